@@ -1,18 +1,79 @@
 from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
 
-from invoicing.models import Invoice, Customer, Supplier
+from invoicing.filters import filter_invoices, search_customers
+from invoicing.models import Invoice, InvoiceBalanceModel, Customer, Supplier
+from invoicing.pagination import EstimatedCountPaginator
+from invoicing.settings import INVOICE_SIDE_CHOICES
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    Model admin for large tables: the changelist counts its rows once, up to
+    `INVOICING_ADMIN_COUNT_LIMIT`, rather than counting the whole table too.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class InvoiceSideFilter(admin.SimpleListFilter):
+    """
+    Filter invoices on their side, with the predicates of the partial per-side
+    indexes.
+    """
+
+    title = _("Side")
+    parameter_name = "side"
+
+    def lookups(self, request, model_admin):
+        return INVOICE_SIDE_CHOICES
+
+    def queryset(self, request, queryset):
+        if self.value() not in dict(INVOICE_SIDE_CHOICES):
+            return queryset
+        return filter_invoices(queryset, side=self.value())
 
 
 @admin.register(Customer)
-class CustomerAdmin(admin.ModelAdmin):
-    pass
+class CustomerAdmin(ScalableModelAdmin):
+    list_display = ("id", "name", "email", "invoice_count", "outstanding_total")
+    list_select_related = ("user",)
+    # Required by the autocomplete of the invoice form, see `get_search_results`.
+    search_fields = ("name", "email")
+    ordering = ("name", "id")
+    raw_id_fields = ("user",)
+    readonly_fields = InvoiceBalanceModel.BALANCE_FIELDS
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_customers(queryset, search_term), False
 
 
 @admin.register(Supplier)
-class SupplierAdmin(admin.ModelAdmin):
-    pass
+class SupplierAdmin(ScalableModelAdmin):
+    list_display = ("id", "__str__", "invoice_count", "outstanding_total")
+    list_select_related = ("user",)
+    ordering = ("id",)
+    raw_id_fields = ("user",)
+    readonly_fields = InvoiceBalanceModel.BALANCE_FIELDS
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
-    pass
+class InvoiceAdmin(ScalableModelAdmin):
+    list_display = ("id", "date", "status", "amount", "customer", "supplier")
+    list_select_related = ("customer", "supplier__user")
+    # Date ranges the date index can seek on. A `date_hierarchy` would list
+    # the distinct years and months of the invoices, scanning the table.
+    list_filter = ("status", InvoiceSideFilter, ("date", admin.DateFieldListFilter))
+    ordering = ("-date", "-id")
+    # Matches the start of the customer name or email, see `get_search_results`.
+    search_fields = ("customer__name",)
+    autocomplete_fields = ("customer",)
+    raw_id_fields = ("supplier",)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_invoices(queryset, search=search_term), False
@@ -0,0 +1,52 @@
+"""
+Time-bucketed invoice analytics.
+
+Every report is a single grouped query: the buckets are computed by the
+database with `Trunc` and the top-N restriction is a subquery of the same
+statement, so the cost does not depend on the number of buckets or groups.
+"""
+
+from django.db.models import Avg, Count, DateField, Sum
+from django.db.models.functions import Trunc
+
+from invoicing.filters import filter_invoices
+from invoicing.models import Invoice
+
+ANALYTICS_BUCKETS = ("day", "week", "month", "quarter")
+ANALYTICS_GROUPS = {
+    "status": "status",
+    "customer": "customer_id",
+    "supplier": "supplier_id",
+}
+
+
+def invoice_analytics(bucket="month", group_by=None, top=None, **filters):
+    """
+    Return the invoice count, total and average amount per `bucket`, and per
+    `group_by` value if given, as dicts ordered by bucket.
+
+    With `top`, only the `top` customers or suppliers having the largest total
+    amount over the filtered invoices are reported.
+    """
+    queryset = filter_invoices(Invoice.objects.order_by(), **filters)
+    columns = ["bucket"]
+    if group_by is not None:
+        column = ANALYTICS_GROUPS[group_by]
+        columns.append(column)
+        if group_by != "status":
+            queryset = queryset.filter(**{f"{column}__isnull": False})
+            if top is not None:
+                ranking = (
+                    queryset.values(column)
+                    .annotate(revenue=Sum("amount"))
+                    .order_by("-revenue", column)
+                    .values(column)[:top]
+                )
+                queryset = queryset.filter(**{f"{column}__in": ranking})
+
+    return (
+        queryset.annotate(bucket=Trunc("date", bucket, output_field=DateField()))
+        .values(*columns)
+        .annotate(count=Count("id"), total=Sum("amount"), average=Avg("amount"))
+        .order_by(*columns)
+    )
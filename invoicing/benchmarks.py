@@ -0,0 +1,373 @@
+"""
+API benchmark suite.
+
+Scenarios are registered with `@scenario(name)` and receive a `Benchmark`,
+whose `measure()` times a callable over several rounds and records latency
+percentiles, throughput and query counts. `run_benchmarks()` seeds the current
+database at each scale with `seed_db` and runs the selected scenarios; results
+are plain JSON-serializable dicts that `compare_results()` diffs against a
+baseline run.
+"""
+
+import asyncio
+import io
+import platform
+import statistics
+import time
+
+import django
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from invoicing import renderers
+from invoicing.cache import get_cache
+from invoicing.db import (
+    SQLITE_DEFAULT_PRAGMAS,
+    SQLITE_TUNED_PRAGMAS,
+    apply_sqlite_pragmas,
+)
+from invoicing.models import Customer, Invoice
+from invoicing.parsers import FastJSONParser
+from invoicing.renderers import FastJSONRenderer
+from invoicing.serializers import InvoiceSerializer
+from invoicing.settings import INVOICING_SQLITE_PRAGMAS
+
+# `seed_db` options of each dataset scale.
+SCALES = {
+    "small": {"users": 50, "suppliers": 5, "days": 90, "invoices_per_day": 100},
+    "medium": {"users": 200, "suppliers": 20, "days": 365, "invoices_per_day": 500},
+    "large": {"users": 500, "suppliers": 50, "days": 365},
+}
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """
+    Register a benchmark scenario under `name`.
+    """
+
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+
+    return decorator
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a non-empty list of numbers.
+    """
+    ordered = sorted(values)
+    rank = max(1, round(percent / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Benchmark:
+    def __init__(self, client, user, repeat=20, warmup=2):
+        self.client = client
+        self.user = user
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results = {}
+
+    def measure(self, name, func, setup=None, repeat=None, batch=1):
+        """
+        Run `func` `warmup` times untimed, then `repeat` timed rounds. `setup`
+        runs before every round, outside of the timings. `batch` is the number
+        of requests a round makes, for the throughput.
+        """
+        repeat = repeat or self.repeat
+        for _ in range(self.warmup):
+            if setup is not None:
+                setup()
+            func()
+
+        timings, queries = [], []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                result = func()
+                timings.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            status_code = getattr(result, "status_code", None)
+            if status_code is not None and status_code >= 400:
+                raise AssertionError(f"{name} failed with status {status_code}.")
+
+        self.results[name] = {
+            "rounds": repeat,
+            "mean_ms": statistics.fmean(timings) * 1000,
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p90_ms": percentile(timings, 90) * 1000,
+            "p99_ms": percentile(timings, 99) * 1000,
+            "max_ms": max(timings) * 1000,
+            "throughput_rps": repeat * batch / sum(timings),
+            "queries": max(queries),
+        }
+        return self.results[name]
+
+
+def clear_cache():
+    get_cache().clear()
+
+
+def measure_get(benchmark, name, url):
+    """
+    Measure a GET request both with a cold and a warm response cache.
+    """
+    benchmark.measure(name, lambda: benchmark.client.get(url), setup=clear_cache)
+    benchmark.measure(f"{name} (cached)", lambda: benchmark.client.get(url))
+
+
+@scenario("invoices")
+def invoices_scenario(benchmark):
+    measure_get(benchmark, "GET /api/invoices/", "/api/invoices/")
+    # A page half way through the dataset, where `OFFSET` scans are slow.
+    page = max(1, Invoice.objects.count() // 20)
+    measure_get(
+        benchmark, "GET /api/invoices/?page=middle", f"/api/invoices/?page={page}"
+    )
+    measure_get(benchmark, "GET /api/invoices/?cursor=", "/api/invoices/?cursor=")
+
+
+@scenario("customers")
+def customers_scenario(benchmark):
+    measure_get(benchmark, "GET /api/customers/", "/api/customers/")
+
+
+@scenario("suppliers")
+def suppliers_scenario(benchmark):
+    measure_get(benchmark, "GET /api/suppliers/", "/api/suppliers/")
+
+
+@scenario("dashboard")
+def dashboard_scenario(benchmark):
+    measure_get(benchmark, "GET /api/dashboard", "/api/dashboard")
+
+
+@scenario("invoice_writes")
+def invoice_writes_scenario(benchmark):
+    customer = Customer.objects.order_by("id").first()
+    data = {
+        "customer": f"http://testserver/api/customers/{customer.pk}/",
+        "amount": "42.00",
+        "status": "pending",
+    }
+    created = []
+
+    def create():
+        response = benchmark.client.post(
+            "/api/invoices/", data, content_type="application/json"
+        )
+        created.append(response.json()["url"])
+        return response
+
+    benchmark.measure("POST /api/invoices/", create)
+
+    def update():
+        return benchmark.client.patch(
+            created[-1],
+            {"amount": "43.00", "status": "paid"},
+            content_type="application/json",
+        )
+
+    benchmark.measure("PATCH /api/invoices/{id}/", update)
+
+
+@scenario("list_serialization")
+def list_serialization_scenario(benchmark, rows=1000):
+    """
+    Render a page of `rows` invoices with hyperlinks, primary keys and a
+    sparse fieldset, without the database and HTTP overheads.
+    """
+    invoices = list(Invoice.objects.order_by("-date", "-id")[:rows])
+    context = {"request": Request(RequestFactory().get("/api/invoices/"))}
+    for label, kwargs in (
+        ("links=urls", {}),
+        ("links=ids", {"links": "ids"}),
+        ("fields=amount,date", {"fields": ["amount", "date"]}),
+    ):
+        benchmark.measure(
+            f"InvoiceSerializer {label} ({len(invoices)} rows)",
+            lambda: InvoiceSerializer(
+                invoices, many=True, context=context, **kwargs
+            ).data,
+        )
+
+
+@scenario("json")
+def json_scenario(benchmark, sizes=(10, 100, 1000)):
+    """
+    Render and parse pages of invoices with DRF's JSON renderer and parser
+    and with the `orjson` backed ones, when it is installed.
+    """
+    invoices = list(Invoice.objects.order_by("-date", "-id")[: max(sizes)])
+    context = {"request": Request(RequestFactory().get("/api/invoices/"))}
+    backend = "orjson" if renderers.orjson else "json"
+    for size in sizes:
+        data = {
+            "next": None,
+            "previous": None,
+            "results": InvoiceSerializer(
+                invoices[:size], many=True, context=context
+            ).data,
+        }
+        content = JSONRenderer().render(data)
+        for label, renderer, parser in (
+            ("DRF", JSONRenderer(), JSONParser()),
+            (f"fast ({backend})", FastJSONRenderer(), FastJSONParser()),
+        ):
+            benchmark.measure(
+                f"render {label} ({size} rows)", lambda: renderer.render(data)
+            )
+            benchmark.measure(
+                f"parse {label} ({size} rows)",
+                lambda: parser.parse(io.BytesIO(content)),
+            )
+
+
+@scenario("async_concurrency")
+def async_concurrency_scenario(benchmark, concurrency=20):
+    """
+    Compare bursts of concurrent requests to the async views with the same
+    number of requests served one after the other, as a WSGI worker thread
+    would. The queries of the async views run one at a time in a single
+    thread, so the burst is not expected to be faster: this measures the
+    overhead of the async path.
+    """
+    async_client = AsyncClient()
+    async_client.force_login(benchmark.user)
+    endpoints = (
+        ("/api/dashboard", "/api/async/dashboard"),
+        ("/api/invoices/?cursor=", "/api/async/invoices/"),
+    )
+    for sync_url, async_url in endpoints:
+
+        def sequence():
+            # The async views are not cached, neither are these requests.
+            for _ in range(concurrency):
+                clear_cache()
+                benchmark.client.get(sync_url)
+
+        benchmark.measure(
+            f"{concurrency}x GET {sync_url} (sequential)", sequence, batch=concurrency
+        )
+
+        async def burst():
+            return await asyncio.gather(
+                *(async_client.get(async_url) for _ in range(concurrency))
+            )
+
+        benchmark.measure(
+            f"{concurrency}x GET {async_url} (concurrent)",
+            async_to_sync(burst),
+            batch=concurrency,
+        )
+
+
+@scenario("write_throughput")
+def write_throughput_scenario(benchmark):
+    """
+    Create invoices one transaction at a time. On SQLite, compare the default
+    pragmas with the tuned ones.
+    """
+    customer = Customer.objects.order_by("id").first()
+
+    def create():
+        return Invoice.objects.create(customer=customer, amount="42.00")
+
+    # Pragmas can not be changed within a transaction.
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        benchmark.measure("Invoice.objects.create()", create)
+        return
+
+    profiles = (("default", SQLITE_DEFAULT_PRAGMAS), ("tuned", SQLITE_TUNED_PRAGMAS))
+    try:
+        for label, pragmas in profiles:
+            apply_sqlite_pragmas(connection, pragmas)
+            benchmark.measure(f"Invoice.objects.create() ({label} pragmas)", create)
+    finally:
+        apply_sqlite_pragmas(
+            connection, {**SQLITE_DEFAULT_PRAGMAS, **INVOICING_SQLITE_PRAGMAS}
+        )
+
+
+def run_benchmarks(scales, scenarios, repeat=20, warmup=2, seed=0, stdout=None):
+    """
+    Seed the current database at each of the `scales`, a mapping of names to
+    `seed_db` options, and run the named `scenarios` against it.
+    """
+    User = get_user_model()
+    results = {}
+    for scale, options in scales.items():
+        call_command("flush", interactive=False, verbosity=0)
+        clear_cache()
+        call_command("seed_db", seed=seed, **options)
+        user = User.objects.get(username="superuser")
+
+        client = Client()
+        client.force_login(user)
+        benchmark = Benchmark(client, user, repeat=repeat, warmup=warmup)
+        for name in scenarios:
+            if stdout is not None:
+                stdout.write(f"Running {name} at {scale} scale...")
+            SCENARIOS[name](benchmark)
+        results[scale] = {
+            "dataset": {"invoices": Invoice.objects.count(), **options},
+            "results": benchmark.results,
+        }
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "scales": results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2, metric="p50_ms"):
+    """
+    Return the `(scale, name, message)` regressions of `current` against
+    `baseline`: a `metric` more than `threshold` (a ratio) slower, or more
+    queries.
+    """
+    regressions = []
+    for scale, data in current["scales"].items():
+        baseline_results = baseline["scales"].get(scale, {}).get("results", {})
+        for name, result in data["results"].items():
+            previous = baseline_results.get(name)
+            if previous is None:
+                continue
+            if result[metric] > previous[metric] * (1 + threshold):
+                change = (result[metric] / previous[metric] - 1) * 100
+                regressions.append(
+                    (
+                        scale,
+                        name,
+                        f"{metric} {previous[metric]:.2f} -> {result[metric]:.2f} "
+                        f"(+{change:.0f}%)",
+                    )
+                )
+            if result["queries"] > previous["queries"]:
+                regressions.append(
+                    (
+                        scale,
+                        name,
+                        f"queries {previous['queries']} -> {result['queries']}",
+                    )
+                )
+    return regressions
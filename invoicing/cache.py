@@ -0,0 +1,177 @@
+"""
+Versioned response caching.
+
+Every cached endpoint depends on a few models, each having a version stored in
+the cache that is bumped whenever one of its rows changes. Cache keys embed the
+versions of the dependencies, so a bump invalidates every dependent entry at
+once. Versions are timestamps, which also provide the `Last-Modified` date and
+make `ETag`s change with the data.
+
+Responses read from a replica are cached apart from those read from the
+primary, and not at all in the `INVOICING_STICKY_SECONDS` following a bump:
+the replica may not have caught up with the write yet, and its stale data
+would otherwise be served under the new version.
+
+The local-memory backend is per process: deployments running several workers
+should point `INVOICING_CACHE_ALIAS` at a shared backend.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from invoicing.routers import read_database
+from invoicing.settings import (
+    INVOICING_CACHE_ALIAS,
+    INVOICING_CACHE_TIMEOUT,
+    INVOICING_STICKY_SECONDS,
+)
+
+
+def get_cache():
+    return caches[INVOICING_CACHE_ALIAS]
+
+
+def _version_key(label):
+    return f"invoicing:version:{label}"
+
+
+def get_versions(labels):
+    """
+    Return the current version of each model label, as nanosecond timestamps.
+    """
+    cache = get_cache()
+    keys = {_version_key(label): label for label in labels}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        # Unknown or evicted versions restart from now, which still differs
+        # from the versions embedded in any key cached before.
+        cache.add(key, time.time_ns(), timeout=None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_versions(*labels):
+    """
+    Invalidate the responses depending on the given model labels.
+
+    The versions are bumped right away, so that later reads in this process
+    miss the cache, and again once the transaction commits, so that entries
+    cached from the pre-commit data by concurrent requests are dropped too.
+    """
+
+    def bump():
+        now = time.time_ns()
+        get_cache().set_many(
+            {_version_key(label): now for label in labels}, timeout=None
+        )
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def _to_cacheable(data):
+    """
+    Copy response data into plain containers. In particular DRF's `Hyperlink`
+    strings pickle their name, which is `str()` of the linked object and may
+    run a query per row.
+    """
+    if isinstance(data, dict):
+        return {key: _to_cacheable(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_to_cacheable(value) for value in data]
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(",")) or (
+            if_none_match.strip() == "*"
+        )
+
+    if_modified_since = parse_http_date_safe(request.headers.get("If-Modified-Since"))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def cached_response(method):
+    """
+    Cache the data of the responses of a view handler.
+
+    Entries are keyed by the absolute URL, the user, the database read and the
+    versions of the view's `cache_dependencies`. Responses carry an `ETag` and `Last-Modified`
+    date, and conditional requests matching them get a `304 Not Modified`.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        request = self.request
+        if request.method not in ("GET", "HEAD"):
+            return method(self, *args, **kwargs)
+
+        versions = get_versions(self.cache_dependencies)
+        database = read_database.get() or DEFAULT_DB_ALIAS
+        key_parts = [
+            request.build_absolute_uri(request.path),
+            sorted(request.query_params.lists()),
+            request.user.pk,
+            database,
+            sorted(versions.items()),
+        ]
+        digest = hashlib.sha256(repr(key_parts).encode()).hexdigest()
+        etag = quote_etag(digest)
+        last_modified = max(versions.values(), default=0) // 10**9
+
+        if _not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = get_cache()
+            key = f"invoicing:response:{digest}"
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = method(self, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                # A replica may still lag behind the last bump.
+                lagging = database != DEFAULT_DB_ALIAS and (
+                    time.time_ns() - max(versions.values(), default=0)
+                    < INVOICING_STICKY_SECONDS * 10**9
+                )
+                if not lagging:
+                    cache.set(
+                        key, _to_cacheable(response.data), INVOICING_CACHE_TIMEOUT
+                    )
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    return wrapper
+
+
+class CachedResponseMixin:
+    """
+    Cache the `list` and `retrieve` responses of a viewset, which must declare
+    the model labels its responses depend on in `cache_dependencies`.
+    """
+
+    cache_dependencies = ()
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,172 @@
+"""
+Invoice change feed.
+
+Invoices are listed in `(updated_at, id)` order, the order of the index on
+these columns, from a token identifying the last change a client received.
+Deleted invoices are kept as tombstones, see `Invoice.delete`, and listed with
+their `deleted_at` date, until `purge_tombstones` deletes them for good after
+`INVOICING_TOMBSTONE_RETENTION` seconds. Each row carries the token to resume
+from, and every response the token to resume after its last row, so that a
+client only reads the changes since its previous sync. Tokens preceding the
+last purged tombstone, see `PurgeWatermark`, are rejected: the client may have
+missed deletions.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from invoicing.exports import iter_chunks
+from invoicing.models import Invoice, PurgeWatermark
+from invoicing.settings import (
+    INVOICING_CHANGES_SAFETY_WINDOW,
+    INVOICING_TOMBSTONE_RETENTION,
+)
+
+CHANGE_COLUMNS = (
+    "id",
+    "updated_at",
+    "deleted_at",
+    "date",
+    "status",
+    "amount",
+    "customer_id",
+    "supplier_id",
+)
+
+# Response header holding the token to resume after the last row.
+CHANGE_TOKEN_HEADER = "Change-Token"
+
+# Above every invoice id: a position `(updated_at, MAX_INVOICE_ID)` is after
+# every change made at `updated_at`.
+MAX_INVOICE_ID = 2**63 - 1
+
+
+def encode_change_token(updated_at, pk):
+    value = f"{updated_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_change_token(token):
+    """
+    Return the `(updated_at, id)` position encoded in `token`, raise a
+    `ValueError` if it is invalid or has expired.
+    """
+    try:
+        value = base64.urlsafe_b64decode(token.encode()).decode()
+        updated_at, pk = value.split("|")
+        updated_at, pk = datetime.fromisoformat(updated_at), int(pk)
+    except (TypeError, UnicodeError, ValueError) as error:
+        raise ValueError(f"Invalid change token: {token!r}.") from error
+    if timezone.is_naive(updated_at):
+        raise ValueError(f"Invalid change token: {token!r}.")
+    watermark = get_purge_watermark()
+    if watermark is not None and (updated_at, pk) < watermark:
+        raise ValueError(f"Expired change token: {token!r}, sync again from the start.")
+    return updated_at, pk
+
+
+def get_purge_watermark():
+    """
+    Return the `(updated_at, id)` position of the last purged tombstone, or
+    `None` if none was purged.
+    """
+    return (
+        PurgeWatermark.objects.values_list("updated_at", "invoice_id")
+        .order_by()
+        .first()
+    )
+
+
+def purge_tombstones():
+    """
+    Delete for good the invoices deleted more than
+    `INVOICING_TOMBSTONE_RETENTION` seconds ago, move the purge watermark past
+    them and return their number.
+    """
+    cutoff = timezone.now() - timedelta(seconds=INVOICING_TOMBSTONE_RETENTION)
+    tombstones = Invoice.all_objects.filter(deleted_at__lt=cutoff)
+    with transaction.atomic():
+        last = (
+            tombstones.order_by("-updated_at", "-id")
+            .values_list("updated_at", "id")
+            .first()
+        )
+        if last is None:
+            return 0
+        deleted, _ = tombstones.hard_delete()
+        watermark = get_purge_watermark()
+        if watermark is None or watermark < last:
+            PurgeWatermark.objects.update_or_create(
+                pk=1, defaults={"updated_at": last[0], "invoice_id": last[1]}
+            )
+    return deleted
+
+
+def get_changes_until():
+    """
+    Return the date up to which the changes are reported, see
+    `INVOICING_CHANGES_SAFETY_WINDOW`.
+    """
+    return timezone.now() - timedelta(seconds=INVOICING_CHANGES_SAFETY_WINDOW)
+
+
+def get_resume_token(until, since=None):
+    """
+    Return the token resuming after the changes reported up to `until`, even
+    when there are none.
+    """
+    position = (until, MAX_INVOICE_ID)
+    if since is not None:
+        position = max(position, since)
+    return encode_change_token(*position)
+
+
+def change_rows(chunk_size, since=None, until=None):
+    """
+    Iterate over the invoices changed after the `(updated_at, id)` position
+    `since`, as tuples of `CHANGE_COLUMNS`, up to `until`, the end of the
+    safety window by default.
+    """
+    if until is None:
+        until = get_changes_until()
+    queryset = Invoice.all_objects.filter(updated_at__lte=until)
+    if since is not None:
+        updated_at, pk = since
+        queryset = queryset.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk)
+        )
+    return (
+        queryset.order_by("updated_at", "id")
+        .values_list(*CHANGE_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _format_row(row):
+    pk, updated_at, deleted_at, date, status, amount, customer_id, supplier_id = row
+    return {
+        "id": pk,
+        "token": encode_change_token(updated_at, pk),
+        "updated_at": updated_at.isoformat(),
+        "deleted": deleted_at is not None,
+        "deleted_at": deleted_at and deleted_at.isoformat(),
+        "date": date.isoformat(),
+        "status": status,
+        "amount": str(amount),
+        "customer_id": customer_id,
+        "supplier_id": supplier_id,
+    }
+
+
+def iter_changes(chunk_size, since=None, until=None):
+    """
+    Render the changes after `since` as newline delimited JSON, yielding one
+    string per chunk of rows.
+    """
+    for chunk in iter_chunks(change_rows(chunk_size, since, until), chunk_size):
+        yield "".join(json.dumps(_format_row(row)) + "\n" for row in chunk)
@@ -0,0 +1,240 @@
+"""
+Columnar invoice snapshots for offline analytics.
+
+Invoices are written with the names of their customer and supplier to a
+directory of files partitioned by month, `month=2025-01/part-<first id>-<last
+id>.<format>`, in Apache Parquet when `pyarrow` is installed and as NumPy
+`.npz` archives of typed columns otherwise. The `.npz` files are written
+without NumPy, which is only needed to read them.
+
+The rows are read in id order with a server-side cursor and written one part
+per chunk and month, so memory use is bounded by the chunk size. The
+`_manifest.json` file lists the parts and the largest id written: later
+snapshots only append the invoices created since. Changes to invoices already
+written are not picked up, a full snapshot rewrites everything: it is written
+to a sibling directory, swapped with the previous snapshot once complete.
+"""
+
+import json
+import os
+import shutil
+import struct
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.db.models import Case, CharField, Value, When
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from invoicing.exports import iter_chunks
+from invoicing.models import Invoice
+from invoicing.rollups import month_of
+from invoicing.settings import INVOICE_EXPORT_CHUNK_SIZE
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MANIFEST_NAME = "_manifest.json"
+
+# Name and type of the snapshot columns. Amounts are stored in cents and, in
+# `.npz` files, missing ids as 0 and missing names as empty strings.
+SNAPSHOT_COLUMNS = (
+    ("id", "int64"),
+    ("date", "timestamp"),
+    ("status", "string"),
+    ("amount_cents", "int64"),
+    ("customer_id", "int64"),
+    ("customer_name", "string"),
+    ("supplier_id", "int64"),
+    ("supplier_name", "string"),
+)
+
+
+def snapshot_rows(min_id=0, using="default"):
+    """
+    Iterate over the invoices with an id above `min_id`, in id order, as
+    tuples of `SNAPSHOT_COLUMNS`.
+    """
+    queryset = (
+        Invoice.objects.using(using)
+        .filter(id__gt=min_id)
+        .annotate(
+            # `Supplier.__str__`, computed by the database.
+            supplier_name=Case(
+                When(
+                    supplier__isnull=False,
+                    then=Concat(
+                        "supplier__user__first_name",
+                        Value(" "),
+                        "supplier__user__last_name",
+                    ),
+                ),
+                output_field=CharField(),
+            ),
+        )
+        .order_by("id")
+        .values_list(
+            "id",
+            "date",
+            "status",
+            "amount",
+            "customer_id",
+            "customer__name",
+            "supplier_id",
+            "supplier_name",
+        )
+    )
+    for row in queryset.iterator(chunk_size=INVOICE_EXPORT_CHUNK_SIZE):
+        pk, date, status, amount, *parties = row
+        yield pk, date, status, int(amount * 100), *parties
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _npy(values, kind):
+    """
+    Encode a column as a NumPy `.npy` file.
+    """
+    if kind == "string":
+        values = ["" if value is None else value for value in values]
+        width = max(1, *map(len, values))
+        descr = f"<U{width}"
+        data = b"".join(
+            value.ljust(width, "\0").encode("utf-32-le") for value in values
+        )
+    else:
+        descr = "<i8"
+        if kind == "timestamp":
+            descr = "<M8[us]"
+            values = [(value - EPOCH) // timedelta(microseconds=1) for value in values]
+        data = struct.pack(f"<{len(values)}q", *(value or 0 for value in values))
+
+    header = repr({"descr": descr, "fortran_order": False, "shape": (len(values),)})
+    # The header follows the 10 bytes of magic, version and header length, is
+    # padded with spaces and ends with a newline at a multiple of 64 bytes.
+    padding = -(10 + len(header) + 1) % 64
+    header = f"{header}{' ' * padding}\n".encode()
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header + data
+
+
+def write_npz(path, columns):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for (name, kind), values in zip(SNAPSHOT_COLUMNS, columns):
+            archive.writestr(f"{name}.npy", _npy(values, kind))
+
+
+def write_parquet(path, columns):
+    types = {
+        "int64": pyarrow.int64(),
+        "timestamp": pyarrow.timestamp("us", tz="UTC"),
+        "string": pyarrow.string(),
+    }
+    table = pyarrow.table(
+        {
+            name: pyarrow.array(values, type=types[kind])
+            for (name, kind), values in zip(SNAPSHOT_COLUMNS, columns)
+        }
+    )
+    pyarrow.parquet.write_table(table, path, compression="zstd")
+
+
+SNAPSHOT_FORMATS = {"parquet": write_parquet, "npz": write_npz}
+
+
+def get_default_format():
+    return "parquet" if pyarrow is not None else "npz"
+
+
+def read_manifest(root):
+    path = Path(root) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def write_manifest(root, manifest):
+    # Replaced atomically, readers never see a partial manifest.
+    path = Path(root) / MANIFEST_NAME
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(manifest, indent=2))
+    os.replace(temporary, path)
+
+
+def snapshot_invoices(
+    root, snapshot_format=None, chunk_size=100000, full=False, using="default"
+):
+    """
+    Write the invoices created since the last snapshot in `root`, or every
+    invoice if `full`, and return the number of written rows.
+    """
+    root = Path(root)
+    if full:
+        # The previous snapshot stays readable until the new one is complete.
+        building = root.with_name(f"{root.name}.building")
+        replaced = root.with_name(f"{root.name}.replaced")
+        for path in (building, replaced):
+            shutil.rmtree(path, ignore_errors=True)
+        count = snapshot_invoices(building, snapshot_format, chunk_size, using=using)
+        if root.exists():
+            os.replace(root, replaced)
+        os.replace(building, root)
+        shutil.rmtree(replaced, ignore_errors=True)
+        return count
+
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(root)
+    snapshot_format = snapshot_format or (
+        manifest["format"] if manifest else get_default_format()
+    )
+    if snapshot_format == "parquet" and pyarrow is None:
+        raise ValueError("Parquet snapshots require pyarrow.")
+    if manifest is not None and manifest["format"] != snapshot_format:
+        raise ValueError(
+            f"The snapshot in {root} is in {manifest['format']}, "
+            "take a full snapshot to change its format."
+        )
+    if manifest is None:
+        manifest = {
+            "format": snapshot_format,
+            "columns": [name for name, _ in SNAPSHOT_COLUMNS],
+            "max_id": 0,
+            "parts": [],
+        }
+
+    # Parts left by an interrupted snapshot would duplicate rows.
+    listed = {part["path"] for part in manifest["parts"]}
+    for path in root.glob("month=*/part-*"):
+        if path.relative_to(root).as_posix() not in listed:
+            path.unlink()
+
+    write = SNAPSHOT_FORMATS[snapshot_format]
+    count = 0
+    for chunk in iter_chunks(snapshot_rows(manifest["max_id"], using), chunk_size):
+        months = defaultdict(list)
+        for row in chunk:
+            months[month_of(row[1])].append(row)
+        for month, rows in sorted(months.items()):
+            name = (
+                f"month={month:%Y-%m}/part-{rows[0][0]}-{rows[-1][0]}.{snapshot_format}"
+            )
+            (root / name).parent.mkdir(exist_ok=True)
+            write(root / name, list(zip(*rows)))
+            manifest["parts"].append(
+                {"path": name, "month": f"{month:%Y-%m}", "rows": len(rows)}
+            )
+        manifest["max_id"] = chunk[-1][0]
+        count += len(chunk)
+        # Written after every chunk, an interrupted snapshot resumes from it.
+        manifest["updated_at"] = timezone.now().isoformat()
+        write_manifest(root, manifest)
+
+    if not count:
+        manifest["updated_at"] = timezone.now().isoformat()
+        write_manifest(root, manifest)
+    return count
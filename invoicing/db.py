@@ -0,0 +1,107 @@
+"""
+Database connection tuning and vendor specific queries.
+
+SQLite connections get the pragmas of `INVOICING_SQLITE_PRAGMAS` applied when
+they are opened, see `invoicing.signals`.
+"""
+
+from django.db import connections
+from django.db.models import F
+
+# What SQLite uses when no pragma is set: rollback journal, fsync on every
+# commit, no memory mapping and immediate "database is locked" errors.
+SQLITE_DEFAULT_PRAGMAS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "mmap_size": 0,
+    "busy_timeout": 0,
+}
+
+# Write-ahead logging lets readers run alongside the writer and, with
+# `synchronous=NORMAL`, commits no longer wait for an fsync; a crash may lose
+# the last transactions but never corrupts the database. Writers wait up to
+# `busy_timeout` milliseconds for the lock instead of failing.
+SQLITE_TUNED_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+
+def apply_sqlite_pragmas(connection, pragmas):
+    """
+    Set the `pragmas` on an open SQLite `connection`.
+    """
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+# Cheap row count estimates, never scanning the table.
+ROW_COUNT_ESTIMATE_QUERIES = {
+    # Kept up to date by `VACUUM`/`ANALYZE` and autovacuum, -1 until the table
+    # is first analyzed.
+    "postgresql": "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+    # The largest rowid is the last entry of the table's B-tree; rows deleted
+    # since do not lower it.
+    "sqlite": "SELECT MAX(_ROWID_) FROM {table}",
+    "mysql": (
+        "SELECT table_rows FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = %s"
+    ),
+}
+
+
+def estimate_row_count(model, using="default"):
+    """
+    Return an estimate of the number of rows of the table of `model`, or
+    `None` when the database can not provide one.
+    """
+    connection = connections[using]
+    query = ROW_COUNT_ESTIMATE_QUERIES.get(connection.vendor)
+    if query is None:
+        return None
+
+    table = model._meta.db_table
+    params = [table]
+    if "{table}" in query:
+        query = query.format(table=connection.ops.quote_name(table))
+        params = []
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def lock_rows(queryset, field):
+    """
+    Return the rows of `queryset`, locked until the end of the current
+    transaction. Without row locks (SQLite), an update takes the write lock of
+    the database: a no-op one, of `field`, is run before the rows are read.
+    """
+    features = connections[queryset.db].features
+    if features.has_select_for_update:
+        of = ("self",) if features.has_select_for_update_of else ()
+        return list(queryset.select_for_update(of=of))
+    queryset.update(**{field: F(field)})
+    return list(queryset)
+
+
+def lock_table_writes(model, using="default"):
+    """
+    Block the writes to the table of `model` until the current transaction
+    ends, waiting for those in progress, so that the rows read afterwards stay
+    current. SQLite has a single writer: a no-op write takes the write lock of
+    the whole database.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"LOCK TABLE {table} IN SHARE MODE")
+        else:
+            pk = connection.ops.quote_name(model._meta.pk.column)
+            cursor.execute(f"UPDATE {table} SET {pk} = {pk} WHERE 1 = 0")
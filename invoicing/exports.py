@@ -0,0 +1,92 @@
+"""
+Constant memory invoice exports.
+
+Rows are read as tuples with `values_list(...).iterator()`, which uses a
+server-side cursor where the database supports it, and are rendered in
+chunks of text so that no model or serializer is instantiated per row.
+"""
+
+import csv
+import io
+import json
+
+from invoicing.filters import filter_invoices
+from invoicing.models import Invoice
+
+EXPORT_COLUMNS = ("id", "date", "status", "amount", "customer_id", "supplier_id")
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_rows(chunk_size, **filters):
+    """
+    Iterate over the filtered invoices as tuples of `EXPORT_COLUMNS`.
+    """
+    queryset = filter_invoices(Invoice.objects.all(), **filters)
+    return (
+        queryset.order_by("date", "id")
+        .values_list(*EXPORT_COLUMNS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def iter_chunks(rows, chunk_size):
+    """
+    Group rows in lists of `chunk_size` rows.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _format_row(row):
+    pk, date, status, amount, customer_id, supplier_id = row
+    return pk, date.isoformat(), status, str(amount), customer_id, supplier_id
+
+
+def iter_csv(rows, chunk_size):
+    """
+    Render rows as CSV, yielding one string per chunk of rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield flush()
+    for chunk in iter_chunks(rows, chunk_size):
+        writer.writerows(map(_format_row, chunk))
+        yield flush()
+
+
+def iter_ndjson(rows, chunk_size):
+    """
+    Render rows as newline delimited JSON, yielding one string per chunk of rows.
+    """
+    for chunk in iter_chunks(rows, chunk_size):
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, _format_row(row)))) + "\n"
+            for row in chunk
+        )
+
+
+def export_invoices(export_format, chunk_size, **filters):
+    """
+    Return an iterator over the text chunks of the export.
+    """
+    rows = export_rows(chunk_size, **filters)
+    if export_format == "csv":
+        return iter_csv(rows, chunk_size)
+    return iter_ndjson(rows, chunk_size)
@@ -0,0 +1,109 @@
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from invoicing.models import Customer, normalize_search_text
+
+# Sorts after any other character, bounds the range of a prefix search.
+MAX_CHAR = chr(0x10FFFF)
+
+
+def search_customers(queryset, search):
+    """
+    Filter a customer queryset on the names or emails starting with `search`,
+    ignoring case and accents.
+
+    The prefix is matched as a range on the normalized columns, which their
+    indexes serve on every database, unlike a `LIKE` pattern.
+    """
+    prefix = normalize_search_text(search)
+    return queryset.filter(
+        Q(name_normalized__gte=prefix, name_normalized__lt=prefix + MAX_CHAR)
+        | Q(email_normalized__gte=prefix, email_normalized__lt=prefix + MAX_CHAR)
+    )
+
+
+def filter_invoices(
+    queryset,
+    date_from=None,
+    date_to=None,
+    status=None,
+    customer=None,
+    supplier=None,
+    side=None,
+    amount_min=None,
+    amount_max=None,
+    search=None,
+):
+    """
+    Filter an invoice queryset, each filter maps onto an indexed column.
+    `date_from` is inclusive and `date_to` exclusive, both amount bounds are
+    inclusive and `search` matches the start of the customer name or email.
+    """
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(date__lt=date_to)
+    if status is not None:
+        queryset = queryset.filter(status=status)
+    if customer is not None:
+        queryset = queryset.filter(customer_id=customer)
+    if supplier is not None:
+        queryset = queryset.filter(supplier_id=supplier)
+    if side is not None:
+        # Matches the predicates of the partial per-side indexes.
+        queryset = queryset.filter(supplier__isnull=side == "customer")
+    if amount_min is not None:
+        queryset = queryset.filter(amount__gte=amount_min)
+    if amount_max is not None:
+        queryset = queryset.filter(amount__lte=amount_max)
+    if search:
+        customers = search_customers(Customer.objects.all(), search)
+        queryset = queryset.filter(customer_id__in=customers.values("id"))
+    return queryset
+
+
+class InvoiceFilterBackend(BaseFilterBackend):
+    """
+    Filter invoices with `filter_invoices` on the query parameters, validated
+    by the view's `filter_serializer_class`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        serializer = view.filter_serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return filter_invoices(queryset, **serializer.validated_data)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": name,
+                "required": False,
+                "in": "query",
+                "description": str(field.help_text or ""),
+                "schema": {"type": "string"},
+            }
+            for name, field in view.filter_serializer_class().fields.items()
+        ]
+
+
+class IndexedOrderingFilter(OrderingFilter):
+    """
+    Order on a single field of the view's `ordering_fields`, each of which must
+    lead an index ending with the primary key, the tie-breaker.
+
+    Other orderings would sort the whole table and are rejected.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        param = request.query_params.get(self.ordering_param)
+        if not param:
+            return self.get_default_ordering(view)
+
+        fields = view.ordering_fields
+        if param.lstrip("-") not in fields:
+            raise ValidationError(
+                {self.ordering_param: [f"Must be one of: {', '.join(fields)}."]}
+            )
+        direction = "-" if param.startswith("-") else ""
+        return (param, f"{direction}pk")
@@ -0,0 +1,176 @@
+"""
+Idempotency keys.
+
+Clients retrying a write send the same `Idempotency-Key` header with every
+attempt. The response to the first attempt is stored with the key, and the
+retries get it back, with an `Idempotent-Replayed: true` header, from a
+single lookup on the unique `(user, key)` index: the view does not run again.
+
+Keys expire after `INVOICING_IDEMPOTENCY_TTL` seconds. Expired keys are
+replaced when reused, and deleted by the `purge_idempotency_keys` job. A first
+attempt that did not complete within `INVOICING_IDEMPOTENCY_LOCK_TIMEOUT`
+seconds is given up, and the next retry runs the request again.
+"""
+
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from invoicing.models import IdempotencyKey
+from invoicing.renderers import FastJSONRenderer
+from invoicing.settings import (
+    INVOICING_IDEMPOTENCY_LOCK_TIMEOUT,
+    INVOICING_IDEMPOTENCY_TTL,
+)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Response headers stored and replayed along with the data.
+REPLAYED_HEADERS = ("Location",)
+
+
+def get_fingerprint(request):
+    """
+    Hash the method, path and data of `request`.
+    """
+    if not hasattr(request, "_idempotency_fingerprint"):
+        digest = hashlib.sha256()
+        digest.update(f"{request.method} {request.path}\n".encode())
+        digest.update(FastJSONRenderer().render(request.data))
+        request._idempotency_fingerprint = digest.hexdigest()
+    return request._idempotency_fingerprint
+
+
+def get_idempotency_record(request, key):
+    """
+    Return the `IdempotencyKey` of the user of `request` and `key`, expired or
+    not, or `None`. Looked up once per request, throttles need it first.
+    """
+    if not hasattr(request, "_idempotency_record"):
+        request._idempotency_record = IdempotencyKey.objects.filter(
+            user=request.user, key=key
+        ).first()
+    return request._idempotency_record
+
+
+def is_replay(request):
+    """
+    Return whether `request` retries a completed request with the same
+    `Idempotency-Key`, and gets its stored response back.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key or not request.user.is_authenticated:
+        return False
+    record = get_idempotency_record(request, key)
+    return (
+        record is not None
+        and record.status_code is not None
+        and record.expires_at > timezone.now()
+        and record.fingerprint == get_fingerprint(request)
+    )
+
+
+def purge_idempotency_keys():
+    """
+    Delete the expired idempotency keys and return their number.
+    """
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def _error(detail, status_code):
+    return Response({"detail": detail}, status=status_code)
+
+
+def idempotent(method):
+    """
+    Store the response of a view handler called with an `Idempotency-Key`
+    header and replay it to the later calls with the same key.
+
+    Responses are only stored when the handler succeeds: after an error, the
+    key can be used again. A key reused for another request is rejected with a
+    `422`, and a retry arriving while the first attempt runs with a `409`,
+    until the first attempt is given up.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return _error(
+                f"The {IDEMPOTENCY_HEADER} header is too long.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = get_fingerprint(request)
+        now = timezone.now()
+        record = get_idempotency_record(request, key)
+        if record is not None and record.expires_at <= now:
+            record.delete()
+            record = None
+
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return _error(
+                    f"The {IDEMPOTENCY_HEADER} was used for another request.",
+                    status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is not None:
+                response = Response(
+                    record.response, status=record.status_code, headers=record.headers
+                )
+                response[REPLAYED_HEADER] = "true"
+                return response
+
+            # The first attempt is given up after a while, e.g. when its
+            # process crashed; only one retry takes it over.
+            given_up = now - timedelta(seconds=INVOICING_IDEMPOTENCY_LOCK_TIMEOUT)
+            if record.created_at > given_up or not IdempotencyKey.objects.filter(
+                pk=record.pk, status_code__isnull=True, created_at=record.created_at
+            ).update(created_at=now):
+                return _error(
+                    f"A request with this {IDEMPOTENCY_HEADER} is in progress.",
+                    status.HTTP_409_CONFLICT,
+                )
+            record.created_at = now
+        else:
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user,
+                        key=key,
+                        fingerprint=fingerprint,
+                        expires_at=now + timedelta(seconds=INVOICING_IDEMPOTENCY_TTL),
+                    )
+            except IntegrityError:
+                # A concurrent request with the same key got there first.
+                return _error(
+                    f"A request with this {IDEMPOTENCY_HEADER} is in progress.",
+                    status.HTTP_409_CONFLICT,
+                )
+
+        try:
+            response = method(self, request, *args, **kwargs)
+        except BaseException:
+            record.delete()
+            raise
+        if response.status_code >= 400:
+            record.delete()
+            return response
+
+        record.status_code = response.status_code
+        record.response = response.data
+        record.headers = {
+            name: response[name] for name in REPLAYED_HEADERS if name in response
+        }
+        record.save(update_fields=["status_code", "response", "headers"])
+        return response
+
+    return wrapper
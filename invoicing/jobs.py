@@ -0,0 +1,276 @@
+"""
+Database backed job queue.
+
+Handlers are registered with `@job_handler(name)` and jobs are enqueued with
+`enqueue()`, or `POST /api/jobs/`. `manage.py run_worker` claims queued jobs
+with a conditional `UPDATE`, so that several workers share the queue without
+locking it, and runs them with `run_job()` in a process pool. Running jobs
+update their heartbeat, jobs whose heartbeat stopped are claimed again. Failed
+jobs are retried with an exponential backoff until they reach their
+`max_attempts`.
+"""
+
+import logging
+import tempfile
+import threading
+import traceback
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from invoicing.changes import purge_tombstones
+from invoicing.exports import export_invoices
+from invoicing.filters import filter_invoices
+from invoicing.idempotency import purge_idempotency_keys
+from invoicing.models import Customer, Invoice, Job, Supplier
+from invoicing.rollups import rebuild_monthly_rollups, reconcile_balances
+from invoicing.serializers.invoicing_serializers import InvoiceExportSerializer
+from invoicing.serializers.job_serializers import (
+    ReconcileBalancesJobSerializer,
+    SeedDbJobSerializer,
+)
+from invoicing.settings import (
+    INVOICE_EXPORT_CHUNK_SIZE,
+    INVOICING_EXPORT_ROOT,
+    INVOICING_JOB_HEARTBEAT_INTERVAL,
+    INVOICING_JOB_RETRY_DELAY,
+    INVOICING_JOB_TIMEOUT,
+)
+from invoicing.thumbnails import generate_thumbnails, is_local_image, prune_thumbnails
+
+logger = logging.getLogger("invoicing.jobs")
+
+# `serializer_class` validates the parameters of the job, which the handler
+# receives as keyword arguments. Only staff users may enqueue `admin_only` jobs.
+JobHandler = namedtuple("JobHandler", ["func", "serializer_class", "admin_only"])
+
+JOB_HANDLERS = {}
+
+
+def job_handler(name, serializer_class=None, admin_only=False):
+    """
+    Register the decorated function as the handler of the `name` jobs, called
+    with the job and its parameters and returning a JSON-serializable result.
+    """
+
+    def decorator(func):
+        JOB_HANDLERS[name] = JobHandler(func, serializer_class, admin_only)
+        return func
+
+    return decorator
+
+
+def enqueue(name, params=None, user=None, **kwargs):
+    """
+    Queue a `name` job and return it.
+    """
+    return Job.objects.create(name=name, params=params or {}, user=user, **kwargs)
+
+
+def claim_job(worker):
+    """
+    Mark the next job due to run as run by `worker` and return its id, or
+    `None` when there is none.
+    """
+    now = timezone.now()
+    claimable = Q(status="queued", run_after__lte=now) | Q(
+        status="running",
+        heartbeat_at__lt=now - timedelta(seconds=INVOICING_JOB_TIMEOUT),
+    )
+    candidates = (
+        Job.objects.filter(claimable)
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:10]
+    )
+    for pk in candidates:
+        # Another worker may have claimed the job since it was selected.
+        claimed = Job.objects.filter(claimable, pk=pk).update(
+            status="running",
+            worker=worker,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return pk
+    return None
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Update the `heartbeat_at` of the running `job` from a thread, every
+    `INVOICING_JOB_HEARTBEAT_INTERVAL` seconds, until the block exits.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(INVOICING_JOB_HEARTBEAT_INTERVAL):
+                # Not once another worker claimed the job.
+                Job.objects.filter(
+                    pk=job.pk, status="running", worker=job.worker
+                ).update(heartbeat_at=timezone.now())
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f"job-{job.pk}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def finish_job(pk, worker, status, **updates):
+    """
+    Update the job `pk` run by `worker` to `status` and return it, or return
+    the status the job has since another worker claimed it.
+    """
+    # Not once another worker claimed the job, whose run it would overwrite.
+    updated = Job.objects.filter(pk=pk, status="running", worker=worker).update(
+        status=status, **updates
+    )
+    if updated:
+        return status
+    logger.warning("Job #%s was claimed by another worker.", pk)
+    return Job.objects.values_list("status", flat=True).get(pk=pk)
+
+
+def fail_job(pk, error, worker):
+    """
+    Queue the job `pk` run by `worker` again, after a delay, or mark it failed
+    once it reached its `max_attempts`. Return its new status.
+    """
+    job = Job.objects.get(pk=pk)
+    now = timezone.now()
+    if job.attempts < job.max_attempts:
+        status = "queued"
+        delay = INVOICING_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        updates = {"run_after": now + timedelta(seconds=delay)}
+    else:
+        status = "failed"
+        updates = {"finished_at": now}
+    return finish_job(pk, worker, status, error=error, **updates)
+
+
+def run_job(pk):
+    """
+    Run the claimed job `pk` and return its new status.
+    """
+    job = Job.objects.get(pk=pk)
+    try:
+        handler = JOB_HANDLERS[job.name]
+        params = job.params
+        if handler.serializer_class is not None:
+            serializer = handler.serializer_class(data=params)
+            serializer.is_valid(raise_exception=True)
+            params = serializer.validated_data
+        with heartbeat(job):
+            result = handler.func(job, **params)
+    except Exception:
+        logger.exception("Job %s #%s failed.", job.name, job.pk)
+        return fail_job(pk, traceback.format_exc(), job.worker)
+
+    return finish_job(
+        pk,
+        job.worker,
+        "succeeded",
+        result=result,
+        error="",
+        finished_at=timezone.now(),
+    )
+
+
+def get_export_storage():
+    return FileSystemStorage(location=INVOICING_EXPORT_ROOT)
+
+
+@job_handler("export", InvoiceExportSerializer)
+def export_job(job, export_format, **filters):
+    """
+    Write the invoices matching the filters to a file of the private export
+    storage, downloaded from `/api/jobs/<id>/download/` by the user who
+    enqueued the job, or staff.
+    """
+    total = filter_invoices(Invoice.objects.all(), **filters).count()
+    job.report_progress(0, total)
+
+    lines = 0
+    with tempfile.TemporaryFile() as output:
+        chunks = export_invoices(export_format, INVOICE_EXPORT_CHUNK_SIZE, **filters)
+        for chunk in chunks:
+            output.write(chunk.encode())
+            # Rows are rendered one per line, a CSV header included.
+            lines += chunk.count("\n")
+            job.report_progress(min(lines, total))
+        name = get_export_storage().save(
+            f"invoices-{job.pk}.{export_format}", File(output)
+        )
+
+    url = reverse("job-download", kwargs={"pk": job.pk})
+    return {"rows": total, "file": name, "url": url}
+
+
+@job_handler("rebuild_rollups", admin_only=True)
+def rebuild_rollups_job(job):
+    return {"rows": rebuild_monthly_rollups()}
+
+
+@job_handler("reconcile_balances", ReconcileBalancesJobSerializer, admin_only=True)
+def reconcile_balances_job(job, fix=True):
+    drift = reconcile_balances(fix=fix)
+    return {model._meta.model_name: count for model, count in drift.items()}
+
+
+@job_handler("generate_thumbnails", admin_only=True)
+def generate_thumbnails_job(job):
+    """
+    Generate the missing thumbnails, of images uploaded before thumbnails were
+    introduced or evicted since.
+    """
+    instances = [
+        instance
+        for model in (Customer, Supplier)
+        for instance in model.objects.filter(image_digest="")
+        .exclude(image="")
+        .exclude(image__isnull=True)
+        .only("pk", "image")
+        if is_local_image(instance.image)
+    ]
+    job.report_progress(0, len(instances))
+    generated = 0
+    for done, instance in enumerate(instances, 1):
+        generated += generate_thumbnails(instance)
+        job.report_progress(done)
+    prune_thumbnails()
+    return {"images": generated}
+
+
+@job_handler("seed_db", SeedDbJobSerializer, admin_only=True)
+def seed_db_job(job, **options):
+    call_command("seed_db", **options)
+    return {
+        "customers": Customer.objects.count(),
+        "suppliers": Supplier.objects.count(),
+        "invoices": Invoice.objects.count(),
+    }
+
+
+@job_handler("purge_idempotency_keys", admin_only=True)
+def purge_idempotency_keys_job(job):
+    return {"deleted": purge_idempotency_keys()}
+
+
+@job_handler("purge_tombstones", admin_only=True)
+def purge_tombstones_job(job):
+    return {"deleted": purge_tombstones()}
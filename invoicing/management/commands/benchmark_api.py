@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from invoicing.benchmarks import SCALES, SCENARIOS, compare_results, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = """
+    Benchmark the API against seeded test databases and compare the results
+    with a baseline run.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            dest="scales",
+            action="append",
+            choices=list(SCALES),
+            help="Dataset scale, can be repeated. Defaults to small.",
+        )
+        parser.add_argument(
+            "--scenario",
+            dest="scenarios",
+            action="append",
+            choices=list(SCENARIOS),
+            help="Scenario to run, can be repeated. Defaults to all of them.",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="File to write the JSON results to.")
+        parser.add_argument("--baseline", help="JSON results to compare against.")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Tolerated slowdown against the baseline, as a ratio.",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the test database between runs.",
+        )
+
+    def handle(self, *args, **options):
+        scales = {name: SCALES[name] for name in options["scales"] or ["small"]}
+        scenarios = options["scenarios"] or list(SCENARIOS)
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        # Never seed the development database, run against a test database.
+        # SQLite test databases are in memory unless named, which would hide
+        # the cost of the disk writes.
+        test_settings = connection.settings_dict.setdefault("TEST", {})
+        if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+            test_settings["NAME"] = os.path.join(
+                tempfile.gettempdir(), "invoicing_benchmark.sqlite3"
+            )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options["keepdb"]
+        )
+        try:
+            results = run_benchmarks(
+                scales,
+                scenarios,
+                repeat=options["repeat"],
+                warmup=options["warmup"],
+                seed=options["seed"],
+                stdout=self.stdout,
+            )
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        self.write_summary(results)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+
+        if baseline is not None:
+            regressions = compare_results(baseline, results, options["threshold"])
+            for scale, name, message in regressions:
+                self.stderr.write(f"[{scale}] {name}: {message}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) found.")
+            self.stdout.write(self.style.SUCCESS("No regression found."))
+
+    def write_summary(self, results):
+        for scale, data in results["scales"].items():
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"{scale} ({data['dataset']['invoices']} invoices)"
+                )
+            )
+            for name, result in data["results"].items():
+                self.stdout.write(
+                    f"  {name:<40} p50 {result['p50_ms']:8.2f}ms"
+                    f"  p90 {result['p90_ms']:8.2f}ms"
+                    f"  p99 {result['p99_ms']:8.2f}ms"
+                    f"  {result['throughput_rps']:8.1f} req/s"
+                    f"  {result['queries']:3d} queries"
+                )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.exports import EXPORT_FORMATS, export_invoices
+from invoicing.serializers import InvoiceExportSerializer
+from invoicing.settings import INVOICE_EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = """
+    Export invoices as CSV or NDJSON, in constant memory.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            dest="export_format",
+            choices=list(EXPORT_FORMATS),
+            default="csv",
+        )
+        parser.add_argument(
+            "--output", help="File to write the export to, defaults to stdout."
+        )
+        parser.add_argument("--date-from", help="Inclusive ISO 8601 date(time).")
+        parser.add_argument("--date-to", help="Exclusive ISO 8601 date(time).")
+        parser.add_argument("--status")
+        parser.add_argument("--customer", type=int, help="Customer id.")
+        parser.add_argument("--supplier", type=int, help="Supplier id.")
+        parser.add_argument("--chunk-size", type=int, default=INVOICE_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        serializer = InvoiceExportSerializer(
+            data={
+                name: options[name]
+                for name in InvoiceExportSerializer().fields
+                if options.get(name) is not None
+            }
+        )
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        filters = dict(serializer.validated_data)
+        export_format = filters.pop("export_format")
+
+        chunks = export_invoices(export_format, options["chunk_size"], **filters)
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoicing.changes import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = """
+    Delete for good the invoices deleted more than
+    INVOICING_TOMBSTONE_RETENTION seconds ago. Until then, their tombstones are
+    reported by the change feed and still protect their customer and supplier
+    from deletion.
+    """
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = purge_tombstones()
+        end = time.time()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Purged {count} deleted invoices in {end - start:.2f}s."
+            )
+        )
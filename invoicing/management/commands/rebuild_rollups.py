@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoicing.rollups import rebuild_monthly_rollups
+
+
+class Command(BaseCommand):
+    help = """
+    Recompute the pre-aggregated invoice tables from the invoice table.
+    """
+
+    def handle(self, *args, **options):
+        start = time.time()
+        count = rebuild_monthly_rollups()
+        end = time.time()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {count} monthly rollup rows in {end - start:.2f}s."
+            )
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoicing.rollups import reconcile_balances
+
+
+class Command(BaseCommand):
+    help = """
+    Recompute the invoice balances of the customers and suppliers and report
+    the rows that drifted.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the drift, do not correct it.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        drift = reconcile_balances(fix=not options["dry_run"])
+        end = time.time()
+
+        action = "found" if options["dry_run"] else "corrected"
+        for model, count in drift.items():
+            name = str(model._meta.verbose_name_plural).lower()
+            message = f"{count} drifted {name} {action}."
+            style = self.style.WARNING if count else self.style.SUCCESS
+            self.stdout.write(style(message))
+        self.stdout.write(f"Reconciled balances in {end - start:.2f}s.")
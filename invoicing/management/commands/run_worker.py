@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from invoicing.jobs import claim_job, fail_job, run_job
+from invoicing.settings import INVOICING_JOB_POLL_INTERVAL
+
+
+class Command(BaseCommand):
+    help = """
+    Run the queued background jobs, see `invoicing.jobs`. Several workers,
+    on one or more hosts, can share the queue.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="Jobs run at the same time, 0 to run them in this process.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once the queue is empty rather than wait for new jobs.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=INVOICING_JOB_POLL_INTERVAL,
+            help="Seconds to wait for new jobs when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.burst = options["burst"]
+        self.poll_interval = options["poll_interval"]
+        try:
+            if options["processes"] > 0:
+                self.run_pool(options["processes"])
+            else:
+                self.run_inline()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
+
+    def run_inline(self):
+        while True:
+            pk = claim_job(self.worker)
+            if pk is None:
+                if self.burst:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            self.report(pk, run_job(pk))
+
+    def create_pool(self, processes):
+        # Forked processes would share the database connections of this one,
+        # spawned ones set Django up and open their own.
+        connections.close_all()
+        return ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        )
+
+    def run_pool(self, processes):
+        pool = self.create_pool(processes)
+        running = {}
+        try:
+            while True:
+                while len(running) < processes:
+                    pk = claim_job(self.worker)
+                    if pk is None:
+                        break
+                    running[pool.submit(run_job, pk)] = pk
+
+                if not running:
+                    if self.burst:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(
+                    running, timeout=self.poll_interval, return_when=FIRST_COMPLETED
+                )
+                broken = any(
+                    isinstance(future.exception(), BrokenProcessPool) for future in done
+                )
+                if broken:
+                    # A process died, e.g. killed for its memory use, and took
+                    # down the pool: every job it was running failed.
+                    done, _ = wait(running)
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        error = "".join(traceback.format_exception(exc))
+                        status = fail_job(pk, error, self.worker)
+                    self.report(pk, status)
+                if broken:
+                    pool.shutdown(wait=False)
+                    pool = self.create_pool(processes)
+        finally:
+            pool.shutdown()
+
+    def report(self, pk, status):
+        style = self.style.SUCCESS if status == "succeeded" else self.style.WARNING
+        self.stdout.write(style(f"Job #{pk} {status}."))
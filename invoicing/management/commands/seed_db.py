@@ -1,27 +1,82 @@
 import time
-import threading
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import islice
 import logging
 import random
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import Group, Permission
 from django.contrib.auth import get_user_model
-from django.db.utils import IntegrityError
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
 
 from faker import Faker
 
+from invoicing.cache import bump_versions
 from invoicing.models import Customer, Invoice, Supplier
+from invoicing.rollups import rebuild_monthly_rollups, reconcile_balances
 
 User = get_user_model()
 
+# Last day of invoices of the seeded datasets, which must not depend on the
+# day they are generated.
+SEED_END_DATE = date(2025, 12, 31)
+
 
 class Command(BaseCommand):
     help = """
     Seed the database with demo data.
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users", type=int, default=500, help="Number of customer users."
+        )
+        parser.add_argument(
+            "--suppliers", type=int, default=50, help="Number of supplier users."
+        )
+        parser.add_argument(
+            "--admins", type=int, default=5, help="Number of admin users."
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Number of days of invoices."
+        )
+        parser.add_argument(
+            "--end-date",
+            type=date.fromisoformat,
+            help=(
+                "Last day of invoices, as YYYY-MM-DD. Defaults to today, or to "
+                f"{SEED_END_DATE} with --seed."
+            ),
+        )
+        parser.add_argument(
+            "--invoices-per-day",
+            type=int,
+            help="Defaults to 1000 invoices per customer and supplier over all days.",
+        )
+        parser.add_argument("--seed", type=int, help="Seed for reproducible datasets.")
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="Rows per INSERT query."
+        )
+
     def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1.")
+        for name in ("users", "suppliers", "admins", "invoices_per_day"):
+            if (options[name] or 0) < 0:
+                raise CommandError(f"--{name.replace('_', '-')} must not be negative.")
+        end_date = options["end_date"]
+        if end_date is None:
+            end_date = date.today() if options["seed"] is None else SEED_END_DATE
+
+        self.batch_size = options["batch_size"]
+        self.random = random.Random(options["seed"])
+        self.fake = Faker()
+        if options["seed"] is not None:
+            self.fake.seed_instance(options["seed"])
+
         # Create the group 'ADMIN' if it does not exist
         admins_group, admins_created = Group.objects.get_or_create(name="ADMIN")
 
@@ -61,10 +116,7 @@ class Command(BaseCommand):
             )
             logging.info("superuser was created successfully!")
 
-        fake = Faker()
-        user_count = 500
-        firstnames = [fake.first_name() for _ in range(user_count)]
-        lastnames = [fake.last_name() for _ in range(user_count)]
+        start = time.time()
         email_providers = [
             ("gmail.com", 100),
             ("outlook.com", 50),
@@ -75,133 +127,159 @@ class Command(BaseCommand):
         email_suffixes = [
             suffix for suffix, weight in email_providers for _ in range(weight)
         ]
+        existing_usernames = set(User.objects.values_list("username", flat=True))
 
-        # Create customer users
-        def create_users(start, end):
-            for i in range(start, end):
-                try:
-                    email_suffix = random.choice(email_suffixes)
-                    username = (
-                        f"{firstnames[i]}.{lastnames[i].replace(' ', '')}".lower()
-                    )
-                    user = User.objects.create_user(
-                        username=username,
-                        email=f"{username}@{email_suffix}",
-                        first_name=firstnames[i],
-                        last_name=lastnames[i],
-                        password="user_pass",
-                    )
-                    user.groups.add(customers_group)
-                    logging.warning(
-                        f"User {i + 1} ({firstnames[i]} {lastnames[i]}) was created successfully!"
-                    )
-                except IntegrityError:
-                    logging.error(
-                        f"User {i + 1} ({firstnames[i]} {lastnames[i]}) was not created!"
-                    )
-
-        threads = []
-        num_threads = 8
-        chunk_size = user_count // num_threads
-
-        for i in range(num_threads):
-            start = i * chunk_size
-            end = (i + 1) * chunk_size if i != num_threads - 1 else user_count
-            thread = threading.Thread(target=create_users, args=(start, end))
-            thread.start()
-            threads.append(thread)
-
-        # Wait for all threads to finish
-        for thread in threads:
-            thread.join()
-
-        # Create supplier users
-        supplier_count = 50
-        firstnames = [fake.unique.first_name() for _ in range(supplier_count)]
-        lastnames = [fake.unique.last_name() for _ in range(supplier_count)]
-        for i in range(supplier_count):
-            username = f"{firstnames[i]}.{lastnames[i].replace(' ', '')}".lower()
-            email_suffix = random.choice(email_suffixes)
-            user = User.objects.create_user(
-                username=username,
-                email=f"{username}@{email_suffix}",
-                first_name=firstnames[i],
-                last_name=lastnames[i],
-                password="user_pass",
-            )
-            user.groups.add(suppliers_group)
-            logging.warning(
-                f"User {i + 1} ({firstnames[i]} {lastnames[i]}) was created successfully!"
-            )
+        # Hashing a password is deliberately slow, hash each one only once.
+        user_password = make_password("user_pass")
+        admin_password = make_password("admin_pass")
 
-        # Create system admins
-        admin_count = 5
-        firstnames = [fake.unique.first_name() for _ in range(admin_count)]
-        lastnames = [fake.unique.last_name() for _ in range(admin_count)]
-        for i in range(admin_count):
-            username = f"{firstnames[i]}.{lastnames[i].replace(' ', '')}".lower()
-            user = User.objects.create_user(
-                username=username,
-                email=f"{username}@ocg.com",
-                first_name=firstnames[i],
-                last_name=lastnames[i],
-                password="admin_pass",
+        customer_users = self.create_users(
+            options["users"],
+            customers_group,
+            user_password,
+            lambda: self.random.choice(email_suffixes),
+            existing_usernames,
+        )
+        supplier_users = self.create_users(
+            options["suppliers"],
+            suppliers_group,
+            user_password,
+            lambda: self.random.choice(email_suffixes),
+            existing_usernames,
+        )
+        self.create_users(
+            options["admins"],
+            admins_group,
+            admin_password,
+            lambda: "ocg.com",
+            existing_usernames,
+        )
+
+        # Create customers and suppliers
+        Customer.objects.bulk_create(
+            (self.build_customer(user) for user in customer_users),
+            batch_size=self.batch_size,
+        )
+        Supplier.objects.bulk_create(
+            (
+                Supplier(user=user, image=self.get_image_url(user))
+                for user in supplier_users
+            ),
+            batch_size=self.batch_size,
+        )
+        end = time.time()
+        logging.warning(
+            f"{len(customer_users)} customers and {len(supplier_users)} suppliers "
+            f"were created in {end - start:.2f}s"
+        )
+
+        customer_ids = list(Customer.objects.values_list("id", flat=True))
+        supplier_ids = list(Supplier.objects.values_list("id", flat=True))
+        days_count = options["days"]
+        invoices_per_day = options["invoices_per_day"]
+        if invoices_per_day is None:
+            invoices_per_day = (
+                (len(customer_ids) + len(supplier_ids)) * 1000 // days_count
             )
-            user.groups.add(admins_group)
-            logging.warning(
-                f"Admin {i + 1} ({firstnames[i]} {lastnames[i]}) was created successfully!"
+        if invoices_per_day and not (customer_ids or supplier_ids):
+            raise CommandError(
+                "There are no customers or suppliers to invoice, "
+                "pass --users or --suppliers."
             )
 
-        # Create customers
-        for user in User.objects.filter(groups=customers_group):
-            full_name = f"{user.first_name} {user.last_name}"
-            customer = Customer.objects.create(
-                user=user,
-                name=full_name,
-                image=f"https://robohash.org/{full_name.lower().replace(' ', '')}",
-            )
-            logging.warning(f"Customer ({full_name}) was created successfully!")
-
-        # Create suppliers
-        for user in User.objects.filter(groups=suppliers_group):
-            full_name = f"{user.first_name} {user.last_name}"
-            Supplier.objects.create(
-                user=user,
-                image=f"https://robohash.org/{full_name.lower().replace(' ', '')}",
+        start = time.time()
+        invoices = self.generate_invoices(
+            customer_ids, supplier_ids, end_date, days_count, invoices_per_day
+        )
+        count = 0
+        with transaction.atomic():
+            while batch := list(islice(invoices, self.batch_size)):
+                Invoice.objects.bulk_create(batch)
+                count += len(batch)
+        end = time.time()
+        logging.warning(f"Bulk insert of {count} invoices took: {end - start}")
+
+        # `bulk_create` bypasses `Invoice.save` and the model signals, rebuild
+        # the aggregated tables and invalidate the cached responses.
+        rebuild_monthly_rollups()
+        reconcile_balances()
+        bump_versions("invoicing.customer", "invoicing.supplier", "invoicing.invoice")
+
+    def create_users(self, count, group, password, email_suffix, existing_usernames):
+        """
+        Bulk create `count` users with unique usernames in `group`.
+        """
+        users = []
+        while len(users) < count:
+            first_name, last_name = self.fake.first_name(), self.fake.last_name()
+            username = f"{first_name}.{last_name.replace(' ', '')}".lower()
+            if username in existing_usernames:
+                continue
+            existing_usernames.add(username)
+            users.append(
+                User(
+                    username=username,
+                    email=f"{username}@{email_suffix()}",
+                    first_name=first_name,
+                    last_name=last_name,
+                    password=password,
+                )
             )
-            logging.warning(f"Supplier ({full_name}) was created successfully!")
-
-        customers = Customer.objects.all()
-        suppliers = Supplier.objects.all()
-        count_customers = Customer.objects.all().count()
-        count_suppliers = Supplier.objects.all().count()
-        days_count = 365  # Generate 1 year of data
-        now = datetime.now()
-        status_choices = [
-            *("paid " * 10).strip().split(" "),
-            *("pending " * 3).strip().split(" "),
-        ]
-        invoices = []
+
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        User.groups.through.objects.bulk_create(
+            (User.groups.through(user_id=user.pk, group_id=group.pk) for user in users),
+            batch_size=self.batch_size,
+        )
+        return users
+
+    def get_full_name(self, user):
+        return f"{user.first_name} {user.last_name}"
+
+    def get_image_url(self, user):
+        full_name = self.get_full_name(user)
+        return f"https://robohash.org/{full_name.lower().replace(' ', '')}"
+
+    def build_customer(self, user):
+        customer = Customer(
+            user=user,
+            name=self.get_full_name(user),
+            email=user.email,
+            image=self.get_image_url(user),
+        )
+        # `bulk_create` bypasses `Customer.save`.
+        customer.normalize_fields()
+        return customer
+
+    def generate_invoices(
+        self, customer_ids, supplier_ids, end_date, days_count, per_day
+    ):
+        """
+        Lazily generate the invoices, one day at a time, going back from
+        `end_date` but not from later than now.
+        """
+        rng = self.random
+        end = datetime.combine(
+            end_date + timedelta(days=1),
+            datetime.min.time(),
+            tzinfo=timezone.get_current_timezone(),
+        )
+        end = min(end, timezone.now())
+        status_choices = ["paid"] * 10 + ["pending"] * 3
         for days in range(days_count):
-            today = now - timedelta(days=days)
-            for _ in range((count_customers + count_suppliers) * 1000 // days_count):
-                customer, supplier = None, None
-                if random.random() < 0.97:
-                    customer = random.choice(customers)
-                    amount = random.random() * 95 + 5
+            today = end - timedelta(days=days)
+            for _ in range(per_day):
+                customer_id, supplier_id = None, None
+                if customer_ids and (rng.random() < 0.97 or not supplier_ids):
+                    customer_id = rng.choice(customer_ids)
+                    cents = rng.randrange(500, 10000)
                 else:
-                    supplier = random.choice(suppliers)
-                    amount = random.random() * 1900 + 100
-                invoice = Invoice(
-                    customer=customer,
-                    supplier=supplier,
-                    amount=amount,
-                    date=today,
-                    status=random.choice(status_choices),
+                    supplier_id = rng.choice(supplier_ids)
+                    cents = rng.randrange(10000, 200000)
+                yield Invoice(
+                    customer_id=customer_id,
+                    supplier_id=supplier_id,
+                    amount=Decimal(cents).scaleb(-2),
+                    date=today - timedelta(seconds=rng.randrange(86400)),
+                    status=rng.choice(status_choices),
                 )
-                invoices.append(invoice)
-
-        start = time.time()
-        Invoice.objects.bulk_create(invoices, batch_size=2500)
-        end = time.time()
-        logging.warning(f"Bulk insert took: {end - start}")
@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from invoicing.columnar import SNAPSHOT_FORMATS, snapshot_invoices
+from invoicing.settings import INVOICING_REPLICA_ALIAS
+
+
+class Command(BaseCommand):
+    help = """
+    Write the invoices created since the last snapshot, with the names of
+    their customer and supplier, to a directory of columnar files partitioned
+    by month, see `invoicing.columnar`.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Directory of the snapshot.")
+        parser.add_argument(
+            "--format",
+            dest="snapshot_format",
+            choices=list(SNAPSHOT_FORMATS),
+            help="Parquet when pyarrow is installed, npz otherwise.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100000,
+            help="Maximum number of rows per file.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rewrite every invoice rather than append the new ones.",
+        )
+        parser.add_argument(
+            "--database",
+            default=INVOICING_REPLICA_ALIAS or "default",
+            help="Database to read from, the replica when there is one.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.time()
+        try:
+            count = snapshot_invoices(
+                options["output"],
+                snapshot_format=options["snapshot_format"],
+                chunk_size=options["chunk_size"],
+                full=options["full"],
+                using=options["database"],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        end = time.time()
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {count} invoices in {end - start:.2f}s.")
+        )
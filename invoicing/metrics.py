@@ -0,0 +1,113 @@
+"""
+Per-view request metrics, rendered in the Prometheus text exposition format.
+
+Metrics are kept in memory and per process: with several workers, each one
+exposes its own figures and the scraper sums them up.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets, in seconds.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    Request duration, database time and query count histograms, labelled by
+    view and method, and a request counter labelled by status code.
+    """
+
+    histograms = (
+        (
+            "invoicing_request_duration_seconds",
+            "Time spent handling requests.",
+            DURATION_BUCKETS,
+        ),
+        (
+            "invoicing_request_db_duration_seconds",
+            "Time spent in database queries per request.",
+            DURATION_BUCKETS,
+        ),
+        (
+            "invoicing_request_queries",
+            "Number of database queries per request.",
+            QUERY_BUCKETS,
+        ),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.values = {name: {} for name, _, _ in self.histograms}
+            self.requests = {}
+
+    def record(self, view, method, status_code, duration, db_duration, queries):
+        labels = (view, method)
+        observations = zip(self.histograms, (duration, db_duration, queries))
+        with self.lock:
+            for (name, _, buckets), value in observations:
+                histogram = self.values[name].get(labels)
+                if histogram is None:
+                    histogram = self.values[name][labels] = Histogram(buckets)
+                histogram.observe(value)
+            key = (view, method, str(status_code))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            name = "invoicing_requests_total"
+            lines.append(f"# HELP {name} Number of handled requests.")
+            lines.append(f"# TYPE {name} counter")
+            for (view, method, status_code), count in sorted(self.requests.items()):
+                labels = format_labels(view=view, method=method, status=status_code)
+                lines.append(f"{name}{{{labels}}} {count}")
+
+            for name, help_text, _ in self.histograms:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (view, method), histogram in sorted(self.values[name].items()):
+                    labels = format_labels(view=view, method=method)
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(**labels):
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return ",".join(f'{key}="{value}"' for key, value in escaped)
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,143 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from invoicing.metrics import registry
+from invoicing.settings import (
+    INVOICING_SLOW_REQUEST_MS,
+    INVOICING_SLOW_REQUEST_QUERIES,
+)
+
+logger = logging.getLogger("invoicing.requests")
+
+# Connections are per thread and async views run their queries in other
+# threads than the request's, the recorder is looked up from the context.
+current_recorder = ContextVar("current_recorder", default=None)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper timing every query run through it.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start, sql))
+
+    @property
+    def duration(self):
+        return sum(duration for duration, _ in self.queries)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        # First, so that `execute_wrapper()` blocks around the connection
+        # opening pop their own wrapper.
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def get_view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name or match._func_path
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure the wall time, number of queries and database time of requests.
+
+    The figures are sent back in a `Server-Timing` header, aggregated in the
+    per-view histograms served by `/api/metrics`, and requests slower than
+    `INVOICING_SLOW_REQUEST_MS` are logged with their slowest queries.
+    Streamed response bodies are produced after the middleware returns and
+    are not accounted for.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            if connection.connection is not None:
+                install_query_recorder(type(connection), connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        duration = time.perf_counter() - start
+
+        self.process_metrics(request, response, duration, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        duration = time.perf_counter() - start
+
+        self.process_metrics(request, response, duration, recorder)
+        return response
+
+    def process_metrics(self, request, response, duration, recorder):
+        db_duration = recorder.duration
+        queries = len(recorder.queries)
+        response["Server-Timing"] = (
+            f"total;dur={duration * 1000:.1f}, "
+            f'db;dur={db_duration * 1000:.1f};desc="{queries} queries"'
+        )
+
+        view = get_view_name(request)
+        registry.record(
+            view, request.method, response.status_code, duration, db_duration, queries
+        )
+
+        if duration * 1000 >= INVOICING_SLOW_REQUEST_MS:
+            slowest = sorted(recorder.queries, key=lambda query: query[0], reverse=True)
+            logger.warning(
+                "Slow request %s %s (%s): %.1fms, %d queries in %.1fms%s",
+                request.method,
+                request.get_full_path(),
+                view,
+                duration * 1000,
+                queries,
+                db_duration * 1000,
+                "".join(
+                    f"\n  {query_duration * 1000:.1f}ms {sql}"
+                    for query_duration, sql in slowest[:INVOICING_SLOW_REQUEST_QUERIES]
+                ),
+            )
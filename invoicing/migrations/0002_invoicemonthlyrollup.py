@@ -0,0 +1,62 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:33
+
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    Invoice = apps.get_model('invoicing', 'Invoice')
+    InvoiceMonthlyRollup = apps.get_model('invoicing', 'InvoiceMonthlyRollup')
+    stats = (
+        Invoice.objects.annotate(
+            month=TruncMonth('date', output_field=models.DateField()),
+            side=Case(
+                When(supplier__isnull=True, then=Value('customer')),
+                default=Value('supplier'),
+                output_field=models.CharField(),
+            ),
+        )
+        .values('month', 'side', 'status')
+        .annotate(
+            count=Count('id'),
+            total=Sum('amount', output_field=DecimalField(max_digits=20, decimal_places=2)),
+            total_squares=Sum(
+                F('amount') * F('amount'),
+                output_field=DecimalField(max_digits=30, decimal_places=4),
+            ),
+        )
+        .order_by()
+    )
+    InvoiceMonthlyRollup.objects.bulk_create(
+        (InvoiceMonthlyRollup(**stat) for stat in stats), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('side', models.CharField(choices=[('customer', 'Customer'), ('supplier', 'Supplier')], max_length=16, verbose_name='Side')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid')], max_length=32, verbose_name='Status')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Count')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Total amount')),
+                ('total_squares', models.DecimalField(decimal_places=4, default=0, max_digits=30, verbose_name='Sum of squared amounts')),
+            ],
+            options={
+                'verbose_name': 'Invoice monthly rollup',
+                'verbose_name_plural': 'Invoice monthly rollups',
+                'ordering': ['month', 'side', 'status'],
+                'constraints': [models.UniqueConstraint(fields=('month', 'side', 'status'), name='invoicing_rollup_month_side_status_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
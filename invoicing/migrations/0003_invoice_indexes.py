@@ -0,0 +1,36 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0002_invoicemonthlyrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='customer',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='invoicing.customer', verbose_name='Customer'),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='supplier',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='invoices', to='invoicing.supplier', verbose_name='Supplier'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date', 'id'], name='invoicing_invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('customer__isnull', False)), fields=['customer', 'date'], name='invoicing_inv_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('supplier__isnull', False)), fields=['supplier', 'date'], name='invoicing_inv_supplier_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.15 on 2026-10-18 13:53
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_balances(apps, schema_editor):
+    Invoice = apps.get_model('invoicing', 'Invoice')
+    for side in ('customer', 'supplier'):
+        model = apps.get_model('invoicing', side)
+        invoices = Invoice.objects.filter(**{side: OuterRef('pk')}).order_by().values(side)
+
+        def aggregate(expression):
+            return Subquery(invoices.annotate(value=expression).values('value'))
+
+        model.objects.update(
+            invoice_count=Coalesce(aggregate(Count('id')), 0),
+            invoice_total=Coalesce(aggregate(Sum('amount')), 0),
+            outstanding_total=Coalesce(
+                aggregate(Sum('amount', filter=Q(status='pending'))), 0
+            ),
+            last_invoice_date=aggregate(Max('date')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0004_customer_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='invoice_count',
+            field=models.BigIntegerField(default=0, verbose_name='Invoice count'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='invoice_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Invoice total'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_invoice_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last invoice date'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='outstanding_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Outstanding total'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='invoice_count',
+            field=models.BigIntegerField(default=0, verbose_name='Invoice count'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='invoice_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Invoice total'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='last_invoice_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last invoice date'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='outstanding_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20, verbose_name='Outstanding total'),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:07
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Frozen copy of `invoicing.models.normalize_search_text`, so that later
+# changes to the normalization don't change what this migration stored.
+def normalize_search_text(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.casefold().split())
+
+
+def populate_normalized_fields(apps, schema_editor):
+    Customer = apps.get_model('invoicing', 'Customer')
+    customers = []
+    for customer in Customer.objects.only('name', 'email').iterator(chunk_size=2000):
+        customer.name_normalized = normalize_search_text(customer.name)
+        customer.email_normalized = normalize_search_text(customer.email)
+        customers.append(customer)
+        if len(customers) == 2000:
+            Customer.objects.bulk_update(customers, ['name_normalized', 'email_normalized'])
+            customers = []
+    Customer.objects.bulk_update(customers, ['name_normalized', 'email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0005_customer_supplier_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='email_normalized',
+            field=models.CharField(default='', editable=False, max_length=128, verbose_name='Normalized email'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='name_normalized',
+            field=models.CharField(default='', editable=False, max_length=128, verbose_name='Normalized name'),
+        ),
+        migrations.RunPython(populate_normalized_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['name_normalized', 'id'], name='invoicing_cust_name_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['email_normalized', 'id'], name='invoicing_cust_email_norm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'date'], name='invoicing_inv_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['amount', 'id'], name='invoicing_invoice_amount_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:13
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0007_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, verbose_name='Key')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Fingerprint')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status code')),
+                ('response', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True, verbose_name='Response')),
+                ('headers', models.JSONField(blank=True, default=dict, verbose_name='Headers')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Idempotency key',
+                'verbose_name_plural': 'Idempotency keys',
+                'constraints': [models.UniqueConstraint(fields=('user', 'key'), name='invoicing_idempotency_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:23
+
+import django.db.models.manager
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0008_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='invoice',
+            options={'base_manager_name': 'all_objects', 'ordering': ['-date'], 'verbose_name': 'Invoice', 'verbose_name_plural': 'Invoices'},
+        ),
+        migrations.AlterModelManagers(
+            name='invoice',
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Updated at'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['updated_at', 'id'], name='invoicing_invoice_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Deleted at'),
+        ),
+        migrations.CreateModel(
+            name='PurgeWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(verbose_name='Updated at')),
+                ('invoice_id', models.BigIntegerField(verbose_name='Invoice ID')),
+                ('purged_at', models.DateTimeField(auto_now=True, verbose_name='Purged at')),
+            ],
+            options={
+                'verbose_name': 'Purge watermark',
+                'verbose_name_plural': 'Purge watermarks',
+            },
+        ),
+    ]
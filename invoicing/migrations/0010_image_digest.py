@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0009_invoice_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='image_digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='Image digest'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='image_digest',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='Image digest'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:46
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_heartbeats(apps, schema_editor):
+    # Running jobs are claimed again once their heartbeat is too old.
+    Job = apps.get_model('invoicing', 'Job')
+    Job.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0010_image_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Heartbeat at'),
+        ),
+        migrations.RunPython(populate_heartbeats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoicing', '0011_job_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', True), ('supplier__isnull', True)), fields=['date', 'amount', 'supplier', 'deleted_at'], name='invoicing_inv_cust_side_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('customer__isnull', True), ('deleted_at__isnull', True)), fields=['date', 'amount', 'customer', 'deleted_at'], name='invoicing_inv_supp_side_idx'),
+        ),
+    ]
@@ -1,18 +1,104 @@
-from django.db import models
+import unicodedata
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 
 from pylibutils.utils import naive_utcnow
 
-from invoicing.settings import INVOICE_STATUS_CHOICES
+from invoicing.cache import bump_versions
+from invoicing.db import lock_rows
+from invoicing.rollups import invoice_state, record_invoice_changes
+from invoicing.settings import (
+    INVOICE_SIDE_CHOICES,
+    INVOICE_STATUS_CHOICES,
+    JOB_STATUS_CHOICES,
+)
+from invoicing.thumbnails import schedule_thumbnails
 
 User = get_user_model()
 
 
-class Customer(models.Model):
+class InvoiceBalanceModel(models.Model):
+    """
+    Denormalized invoice counters of a party, kept up to date by
+    `invoicing.rollups` and recomputed by `manage.py reconcile_balances`.
+    """
+
+    class Meta:
+        abstract = True
+
+    invoice_count = models.BigIntegerField(_("Invoice count"), default=0)
+    invoice_total = models.DecimalField(
+        _("Invoice total"), decimal_places=2, max_digits=20, default=0
+    )
+    outstanding_total = models.DecimalField(
+        _("Outstanding total"), decimal_places=2, max_digits=20, default=0
+    )
+    last_invoice_date = models.DateTimeField(
+        _("Last invoice date"), null=True, blank=True
+    )
+
+    # Maintained by `invoicing.rollups`, never edited by hand.
+    BALANCE_FIELDS = (
+        "invoice_count",
+        "invoice_total",
+        "outstanding_total",
+        "last_invoice_date",
+    )
+
+
+class ThumbnailedImageModel(models.Model):
+    """
+    Model with an `image` whose thumbnails are generated when it is uploaded,
+    see `invoicing.thumbnails`.
+    """
+
+    class Meta:
+        abstract = True
+
+    # SHA-256 digest of the image, set once its thumbnails are generated.
+    image_digest = models.CharField(
+        _("Image digest"), max_length=64, blank=True, default="", editable=False
+    )
+
+    def save(self, *args, **kwargs):
+        uploaded = bool(self.image) and not self.image._committed
+        if uploaded or not self.image:
+            self.image_digest = ""
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "image" in update_fields:
+                kwargs["update_fields"] = {*update_fields, "image_digest"}
+        super().save(*args, **kwargs)
+        if uploaded:
+            schedule_thumbnails(self)
+
+
+def normalize_search_text(value):
+    """
+    Fold `value` for case and accent insensitive comparisons.
+    """
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(char for char in value if not unicodedata.combining(char))
+    return " ".join(value.casefold().split())
+
+
+class Customer(InvoiceBalanceModel, ThumbnailedImageModel):
     class Meta:
         verbose_name = _("Customer")
         verbose_name_plural = _("Customers")
+        indexes = [
+            models.Index(fields=["name", "id"], name="invoicing_customer_name_idx"),
+            # Prefix searches, see `invoicing.filters.search_customers`.
+            models.Index(
+                fields=["name_normalized", "id"], name="invoicing_cust_name_norm_idx"
+            ),
+            models.Index(
+                fields=["email_normalized", "id"], name="invoicing_cust_email_norm_idx"
+            ),
+        ]
 
     user = models.ForeignKey(
         User, verbose_name=_("User"), on_delete=models.PROTECT, null=True, blank=True
@@ -21,11 +107,39 @@ class Customer(models.Model):
     email = models.CharField(_("Email"), max_length=128)
     image = models.ImageField(_("Image URL"), null=True, blank=True)
 
+    # `name` and `email` folded by `normalize_search_text`, set on save.
+    name_normalized = models.CharField(
+        _("Normalized name"), max_length=128, editable=False, default=""
+    )
+    email_normalized = models.CharField(
+        _("Normalized email"), max_length=128, editable=False, default=""
+    )
+
+    NORMALIZED_FIELDS = {"name": "name_normalized", "email": "email_normalized"}
+
     def __str__(self):
         return self.name
 
+    def normalize_fields(self):
+        for field, normalized_field in self.NORMALIZED_FIELDS.items():
+            setattr(self, normalized_field, normalize_search_text(getattr(self, field)))
+
+    def save(self, *args, **kwargs):
+        self.normalize_fields()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {
+                *update_fields,
+                *(
+                    normalized_field
+                    for field, normalized_field in self.NORMALIZED_FIELDS.items()
+                    if field in update_fields
+                ),
+            }
+        super().save(*args, **kwargs)
+
 
-class Supplier(models.Model):
+class Supplier(InvoiceBalanceModel, ThumbnailedImageModel):
     class Meta:
         verbose_name = _("Supplier")
         verbose_name_plural = _("Suppliers")
@@ -39,11 +153,99 @@ class Supplier(models.Model):
         return f"{self.user.first_name} {self.user.last_name}"
 
 
+class InvoiceQuerySet(models.QuerySet):
+    def lock(self):
+        """
+        Return the invoices with their tracked fields as persisted in the
+        database, locking their rows until the end of the current transaction
+        so that concurrent writers compute their deltas from each other's
+        changes. Must be called in a transaction.
+        """
+        return lock_rows(self.only(*self.model.TRACKED_FIELDS), "deleted_at")
+
+    def delete(self):
+        """
+        Soft-delete the invoices, see `Invoice.delete`.
+        """
+        with transaction.atomic(using=self.db):
+            invoices = self.filter(deleted_at__isnull=True).lock()
+            now = timezone.now()
+            count = (
+                type(self)(self.model, using=self.db)
+                .filter(pk__in=[invoice.pk for invoice in invoices])
+                .update(deleted_at=now, updated_at=now)
+            )
+            record_invoice_changes((invoice.get_state(), None) for invoice in invoices)
+            bump_versions(self.model._meta.label_lower)
+        return count, {self.model._meta.label: count}
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def hard_delete(self):
+        """
+        Delete the invoices for good, without updating the aggregated tables:
+        meant to purge the tombstones of deleted invoices.
+        """
+        return super().delete()
+
+    hard_delete.alters_data = True
+
+
+class InvoiceManager(models.Manager.from_queryset(InvoiceQuerySet)):
+    """
+    Manager of the invoices that are not deleted.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Invoice(models.Model):
     class Meta:
         verbose_name = _("Invoice")
         verbose_name_plural = _("Invoices")
         ordering = ["-date"]
+        base_manager_name = "all_objects"
+        indexes = [
+            # Listings ordered by date, with the primary key as tie-breaker.
+            models.Index(fields=["date", "id"], name="invoicing_invoice_date_idx"),
+            # Per-party listings; they also replace the plain foreign key indexes
+            # and skip the rows where the foreign key is empty. Deleted invoices
+            # are kept: deleting a party looks them up, see `ProtectedDeleteMixin`.
+            models.Index(
+                fields=["customer", "date"],
+                condition=models.Q(customer__isnull=False),
+                name="invoicing_inv_customer_idx",
+            ),
+            models.Index(
+                fields=["supplier", "date"],
+                condition=models.Q(supplier__isnull=False),
+                name="invoicing_inv_supplier_idx",
+            ),
+            # Covering indexes for the `side` filter of the analytics and the
+            # admin (the dashboard reads `InvoiceMonthlyRollup` instead), which
+            # only read the invoices that are not deleted. The columns of the
+            # condition are included too: a query reading a column missing from
+            # the index, even only to check the condition, reads the table.
+            models.Index(
+                fields=["date", "amount", "supplier", "deleted_at"],
+                condition=models.Q(supplier__isnull=True, deleted_at__isnull=True),
+                name="invoicing_inv_cust_side_idx",
+            ),
+            models.Index(
+                fields=["date", "amount", "customer", "deleted_at"],
+                condition=models.Q(customer__isnull=True, deleted_at__isnull=True),
+                name="invoicing_inv_supp_side_idx",
+            ),
+            # Status filters and amount ranges or ordering.
+            models.Index(fields=["status", "date"], name="invoicing_inv_status_idx"),
+            models.Index(fields=["amount", "id"], name="invoicing_invoice_amount_idx"),
+            # Invoices changed since a watermark, see `invoicing.changes`.
+            models.Index(
+                fields=["updated_at", "id"], name="invoicing_invoice_updated_idx"
+            ),
+        ]
 
     customer = models.ForeignKey(
         Customer,
@@ -52,6 +254,7 @@ class Invoice(models.Model):
         related_name="invoices",
         null=True,
         blank=True,
+        db_index=False,
     )
     supplier = models.ForeignKey(
         Supplier,
@@ -60,12 +263,31 @@ class Invoice(models.Model):
         related_name="invoices",
         null=True,
         blank=True,
+        db_index=False,
     )
     amount = models.DecimalField(_("Amount"), decimal_places=2, max_digits=11)
     date = models.DateTimeField(_("Invoice date"), default=naive_utcnow, blank=True)
     status = models.CharField(
         _("Status"), choices=INVOICE_STATUS_CHOICES, default="pending", max_length=32
     )
+    # Set by `save` and `bulk_create`; `bulk_update` callers must set it.
+    updated_at = models.DateTimeField(_("Updated at"), auto_now=True)
+    # Deleted invoices are kept as tombstones, see `delete`.
+    deleted_at = models.DateTimeField(_("Deleted at"), null=True, blank=True)
+
+    objects = InvoiceManager()
+    # Includes the deleted invoices.
+    all_objects = InvoiceQuerySet.as_manager()
+
+    # Fields the aggregated tables depend on, see `invoicing.rollups`.
+    TRACKED_FIELDS = (
+        "customer_id",
+        "supplier_id",
+        "amount",
+        "date",
+        "status",
+        "deleted_at",
+    )
 
     def __str__(self):
         return f"{self.status} | {self.amount} {self.customer}"
@@ -74,15 +296,221 @@ class Invoice(models.Model):
     def is_supplier_invoice(self):
         return self.supplier is not None
 
-    def save(self, *args, **kwargs):
-        if not self.supplier and not self.customer:
-            raise Exception(_("A supplier or customer must be provided."))
-
-        if self.supplier and self.customer:
-            raise Exception(
-                _(
-                    "Only the supplier or the customer must be provided. You can not set both."
-                )
+    def get_state(self):
+        """
+        Return the `InvoiceState` of this invoice, `None` once it is deleted.
+        """
+        return None if self.deleted_at is not None else invoice_state(self)
+
+    def lock_persisted(self, using):
+        """
+        Return this invoice with its tracked fields as persisted in the
+        database, locking its row, or `None` if it is not saved yet.
+        """
+        if self._state.adding or self.pk is None:
+            return None
+        invoices = type(self)._base_manager.db_manager(using).filter(pk=self.pk)
+        return next(iter(invoices.lock()), None)
+
+    @staticmethod
+    def get_parties_error(customer_id, supplier_id):
+        """
+        Return why an invoice can not have these customer and supplier ids,
+        or `None` if it can.
+        """
+        if not supplier_id and not customer_id:
+            return _("A supplier or customer must be provided.")
+
+        if supplier_id and customer_id:
+            return _(
+                "Only the supplier or the customer must be provided. You can not set both."
             )
 
-        return super().save(*args, **kwargs)
+        return None
+
+    def save(self, *args, **kwargs):
+        error = self.get_parties_error(self.customer_id, self.supplier_id)
+        if error:
+            raise Exception(error)
+
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            # Read again under lock, the loaded values may be stale.
+            persisted = self.lock_persisted(using)
+            result = super().save(*args, **kwargs)
+            if persisted is None:
+                record_invoice_changes([(None, self.get_state())])
+                return result
+
+            previous = persisted.get_state()
+            # The fields left out of `update_fields` keep their persisted values.
+            update_fields = kwargs.get("update_fields")
+            for name in update_fields or self.TRACKED_FIELDS:
+                attname = self._meta.get_field(name).attname
+                if attname in self.TRACKED_FIELDS:
+                    setattr(persisted, attname, getattr(self, attname))
+            record_invoice_changes([(previous, persisted.get_state())])
+        return result
+
+    def delete(self, using=None, keep_parents=False):
+        """
+        Soft-delete the invoice: it is hidden from `Invoice.objects` and from
+        the aggregated tables, and kept with its `deleted_at` date so that
+        `/api/invoices/changes/` reports the deletion.
+        """
+        self.deleted_at = timezone.now()
+        self.save(using=using, update_fields=["deleted_at", "updated_at"])
+        return 1, {self._meta.label: 1}
+
+
+class InvoiceMonthlyRollup(models.Model):
+    """
+    Pre-aggregated invoice statistics per month, side and status.
+
+    Kept up to date by `Invoice.save`/`Invoice.delete`; bulk writes that bypass
+    them must go through `invoicing.rollups`, and `manage.py rebuild_rollups`
+    recomputes the whole table.
+    """
+
+    class Meta:
+        verbose_name = _("Invoice monthly rollup")
+        verbose_name_plural = _("Invoice monthly rollups")
+        ordering = ["month", "side", "status"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["month", "side", "status"],
+                name="invoicing_rollup_month_side_status_uniq",
+            ),
+        ]
+
+    month = models.DateField(_("Month"))
+    side = models.CharField(_("Side"), choices=INVOICE_SIDE_CHOICES, max_length=16)
+    status = models.CharField(
+        _("Status"), choices=INVOICE_STATUS_CHOICES, max_length=32
+    )
+    count = models.BigIntegerField(_("Count"), default=0)
+    total = models.DecimalField(
+        _("Total amount"), decimal_places=2, max_digits=20, default=0
+    )
+    total_squares = models.DecimalField(
+        _("Sum of squared amounts"), decimal_places=4, max_digits=30, default=0
+    )
+
+    def __str__(self):
+        return f"{self.month:%m-%Y} | {self.side} | {self.status}"
+
+
+class Job(models.Model):
+    """
+    Operation run in the background by `manage.py run_worker`, see
+    `invoicing.jobs`.
+    """
+
+    class Meta:
+        verbose_name = _("Job")
+        verbose_name_plural = _("Jobs")
+        ordering = ["-id"]
+        indexes = [
+            # Queued jobs due to run, and running jobs without a recent heartbeat.
+            models.Index(
+                fields=["status", "run_after"], name="invoicing_job_queue_idx"
+            ),
+        ]
+
+    name = models.CharField(_("Name"), max_length=64)
+    params = models.JSONField(_("Parameters"), default=dict, blank=True)
+    user = models.ForeignKey(
+        User,
+        verbose_name=_("User"),
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    status = models.CharField(
+        _("Status"),
+        choices=JOB_STATUS_CHOICES,
+        default="queued",
+        max_length=16,
+    )
+    progress_done = models.PositiveBigIntegerField(_("Progress"), default=0)
+    progress_total = models.PositiveBigIntegerField(
+        _("Progress total"), null=True, blank=True
+    )
+    result = models.JSONField(_("Result"), null=True, blank=True)
+    error = models.TextField(_("Error"), blank=True)
+    attempts = models.PositiveSmallIntegerField(_("Attempts"), default=0)
+    max_attempts = models.PositiveSmallIntegerField(_("Maximum attempts"), default=3)
+    worker = models.CharField(_("Worker"), max_length=128, blank=True)
+    run_after = models.DateTimeField(_("Run after"), default=timezone.now)
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+    started_at = models.DateTimeField(_("Started at"), null=True, blank=True)
+    # Updated while the job runs, see `invoicing.jobs.heartbeat`.
+    heartbeat_at = models.DateTimeField(_("Heartbeat at"), null=True, blank=True)
+    finished_at = models.DateTimeField(_("Finished at"), null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} | {self.status}"
+
+    def report_progress(self, done, total=None):
+        """
+        Save the progress of the running job, `total` is kept when `None`.
+        """
+        self.progress_done = done
+        update_fields = ["progress_done"]
+        if total is not None:
+            self.progress_total = total
+            update_fields.append("progress_total")
+        self.save(update_fields=update_fields)
+
+
+class PurgeWatermark(models.Model):
+    """
+    Change feed position of the last deleted invoice purged for good, see
+    `invoicing.changes.purge_tombstones`. Clients resuming from an earlier
+    position may have missed deletions. A single row.
+    """
+
+    class Meta:
+        verbose_name = _("Purge watermark")
+        verbose_name_plural = _("Purge watermarks")
+
+    updated_at = models.DateTimeField(_("Updated at"))
+    invoice_id = models.BigIntegerField(_("Invoice ID"))
+    purged_at = models.DateTimeField(_("Purged at"), auto_now=True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response to a request with an `Idempotency-Key` header, replayed to its
+    retries until `expires_at`, see `invoicing.idempotency`.
+    """
+
+    class Meta:
+        verbose_name = _("Idempotency key")
+        verbose_name_plural = _("Idempotency keys")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="invoicing_idempotency_key_uniq"
+            ),
+        ]
+
+    user = models.ForeignKey(
+        User, verbose_name=_("User"), on_delete=models.CASCADE, related_name="+"
+    )
+    key = models.CharField(_("Key"), max_length=255)
+    # Hash of the request, a key can not be reused for another one.
+    fingerprint = models.CharField(_("Fingerprint"), max_length=64)
+    # Empty until the first request completes.
+    status_code = models.PositiveSmallIntegerField(
+        _("Status code"), null=True, blank=True
+    )
+    response = models.JSONField(
+        _("Response"), null=True, blank=True, encoder=DjangoJSONEncoder
+    )
+    headers = models.JSONField(_("Headers"), default=dict, blank=True)
+    created_at = models.DateTimeField(_("Created at"), auto_now_add=True)
+    expires_at = models.DateTimeField(_("Expires at"), db_index=True)
+
+    def __str__(self):
+        return f"{self.key} | {self.status_code}"
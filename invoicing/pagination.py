@@ -0,0 +1,248 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from invoicing.db import estimate_row_count
+from invoicing.filters import IndexedOrderingFilter
+from invoicing.settings import INVOICING_ADMIN_COUNT_LIMIT
+
+
+class KeysetPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination with an opt-in keyset (cursor) mode.
+
+    Passing `?cursor=` (empty for the first page) switches to keyset
+    pagination on the view's `keyset_ordering`, which must end with a unique
+    field. Each page is then a single index range scan, no `COUNT(*)` is run
+    and rows inserted while a client pages through never shift the pages.
+
+    In page number mode, `?count=false` skips the `COUNT(*)` query.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_query_description = _(
+        "The pagination cursor value, pass an empty value for the first page."
+    )
+    count_query_param = "count"
+    count_query_description = _("Set to false to skip counting the results.")
+    invalid_cursor_message = _("Invalid cursor")
+    default_keyset_ordering = ("-pk",)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        self.count_mode = not self.cursor_mode and self.include_count(request)
+
+        if self.cursor_mode:
+            return self.paginate_keyset(queryset, request, view)
+        if not self.count_mode:
+            return self.paginate_without_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def include_count(self, request):
+        value = request.query_params.get(self.count_query_param, "true")
+        return value.lower() not in ("0", "false", "no")
+
+    def get_keyset_ordering(self, view):
+        # An ordering requested with `IndexedOrderingFilter` ends with the
+        # primary key and can be used as the keyset.
+        for backend in getattr(view, "filter_backends", ()):
+            if issubclass(backend, IndexedOrderingFilter):
+                ordering = backend().get_ordering(self.request, None, view)
+                if ordering:
+                    return ordering
+        return getattr(view, "keyset_ordering", self.default_keyset_ordering)
+
+    def get_keyset_fields(self, model, ordering):
+        return [
+            model._meta.pk if name == "pk" else model._meta.get_field(name)
+            for name in (name.lstrip("-") for name in ordering)
+        ]
+
+    def paginate_keyset(self, queryset, request, view):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        ordering = self.get_keyset_ordering(view)
+        fields = self.get_keyset_fields(queryset.model, ordering)
+
+        queryset = queryset.order_by(*ordering)
+        position = self.decode_cursor(request, fields)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, fields, position))
+
+        results = list(queryset[: page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        self.next_position = (
+            [field.value_from_object(self.page[-1]) for field in fields]
+            if self.has_next
+            else None
+        )
+        self.display_page_controls = False
+        return self.page
+
+    def paginate_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            self.page_number = int(page_number)
+            if self.page_number < 1:
+                raise ValueError
+        except ValueError:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=_("Invalid page")
+                )
+            )
+
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset : offset + page_size + 1])
+        if not results and self.page_number != 1:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number,
+                    message=_("That page contains no results"),
+                )
+            )
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        self.display_page_controls = False
+        return self.page
+
+    def keyset_filter(self, ordering, fields, position):
+        """
+        Build the `(a, b, ...) > (x, y, ...)` row comparison for the ordering.
+        """
+        conditions = []
+        for index, (name, field) in enumerate(zip(ordering, fields)):
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition = Q(**{f"{field.attname}__{lookup}": position[index]})
+            for previous, value in zip(fields[:index], position):
+                condition &= Q(**{previous.attname: value})
+            conditions.append(condition)
+        return reduce(or_, conditions)
+
+    def encode_cursor(self, position):
+        # Unlike `DjangoJSONEncoder`, `str` keeps the microseconds of datetimes.
+        data = json.dumps(position, separators=(",", ":"), default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request, fields):
+        return self.parse_cursor(
+            request.query_params.get(self.cursor_query_param), fields
+        )
+
+    def parse_cursor(self, encoded, fields):
+        if not encoded:
+            return None
+
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(position, list) or len(position) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, position)]
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.count_mode:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        if self.cursor_mode:
+            cursor = self.encode_cursor(self.next_position)
+            return replace_query_param(url, self.cursor_query_param, cursor)
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.count_mode:
+            return super().get_previous_link()
+        if self.cursor_mode or self.page_number == 1:
+            return None
+
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if self.count_mode:
+            return super().get_paginated_response(data)
+
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["required"] = ["results"]
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.extend(
+            [
+                {
+                    "name": self.cursor_query_param,
+                    "required": False,
+                    "in": "query",
+                    "description": str(self.cursor_query_description),
+                    "schema": {"type": "string"},
+                },
+                {
+                    "name": self.count_query_param,
+                    "required": False,
+                    "in": "query",
+                    "description": str(self.count_query_description),
+                    "schema": {"type": "boolean"},
+                },
+            ]
+        )
+        return parameters
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting at most `INVOICING_ADMIN_COUNT_LIMIT` rows.
+
+    Past the limit, unfiltered querysets report the database's estimate of
+    the table size and filtered ones the limit, so that no page runs a
+    `COUNT(*)` over a large table. Querysets of a default manager that filters
+    rows, like the one hiding the deleted invoices, count as filtered: the
+    table size would include the hidden rows.
+    """
+
+    count_limit = INVOICING_ADMIN_COUNT_LIMIT
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+        # `COUNT(*)` over a subquery stopping at the limit.
+        return queryset[: self.count_limit].count()
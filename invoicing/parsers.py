@@ -0,0 +1,65 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """
+    Decode the JSON `data`, a `str` or UTF-8 `bytes`, with `orjson` when it is
+    installed.
+
+    `orjson` decodes numbers with a fraction as floats, which round-trip up to
+    15 significant digits, more than invoice amounts have. The stdlib fallback
+    decodes them as `Decimal`s.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data, parse_float=Decimal)
+
+
+class FastJSONParser(JSONParser):
+    """
+    Parse JSON with `json_loads()`.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace("-", "") != "utf8":
+                data = data.decode(encoding)
+            return json_loads(data)
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parse newline delimited JSON into a list holding one item per line.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+
+        items = []
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json_loads(line.decode(encoding)))
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {number} - {exc}")
+        return items
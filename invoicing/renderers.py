@@ -0,0 +1,56 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PrometheusRenderer(BaseRenderer):
+    """
+    Render text already in the Prometheus exposition format.
+    """
+
+    media_type = "text/plain"
+    format = "prometheus"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Errors, like permission denials, are rendered as plain text.
+        return str(data.get("detail", data)).encode(self.charset)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Render JSON with `orjson` when it is installed, falling back to the stdlib
+    `json` module of `JSONRenderer` otherwise and for indented output, which
+    `orjson` only supports with two spaces.
+
+    Types `orjson` does not handle natively, including datetimes and
+    `Decimal`s, are encoded with `encoder_class`, like `JSONRenderer` does:
+    `Decimal`s are numbers, serializer fields render them as strings unless
+    `COERCE_DECIMAL_TO_STRING` is disabled.
+    """
+
+    orjson_options = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data, default=self.encoder_class().default, option=self.orjson_options
+        )
+        # Like `JSONRenderer`, escape the separators that are valid JSON but
+        # not valid JavaScript.
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
@@ -0,0 +1,312 @@
+"""
+Incremental maintenance of the pre-aggregated invoice tables.
+
+Every write path that touches invoices describes the change as a pair of
+`InvoiceState` (before, after) and lets this module turn it into deltas that
+are applied with `F()` expressions, so concurrent writers never lose updates.
+"""
+
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case,
+    CharField,
+    Count,
+    DateField,
+    DecimalField,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest, TruncMonth
+from django.utils import timezone
+
+from invoicing.cache import bump_versions
+from invoicing.db import lock_rows, lock_table_writes
+
+InvoiceState = namedtuple(
+    "InvoiceState", ["month", "side", "status", "amount", "party_id", "date"]
+)
+
+
+def month_of(value):
+    """
+    Return the first day of the month `value` falls in, in the current timezone.
+    """
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def invoice_state(invoice):
+    """
+    Return the `InvoiceState` describing the contribution of `invoice` to the
+    aggregated tables.
+    """
+    date = invoice._meta.get_field("date").to_python(invoice.date)
+    amount_field = invoice._meta.get_field("amount")
+    amount = amount_field.to_python(invoice.amount).quantize(
+        Decimal(10) ** -amount_field.decimal_places
+    )
+    return InvoiceState(
+        month=month_of(date),
+        side="supplier" if invoice.supplier_id else "customer",
+        status=invoice.status,
+        amount=amount,
+        party_id=invoice.supplier_id or invoice.customer_id,
+        date=date,
+    )
+
+
+def collect_deltas(changes):
+    """
+    Fold an iterable of `(previous, current)` state pairs into per-rollup deltas.
+    Either side of a pair may be `None` for inserts and deletes.
+    """
+    deltas = defaultdict(lambda: [0, Decimal(0), Decimal(0)])
+    for previous, current in changes:
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is None:
+                continue
+            delta = deltas[(state.month, state.side, state.status)]
+            delta[0] += sign
+            delta[1] += sign * state.amount
+            delta[2] += sign * state.amount * state.amount
+    return deltas
+
+
+def apply_rollup_deltas(deltas):
+    """
+    Apply the deltas returned by `collect_deltas` to `InvoiceMonthlyRollup`.
+    """
+    from invoicing.models import InvoiceMonthlyRollup
+
+    for (month, side, status), (count, total, total_squares) in deltas.items():
+        if not count and not total and not total_squares:
+            continue
+        rollups = InvoiceMonthlyRollup.objects.filter(
+            month=month, side=side, status=status
+        )
+        changes = {
+            "count": F("count") + count,
+            "total": F("total") + total,
+            "total_squares": F("total_squares") + total_squares,
+        }
+        if rollups.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                InvoiceMonthlyRollup.objects.create(
+                    month=month,
+                    side=side,
+                    status=status,
+                    count=count,
+                    total=total,
+                    total_squares=total_squares,
+                )
+        except IntegrityError:
+            # Another writer created the row in the meantime.
+            rollups.update(**changes)
+
+
+def collect_balance_deltas(changes):
+    """
+    Fold `(previous, current)` state pairs into per-party balance deltas, keyed
+    by `(side, party_id)`: the count, total and outstanding total deltas, the
+    latest added invoice date and whether an invoice left the party or changed
+    its date, which requires recomputing the last invoice date.
+    """
+    deltas = defaultdict(lambda: [0, Decimal(0), Decimal(0), None, False])
+    for previous, current in changes:
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is None or state.party_id is None:
+                continue
+            delta = deltas[(state.side, state.party_id)]
+            delta[0] += sign
+            delta[1] += sign * state.amount
+            if state.status == "pending":
+                delta[2] += sign * state.amount
+
+        if (
+            previous is not None
+            and current is not None
+            and (previous.side, previous.party_id, previous.date)
+            == (current.side, current.party_id, current.date)
+        ):
+            continue
+        if previous is not None and previous.party_id is not None:
+            deltas[(previous.side, previous.party_id)][4] = True
+        if current is not None and current.party_id is not None:
+            delta = deltas[(current.side, current.party_id)]
+            delta[3] = current.date if delta[3] is None else max(delta[3], current.date)
+    return deltas
+
+
+def apply_balance_deltas(deltas):
+    """
+    Apply the deltas returned by `collect_balance_deltas` to the balances of
+    the customers and suppliers. Must run after the invoices are written.
+    """
+    from invoicing.models import Customer, Invoice, Supplier
+
+    models = {"customer": Customer, "supplier": Supplier}
+    sides = set()
+    for (side, party_id), delta in deltas.items():
+        count, total, outstanding, last_date, recompute_last_date = delta
+        changes = {}
+        if count:
+            changes["invoice_count"] = F("invoice_count") + count
+        if total:
+            changes["invoice_total"] = F("invoice_total") + total
+        if outstanding:
+            changes["outstanding_total"] = F("outstanding_total") + outstanding
+        if recompute_last_date:
+            # A seek on the per-party (party, date) index.
+            changes["last_invoice_date"] = Subquery(
+                Invoice.objects.filter(**{side: OuterRef("pk")})
+                .order_by("-date")
+                .values("date")[:1]
+            )
+        elif last_date is not None:
+            changes["last_invoice_date"] = Greatest(
+                Coalesce("last_invoice_date", Value(last_date)), Value(last_date)
+            )
+        if changes:
+            models[side].objects.filter(pk=party_id).update(**changes)
+            sides.add(side)
+
+    if sides:
+        bump_versions(*(models[side]._meta.label_lower for side in sides))
+
+
+def record_invoice_changes(changes):
+    """
+    Propagate `(previous, current)` invoice state pairs to the aggregated tables
+    and to the balances of the customers and suppliers.
+    """
+    changes = list(changes)
+    apply_rollup_deltas(collect_deltas(changes))
+    apply_balance_deltas(collect_balance_deltas(changes))
+
+
+def rebuild_monthly_rollups():
+    """
+    Recompute `InvoiceMonthlyRollup` from scratch and return the number of rows.
+    Invoice writes wait until the rollups are replaced, their deltas would be
+    lost otherwise.
+    """
+    from invoicing.models import Invoice, InvoiceMonthlyRollup
+
+    total_field = InvoiceMonthlyRollup._meta.get_field("total")
+    squares_field = InvoiceMonthlyRollup._meta.get_field("total_squares")
+    stats = (
+        Invoice.objects.annotate(
+            month=TruncMonth("date", output_field=DateField()),
+            side=Case(
+                When(supplier__isnull=True, then=Value("customer")),
+                default=Value("supplier"),
+                output_field=CharField(),
+            ),
+        )
+        .values("month", "side", "status")
+        .annotate(
+            count=Count("id"),
+            total=Sum("amount", output_field=total_field.clone()),
+            total_squares=Sum(
+                F("amount") * F("amount"),
+                output_field=DecimalField(
+                    max_digits=squares_field.max_digits,
+                    decimal_places=squares_field.decimal_places,
+                ),
+            ),
+        )
+        .order_by()
+    )
+    with transaction.atomic():
+        lock_table_writes(Invoice)
+        rollups = [
+            InvoiceMonthlyRollup(
+                month=stat["month"],
+                side=stat["side"],
+                status=stat["status"],
+                count=stat["count"],
+                total=stat["total"],
+                total_squares=stat["total_squares"],
+            )
+            for stat in stats
+        ]
+        InvoiceMonthlyRollup.objects.all().delete()
+        InvoiceMonthlyRollup.objects.bulk_create(rollups, batch_size=1000)
+        bump_versions("invoicing.invoice")
+    return len(rollups)
+
+
+def reconcile_balances(fix=True, batch_size=1000):
+    """
+    Recompute the balances of every customer and supplier from the invoices.
+    Return the number of drifted rows per model, which are corrected unless
+    `fix` is false.
+
+    Each batch of parties is locked before their invoices are read: invoice
+    writes update the balance of their party in the same transaction, so their
+    increments apply on top of the corrected values rather than being
+    overwritten by them.
+    """
+    from invoicing.models import Customer, Invoice, Supplier
+
+    drift = {}
+    for side, model in (("customer", Customer), ("supplier", Supplier)):
+        column = f"{side}_id"
+        pks = list(model.objects.order_by("pk").values_list("pk", flat=True))
+        drift[model] = 0
+        for start in range(0, len(pks), batch_size):
+            batch = pks[start : start + batch_size]
+            with transaction.atomic():
+                parties = model.objects.filter(pk__in=batch).only(
+                    "pk", *model.BALANCE_FIELDS
+                )
+                parties = lock_rows(parties, "invoice_count") if fix else parties
+                expected = {
+                    stats[column]: (
+                        stats["invoice_count"],
+                        stats["invoice_total"],
+                        stats["outstanding_total"],
+                        stats["last_invoice_date"],
+                    )
+                    for stats in Invoice.objects.filter(**{f"{column}__in": batch})
+                    .values(column)
+                    .annotate(
+                        invoice_count=Count("id"),
+                        invoice_total=Sum("amount"),
+                        outstanding_total=Sum(
+                            "amount", filter=Q(status="pending"), default=0
+                        ),
+                        last_invoice_date=Max("date"),
+                    )
+                    .order_by()
+                }
+
+                drifted = []
+                for party in parties:
+                    values = expected.get(party.pk, (0, Decimal(0), Decimal(0), None))
+                    if (
+                        tuple(getattr(party, name) for name in model.BALANCE_FIELDS)
+                        != values
+                    ):
+                        for name, value in zip(model.BALANCE_FIELDS, values):
+                            setattr(party, name, value)
+                        drifted.append(party)
+                if fix and drifted:
+                    model.objects.bulk_update(drifted, model.BALANCE_FIELDS)
+            drift[model] += len(drifted)
+
+        if fix and drift[model]:
+            bump_versions(model._meta.label_lower)
+    return drift
@@ -0,0 +1,25 @@
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS
+
+# Database the reads of the current request are routed to, `None` for the
+# default behavior.
+read_database = ContextVar("invoicing_read_database", default=None)
+
+
+class ReplicaRouter:
+    """
+    Send the reads of the views opting in, see `ReplicaReadMixin`, to a
+    replica and every write to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        # Instances read from the replica are saved to the primary too.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The primary and its replicas hold the same data.
+        return True
@@ -1,6 +1,12 @@
 from .invoicing_serializers import (
     InvoiceSerializer,
     InvoiceListSerializer,
+    InvoiceBulkSerializer,
+    InvoiceExportSerializer,
+    InvoiceChangesSerializer,
+    InvoiceFilterSerializer,
+    InvoiceAnalyticsSerializer,
+    InvoiceAnalyticsRowSerializer,
     CustomerSerializer,
     CustomerListSerializer,
 )
@@ -9,3 +15,7 @@ from .user_serializers import (
     UserListSerializer,
     GroupSerializer,
 )
+from .job_serializers import (
+    JobSerializer,
+    JobCreateSerializer,
+)
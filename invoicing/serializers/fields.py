@@ -0,0 +1,39 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+
+from invoicing.thumbnails import variant_urls
+
+
+class HyperlinkedPrimaryKeyField(serializers.HyperlinkedRelatedField):
+    """
+    A hyperlinked relation that validates to the primary key in the URL
+    without fetching the object, so that bulk writes can check all the
+    references of a request with a single query per model.
+    """
+
+    def get_object(self, view_name, view_args, view_kwargs):
+        model = self.get_queryset().model
+        try:
+            return model._meta.pk.to_python(view_kwargs[self.lookup_url_kwarg])
+        except DjangoValidationError:
+            raise model.DoesNotExist
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """
+    The URLs of the thumbnails of an image by size, from its `image_digest`;
+    `null` until they are generated.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("source", "image_digest")
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        urls = variant_urls(value)
+        request = self.context.get("request")
+        if request is not None:
+            urls = {size: request.build_absolute_uri(url) for size, url in urls.items()}
+        return urls
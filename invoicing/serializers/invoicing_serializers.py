@@ -1,30 +1,76 @@
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
-from invoicing.models import Customer, Invoice, Supplier
+from invoicing.analytics import ANALYTICS_BUCKETS, ANALYTICS_GROUPS
+from invoicing.cache import bump_versions
+from invoicing.changes import decode_change_token
+from invoicing.exports import EXPORT_FORMATS
+from invoicing.models import Customer, Invoice, InvoiceBalanceModel, Supplier
+from invoicing.rollups import invoice_state, record_invoice_changes
+from invoicing.serializers.fields import HyperlinkedPrimaryKeyField, ThumbnailsField
+from invoicing.serializers.mixins import SparseFieldsetMixin
+from invoicing.settings import INVOICE_SIDE_CHOICES, INVOICE_STATUS_CHOICES
 
 
-class CustomerSerializer(serializers.HyperlinkedModelSerializer):
+class CustomerSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = Customer
-        fields = ["url", "user", "name", "email", "image"]
+        fields = [
+            "url",
+            "user",
+            "name",
+            "email",
+            "image",
+            "thumbnails",
+            *InvoiceBalanceModel.BALANCE_FIELDS,
+        ]
+        read_only_fields = InvoiceBalanceModel.BALANCE_FIELDS
+
 
+class CustomerListSerializer(
+    SparseFieldsetMixin, serializers.HyperlinkedModelSerializer
+):
+    thumbnails = ThumbnailsField()
 
-class CustomerListSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Customer
-        fields = ["url", "name", "email", "image"]
+        fields = [
+            "url",
+            "name",
+            "email",
+            "image",
+            "thumbnails",
+            *InvoiceBalanceModel.BALANCE_FIELDS,
+        ]
+        read_only_fields = InvoiceBalanceModel.BALANCE_FIELDS
+
 
+class SupplierSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
+    thumbnails = ThumbnailsField()
 
-class SupplierSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Supplier
-        fields = ["url", "user", "image"]
+        fields = [
+            "url",
+            "user",
+            "image",
+            "thumbnails",
+            *InvoiceBalanceModel.BALANCE_FIELDS,
+        ]
+        read_only_fields = InvoiceBalanceModel.BALANCE_FIELDS
 
 
-class InvoiceSerializer(serializers.HyperlinkedModelSerializer):
+class InvoiceSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Invoice
         fields = ["url", "customer", "supplier", "amount", "date", "status"]
+        extra_kwargs = {
+            # `Supplier.__str__` renders the user, e.g. in browsable API forms.
+            "supplier": {"queryset": Supplier.objects.select_related("user")},
+        }
 
     def create(self, validated_data):
         """
@@ -50,7 +96,251 @@ class InvoiceSerializer(serializers.HyperlinkedModelSerializer):
         return instance
 
 
-class InvoiceListSerializer(serializers.HyperlinkedModelSerializer):
+class InvoiceListSerializer(
+    SparseFieldsetMixin, serializers.HyperlinkedModelSerializer
+):
     class Meta:
         model = Invoice
         fields = ["url", "customer", "amount", "date", "status"]
+
+
+class InvoiceBulkListSerializer(serializers.ListSerializer):
+    """
+    Validate and write a list of invoices with a fixed number of queries.
+
+    Rows holding an invoice `url` update that invoice with the given fields,
+    the other rows create new invoices. Errors are reported per row.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not self.allow_empty and not data:
+            self.fail("empty")
+        if self.max_length is not None and len(data) > self.max_length:
+            self.fail("max_length", max_length=self.max_length)
+
+        rows, errors = [], []
+        for item in data:
+            try:
+                rows.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                rows.append(None)
+                errors.append(exc.detail)
+
+        self.validate_references(rows, errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return rows
+
+    def validate_references(self, rows, errors):
+        """
+        Check the customers, suppliers and invoices the rows refer to exist,
+        and that each invoice ends up with either a customer or a supplier.
+        """
+        valid_rows = [row for row in rows if row is not None]
+        references = {}
+        for name, model in (("customer", Customer), ("supplier", Supplier)):
+            pks = {row[name] for row in valid_rows if row.get(name) is not None}
+            references[name] = set(
+                model.objects.filter(pk__in=pks).values_list("pk", flat=True)
+            )
+        self.invoices = Invoice.objects.only(*Invoice.TRACKED_FIELDS).in_bulk(
+            {row["url"] for row in valid_rows if "url" in row}
+        )
+
+        for row, row_errors in zip(rows, errors):
+            if row is None:
+                continue
+            for name in ("customer", "supplier"):
+                if row.get(name) is not None and row[name] not in references[name]:
+                    field = self.child.fields[name]
+                    row_errors[name] = [field.error_messages["does_not_exist"]]
+        self.validate_invoices(rows, errors)
+
+    def validate_invoices(self, rows, errors):
+        """
+        Check the invoices of `self.invoices` the rows update exist, and that
+        each invoice ends up with either a customer or a supplier.
+        """
+        for row, row_errors in zip(rows, errors):
+            if row is None:
+                continue
+            if "url" in row:
+                invoice = self.invoices.get(row["url"])
+                if invoice is None:
+                    field = self.child.fields["url"]
+                    row_errors["url"] = [field.error_messages["does_not_exist"]]
+                    continue
+                customer_id = row.get("customer", invoice.customer_id)
+                supplier_id = row.get("supplier", invoice.supplier_id)
+            else:
+                customer_id, supplier_id = row.get("customer"), row.get("supplier")
+
+            error = Invoice.get_parties_error(customer_id, supplier_id)
+            if error:
+                row_errors.setdefault(api_settings.NON_FIELD_ERRORS_KEY, [error])
+
+    def create(self, validated_data):
+        """
+        Write the rows with `bulk_create`/`bulk_update` and return the invoices,
+        in the order of the rows. Must run inside a transaction.
+        """
+        # Read again under lock: the invoices may have changed since they were
+        # validated, and their previous states must be the persisted ones.
+        self.invoices = {
+            invoice.pk: invoice
+            for invoice in Invoice.objects.filter(
+                pk__in=[row["url"] for row in validated_data if "url" in row]
+            ).lock()
+        }
+        errors = [{} for _ in validated_data]
+        self.validate_invoices(validated_data, errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        batch_size = self.context.get("batch_size")
+        invoices, created, updated, changes = [], [], {}, []
+        now = timezone.now()
+        for row in validated_data:
+            values = {
+                f"{name}_id" if name in ("customer", "supplier") else name: value
+                for name, value in row.items()
+                if name != "url"
+            }
+            if "url" in row:
+                invoice = self.invoices[row["url"]]
+                previous = invoice_state(invoice)
+                for name, value in values.items():
+                    setattr(invoice, name, value)
+                invoice.updated_at = now
+                updated[invoice.pk] = invoice
+            else:
+                invoice = Invoice(**values)
+                previous = None
+                created.append(invoice)
+            changes.append((previous, invoice_state(invoice)))
+            invoices.append(invoice)
+
+        Invoice.objects.bulk_create(created, batch_size=batch_size)
+        if updated:
+            Invoice.objects.bulk_update(
+                updated.values(),
+                [*Invoice.TRACKED_FIELDS, "updated_at"],
+                batch_size=batch_size,
+            )
+        # Both bypass `Invoice.save` and its signals, update the aggregated
+        # tables in one go and invalidate the cached responses.
+        record_invoice_changes(changes)
+        bump_versions("invoicing.invoice")
+        return invoices
+
+
+class InvoiceBulkSerializer(serializers.ModelSerializer):
+    serializer_related_field = HyperlinkedPrimaryKeyField
+
+    url = HyperlinkedPrimaryKeyField(
+        view_name="invoice-detail", queryset=Invoice.objects.all(), required=False
+    )
+
+    class Meta:
+        model = Invoice
+        fields = ["url", "customer", "supplier", "amount", "date", "status"]
+        list_serializer_class = InvoiceBulkListSerializer
+
+    def validate(self, attrs):
+        if "url" not in attrs and "amount" not in attrs:
+            raise serializers.ValidationError(
+                {"amount": [self.fields["amount"].error_messages["required"]]}
+            )
+        return attrs
+
+
+class InvoiceFilterSerializer(serializers.Serializer):
+    """
+    Validate the arguments of `filter_invoices`.
+    """
+
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+    status = serializers.ChoiceField(choices=INVOICE_STATUS_CHOICES, required=False)
+    customer = serializers.IntegerField(required=False)
+    supplier = serializers.IntegerField(required=False)
+    amount_min = serializers.DecimalField(
+        max_digits=11, decimal_places=2, required=False
+    )
+    amount_max = serializers.DecimalField(
+        max_digits=11, decimal_places=2, required=False
+    )
+    search = serializers.CharField(
+        max_length=128,
+        required=False,
+        help_text="Start of the customer name or email, ignoring case and accents.",
+    )
+
+    def validate(self, attrs):
+        amount_min, amount_max = attrs.get("amount_min"), attrs.get("amount_max")
+        if (
+            amount_min is not None
+            and amount_max is not None
+            and amount_min > amount_max
+        ):
+            raise serializers.ValidationError(
+                {"amount_max": ["Must be greater than or equal to amount_min."]}
+            )
+        return attrs
+
+
+class InvoiceExportSerializer(InvoiceFilterSerializer):
+    """
+    Validate the options of an invoice export.
+    """
+
+    export_format = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default="csv")
+
+
+class InvoiceChangesSerializer(serializers.Serializer):
+    """
+    Validate the options of the invoice change feed.
+    """
+
+    since = serializers.CharField(
+        required=False,
+        help_text="Token of the last change received, all changes if omitted.",
+    )
+
+    def validate_since(self, value):
+        try:
+            return decode_change_token(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+
+class InvoiceAnalyticsSerializer(InvoiceFilterSerializer):
+    """
+    Validate the options of an invoice analytics report.
+    """
+
+    bucket = serializers.ChoiceField(choices=ANALYTICS_BUCKETS, default="month")
+    group_by = serializers.ChoiceField(choices=list(ANALYTICS_GROUPS), required=False)
+    top = serializers.IntegerField(min_value=1, max_value=100, required=False)
+    side = serializers.ChoiceField(choices=INVOICE_SIDE_CHOICES, required=False)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if "top" in attrs and attrs.get("group_by") not in ("customer", "supplier"):
+            raise serializers.ValidationError(
+                {"top": ["Requires grouping by customer or supplier."]}
+            )
+        return attrs
+
+
+class InvoiceAnalyticsRowSerializer(serializers.Serializer):
+    bucket = serializers.DateField()
+    status = serializers.CharField(required=False)
+    customer = serializers.IntegerField(source="customer_id", required=False)
+    supplier = serializers.IntegerField(source="supplier_id", required=False)
+    count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=20, decimal_places=2)
+    average = serializers.DecimalField(max_digits=20, decimal_places=2)
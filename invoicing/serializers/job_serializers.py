@@ -0,0 +1,87 @@
+from rest_framework import serializers
+
+from invoicing.models import Job
+
+
+class JobSerializer(serializers.HyperlinkedModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "url",
+            "id",
+            "name",
+            "params",
+            "status",
+            "progress_done",
+            "progress_total",
+            "result",
+            "error",
+            "attempts",
+            "max_attempts",
+            "run_after",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
+
+
+class JobCreateSerializer(serializers.ModelSerializer):
+    """
+    Validate a job to enqueue, its parameters with the serializer of its
+    handler.
+    """
+
+    class Meta:
+        model = Job
+        fields = ["name", "params"]
+
+    def validate_name(self, value):
+        from invoicing.jobs import JOB_HANDLERS
+
+        handler = JOB_HANDLERS.get(value)
+        if handler is None:
+            raise serializers.ValidationError(
+                f"Must be one of: {', '.join(sorted(JOB_HANDLERS))}."
+            )
+        if handler.admin_only and not self.context["request"].user.is_staff:
+            raise serializers.ValidationError("Only staff users may run this job.")
+        return value
+
+    def validate(self, attrs):
+        from invoicing.jobs import JOB_HANDLERS
+
+        handler = JOB_HANDLERS[attrs["name"]]
+        params = attrs.get("params") or {}
+        if handler.serializer_class is None:
+            if params:
+                raise serializers.ValidationError(
+                    {"params": ["This job takes no parameters."]}
+                )
+            attrs["params"] = {}
+            return attrs
+
+        serializer = handler.serializer_class(data=params)
+        if not serializer.is_valid():
+            raise serializers.ValidationError({"params": serializer.errors})
+        # Stored as JSON, the handler gets them validated again.
+        attrs["params"] = serializer.data
+        return attrs
+
+
+class ReconcileBalancesJobSerializer(serializers.Serializer):
+    fix = serializers.BooleanField(default=True)
+
+
+class SeedDbJobSerializer(serializers.Serializer):
+    """
+    Options of `manage.py seed_db`.
+    """
+
+    users = serializers.IntegerField(min_value=0, required=False)
+    suppliers = serializers.IntegerField(min_value=0, required=False)
+    admins = serializers.IntegerField(min_value=0, required=False)
+    days = serializers.IntegerField(min_value=1, required=False)
+    end_date = serializers.DateField(required=False)
+    invoices_per_day = serializers.IntegerField(min_value=0, required=False)
+    seed = serializers.IntegerField(required=False)
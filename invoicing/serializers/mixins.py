@@ -0,0 +1,61 @@
+from rest_framework import serializers
+
+
+class SparseFieldsetMixin:
+    """
+    Let the creator of the serializer pick the fields to render with
+    `fields`, and render relations as primary keys rather than hyperlinks with
+    `links="ids"`, in which case the `url` field is rendered as `id`.
+    """
+
+    links_choices = ("urls", "ids")
+
+    def __init__(self, *args, fields=None, links=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse_fields = fields
+        self.links = links or "urls"
+        if self.links not in self.links_choices:
+            raise serializers.ValidationError(
+                {"links": [f"Must be one of: {', '.join(self.links_choices)}."]}
+            )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.links == "ids":
+            fields = {
+                self.get_id_field_name(name, field): self.get_id_field(field)
+                for name, field in fields.items()
+            }
+
+        if self.sparse_fields is not None:
+            unknown = set(self.sparse_fields) - set(fields)
+            if unknown:
+                raise serializers.ValidationError(
+                    {"fields": [f"Unknown fields: {', '.join(sorted(unknown))}."]}
+                )
+            fields = {
+                name: field
+                for name, field in fields.items()
+                if name in self.sparse_fields
+            }
+        return fields
+
+    def get_id_field_name(self, name, field):
+        if isinstance(field, serializers.HyperlinkedIdentityField):
+            return self.Meta.model._meta.pk.name
+        return name
+
+    def get_id_field(self, field):
+        if isinstance(field, serializers.HyperlinkedIdentityField):
+            return serializers.ReadOnlyField()
+        if isinstance(field, serializers.HyperlinkedRelatedField):
+            return serializers.PrimaryKeyRelatedField(
+                read_only=True, source=field.source
+            )
+        if isinstance(field, serializers.ManyRelatedField) and isinstance(
+            field.child_relation, serializers.HyperlinkedRelatedField
+        ):
+            return serializers.PrimaryKeyRelatedField(
+                many=True, read_only=True, source=field.source
+            )
+        return field
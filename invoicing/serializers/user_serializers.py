@@ -3,26 +3,28 @@ from rest_framework import serializers
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 
-from invoicing.models import Customer
+from invoicing.serializers.mixins import SparseFieldsetMixin
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ["url", "username", "email", "groups"]
 
 
-class UserListSerializer(serializers.HyperlinkedModelSerializer):
-    customer = serializers.PrimaryKeyRelatedField(queryset=Customer.objects.all())
+class UserListSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
+    customers = serializers.PrimaryKeyRelatedField(
+        source="customer_set", many=True, read_only=True
+    )
 
     class Meta:
         model = User
-        fields = ["url", "username", "email", "customer"]
+        fields = ["url", "username", "email", "customers"]
 
 
-class GroupSerializer(serializers.HyperlinkedModelSerializer):
+class GroupSerializer(SparseFieldsetMixin, serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Group
         fields = ["url", "name"]
@@ -1,7 +1,120 @@
-from django.utils.translation import gettext_lazy as _
+from pathlib import Path
 
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 
 INVOICE_STATUS_CHOICES = (
     ("pending", _("Pending")),
     ("paid", _("Paid")),
 )
+
+INVOICE_SIDE_CHOICES = (
+    ("customer", _("Customer")),
+    ("supplier", _("Supplier")),
+)
+
+JOB_STATUS_CHOICES = (
+    ("queued", _("Queued")),
+    ("running", _("Running")),
+    ("succeeded", _("Succeeded")),
+    ("failed", _("Failed")),
+)
+
+# Default and maximum number of rows written per query by the bulk endpoint.
+INVOICE_BULK_BATCH_SIZE = getattr(settings, "INVOICE_BULK_BATCH_SIZE", 1000)
+INVOICE_BULK_MAX_BATCH_SIZE = getattr(settings, "INVOICE_BULK_MAX_BATCH_SIZE", 5000)
+# Maximum number of rows accepted by a single bulk request.
+INVOICE_BULK_MAX_ROWS = getattr(settings, "INVOICE_BULK_MAX_ROWS", 50000)
+
+# Number of rows fetched from the database, and rendered, at a time by exports.
+INVOICE_EXPORT_CHUNK_SIZE = getattr(settings, "INVOICE_EXPORT_CHUNK_SIZE", 2000)
+# Directory of the files written by the `export` job. It must not be served:
+# `/api/jobs/<id>/download/` returns them to the users who can see the job.
+INVOICING_EXPORT_ROOT = getattr(
+    settings, "INVOICING_EXPORT_ROOT", Path(settings.BASE_DIR) / "private" / "exports"
+)
+
+# Cache used for the API responses and how long, in seconds, entries are kept.
+INVOICING_CACHE_ALIAS = getattr(settings, "INVOICING_CACHE_ALIAS", "default")
+INVOICING_CACHE_TIMEOUT = getattr(settings, "INVOICING_CACHE_TIMEOUT", 300)
+
+# Requests slower than this, in milliseconds, are logged with their slowest
+# queries.
+INVOICING_SLOW_REQUEST_MS = getattr(settings, "INVOICING_SLOW_REQUEST_MS", 500)
+INVOICING_SLOW_REQUEST_QUERIES = getattr(settings, "INVOICING_SLOW_REQUEST_QUERIES", 5)
+
+# Pragmas set on every new SQLite connection, see `invoicing.db`.
+INVOICING_SQLITE_PRAGMAS = getattr(settings, "INVOICING_SQLITE_PRAGMAS", {})
+
+# Database alias `list`/`retrieve` actions read from, `None` to read from the
+# primary. After a write, a client keeps reading from the primary for
+# `INVOICING_STICKY_SECONDS`, so that it sees its own writes despite the
+# replication lag.
+INVOICING_REPLICA_ALIAS = getattr(settings, "INVOICING_REPLICA_ALIAS", None)
+INVOICING_STICKY_SECONDS = getattr(settings, "INVOICING_STICKY_SECONDS", 10)
+INVOICING_STICKY_COOKIE = getattr(
+    settings, "INVOICING_STICKY_COOKIE", "invoicing_primary"
+)
+
+# Background jobs, see `invoicing.jobs`. Failed jobs are retried after
+# `INVOICING_JOB_RETRY_DELAY` seconds, doubled on every attempt. Running jobs
+# record a heartbeat every `INVOICING_JOB_HEARTBEAT_INTERVAL` seconds, those
+# without one for `INVOICING_JOB_TIMEOUT` seconds are considered lost with
+# their worker and run again.
+INVOICING_JOB_RETRY_DELAY = getattr(settings, "INVOICING_JOB_RETRY_DELAY", 30)
+INVOICING_JOB_HEARTBEAT_INTERVAL = getattr(
+    settings, "INVOICING_JOB_HEARTBEAT_INTERVAL", 30
+)
+INVOICING_JOB_TIMEOUT = getattr(settings, "INVOICING_JOB_TIMEOUT", 300)
+# Seconds an idle worker waits before looking for queued jobs again.
+INVOICING_JOB_POLL_INTERVAL = getattr(settings, "INVOICING_JOB_POLL_INTERVAL", 1)
+
+# Responses to requests with an `Idempotency-Key` header are replayed to the
+# retries of the request for this many seconds, see `invoicing.idempotency`.
+INVOICING_IDEMPOTENCY_TTL = getattr(settings, "INVOICING_IDEMPOTENCY_TTL", 24 * 3600)
+# Seconds after which the first attempt of a request with an `Idempotency-Key`
+# that has not completed, e.g. because its process crashed, is given up and a
+# retry runs the request again. Should exceed the longest request duration.
+INVOICING_IDEMPOTENCY_LOCK_TIMEOUT = getattr(
+    settings, "INVOICING_IDEMPOTENCY_LOCK_TIMEOUT", 300
+)
+
+# Token bucket of the invoice ingestion of every user, in invoices: created
+# invoices consume one token each, refilled at `INVOICING_INGESTION_RATE` per
+# second up to `INVOICING_INGESTION_BURST`.
+INVOICING_INGESTION_RATE = getattr(settings, "INVOICING_INGESTION_RATE", 1000)
+INVOICING_INGESTION_BURST = getattr(
+    settings, "INVOICING_INGESTION_BURST", INVOICE_BULK_MAX_ROWS
+)
+
+# Admin changelists count up to this many rows. Past it, unfiltered lists
+# show the database's estimate of the table size and filtered ones this
+# limit, see `invoicing.pagination.EstimatedCountPaginator`.
+INVOICING_ADMIN_COUNT_LIMIT = getattr(settings, "INVOICING_ADMIN_COUNT_LIMIT", 10000)
+
+# `/api/invoices/changes/` only reports the changes older than this many
+# seconds, so that a client resuming after the last reported change does not
+# skip writes still being committed with an earlier `updated_at`. Should
+# exceed the duration of the longest transaction writing invoices.
+INVOICING_CHANGES_SAFETY_WINDOW = getattr(
+    settings, "INVOICING_CHANGES_SAFETY_WINDOW", 60
+)
+# Deleted invoices are kept as tombstones, for the change feed to report the
+# deletions, for this many seconds; the `purge_tombstones` job then deletes them
+# for good. Change tokens preceding a purged deletion are rejected: the client
+# must sync again from the start.
+INVOICING_TOMBSTONE_RETENTION = getattr(
+    settings, "INVOICING_TOMBSTONE_RETENTION", 30 * 24 * 3600
+)
+
+# Thumbnails of the customer and supplier images, see `invoicing.thumbnails`:
+# the largest side of every variant in pixels, the WebP quality, the threads
+# generating them, 0 to generate them in the saving thread, and the bytes
+# the variants may take on disk before the least recently generated or reused
+# are evicted.
+INVOICING_THUMBNAIL_SIZES = getattr(settings, "INVOICING_THUMBNAIL_SIZES", (64, 256))
+INVOICING_THUMBNAIL_QUALITY = getattr(settings, "INVOICING_THUMBNAIL_QUALITY", 80)
+INVOICING_THUMBNAIL_WORKERS = getattr(settings, "INVOICING_THUMBNAIL_WORKERS", 2)
+INVOICING_THUMBNAIL_CACHE_SIZE = getattr(
+    settings, "INVOICING_THUMBNAIL_CACHE_SIZE", 256 * 1024 * 1024
+)
@@ -0,0 +1,30 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from invoicing.cache import bump_versions
+from invoicing.db import apply_sqlite_pragmas
+from invoicing.models import Customer, Invoice, Supplier
+from invoicing.settings import INVOICING_SQLITE_PRAGMAS
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=Supplier)
+@receiver(post_delete, sender=Supplier)
+def invalidate_cached_responses(sender, **kwargs):
+    """
+    Invalidate the cached responses depending on the changed model.
+    """
+    bump_versions(sender._meta.label_lower)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """
+    Tune the new database connections.
+    """
+    if connection.vendor == "sqlite" and INVOICING_SQLITE_PRAGMAS:
+        apply_sqlite_pragmas(connection, INVOICING_SQLITE_PRAGMAS)
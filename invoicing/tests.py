@@ -1,3 +1,2123 @@
-from django.test import TestCase
+import ast
+import csv
+import io
+import json
+import os
+import runpy
+import shutil
+import struct
+import tempfile
+import time
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
+from urllib.parse import urlparse
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from invoicing import columnar, parsers
+from invoicing.benchmarks import SCENARIOS, Benchmark, compare_results
+from invoicing.cache import get_cache
+from invoicing.changes import purge_tombstones
+from invoicing.filters import search_customers
+from invoicing.idempotency import purge_idempotency_keys
+from invoicing.metrics import registry
+from invoicing.signals import configure_connection
+from invoicing.throttling import InvoiceIngestionThrottle
+from invoicing.management.commands.seed_db import SEED_END_DATE
+from invoicing.jobs import (
+    JOB_HANDLERS,
+    JobHandler,
+    claim_job,
+    enqueue,
+    fail_job,
+    heartbeat,
+    run_job,
+)
+from invoicing.models import (
+    Customer,
+    IdempotencyKey,
+    Invoice,
+    InvoiceMonthlyRollup,
+    Job,
+    Supplier,
+)
+from invoicing.pagination import EstimatedCountPaginator, KeysetPageNumberPagination
+from invoicing.parsers import FastJSONParser
+from invoicing.renderers import FastJSONRenderer
+from invoicing.serializers.invoicing_serializers import InvoiceBulkListSerializer
+from invoicing.rollups import rebuild_monthly_rollups, reconcile_balances
+from invoicing.routers import read_database
+from invoicing.thumbnails import (
+    _generate_thumbnails_task,
+    generate_thumbnails,
+    prune_thumbnails,
+)
+from invoicing.urls import router
+
+User = get_user_model()
+
+
+class InvoicingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="tester", first_name="Test", last_name="Er", password="pass"
+        )
+        cls.customer = Customer.objects.create(
+            user=cls.user, name="Test Customer", email="customer@ocg.com"
+        )
+        cls.supplier = Supplier.objects.create(user=cls.user)
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_invoice(self, **kwargs):
+        kwargs.setdefault("amount", Decimal("10.00"))
+        kwargs.setdefault("date", datetime.now(timezone.utc))
+        if "supplier" not in kwargs:
+            kwargs.setdefault("customer", self.customer)
+        return Invoice.objects.create(**kwargs)
+
+
+class QueryCountAssertionMixin:
+    """
+    Assertions on the number of queries an endpoint runs as its data grows.
+    """
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(context), response
+
+    def assertQueryCountIndependentOfPageSize(self, urls, populate, sizes=(2, 8)):
+        """
+        Call `populate(size)` for each of `sizes` and check that listing each
+        of `urls`, which must then return `size` rows, always runs the same
+        number of queries.
+        """
+        counts = {url: [] for url in urls}
+        for size in sizes:
+            populate(size)
+            for url in urls:
+                count, response = self.count_queries(url)
+                if "results" in response.data:
+                    self.assertEqual(len(response.data["results"]), size, url)
+                counts[url].append(count)
+
+        for url, url_counts in counts.items():
+            with self.subTest(url=url):
+                self.assertEqual(
+                    len(set(url_counts)),
+                    1,
+                    f"{url} ran {url_counts} queries for {sizes} rows.",
+                )
+
+
+class InvoiceMonthlyRollupTests(InvoicingTestCase):
+    def rollup(self, month, side="customer", status="pending"):
+        return InvoiceMonthlyRollup.objects.get(month=month, side=side, status=status)
+
+    def rollup_rows(self):
+        return list(
+            InvoiceMonthlyRollup.objects.filter(count__gt=0).values_list(
+                "month", "side", "status", "count", "total", "total_squares"
+            )
+        )
+
+    def test_rollups_follow_invoice_writes(self):
+        january = datetime(2025, 1, 15, tzinfo=timezone.utc)
+        invoice = self.create_invoice(amount=Decimal("10.50"), date=january)
+        self.create_invoice(amount=Decimal("4.50"), date=january)
+        self.create_invoice(supplier=self.supplier, amount=Decimal("100"), date=january)
+
+        rollup = self.rollup(january.date().replace(day=1))
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(rollup.total, Decimal("15.00"))
+        self.assertEqual(rollup.total_squares, Decimal("130.5000"))
+        self.assertEqual(self.rollup(rollup.month, side="supplier").count, 1)
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.status = "paid"
+        invoice.date = datetime(2025, 2, 1, tzinfo=timezone.utc)
+        invoice.save()
+        self.assertEqual(self.rollup(rollup.month).count, 1)
+        self.assertEqual(self.rollup(rollup.month).total, Decimal("4.50"))
+        self.assertEqual(self.rollup(invoice.date.date(), status="paid").count, 1)
+
+        invoice.delete()
+        self.assertEqual(self.rollup(invoice.date.date(), status="paid").count, 0)
+
+    def test_saves_of_stale_instances_are_not_lost(self):
+        invoice = self.create_invoice(amount=Decimal("10.00"))
+        first = Invoice.objects.get(pk=invoice.pk)
+        second = Invoice.objects.get(pk=invoice.pk)
+
+        first.amount = Decimal("25.00")
+        first.save()
+        # Loaded before the first save, which changed the amount.
+        second.status = "paid"
+        second.save(update_fields=["status", "updated_at"])
+
+        incremental = self.rollup_rows()
+        rebuild_monthly_rollups()
+        self.assertEqual(self.rollup_rows(), incremental)
+        self.assertEqual(
+            self.rollup(invoice.date.date().replace(day=1), status="paid").total,
+            Decimal("25.00"),
+        )
+        self.assertEqual(reconcile_balances(fix=False)[Customer], 0)
+
+    def test_rebuild_matches_incremental_maintenance(self):
+        for date, amount in (
+            (datetime(2024, 12, 3, tzinfo=timezone.utc), "12.34"),
+            (datetime(2025, 1, 9, tzinfo=timezone.utc), "0.99"),
+            (datetime(2025, 1, 10, tzinfo=timezone.utc), "1000.00"),
+        ):
+            self.create_invoice(amount=Decimal(amount), date=date)
+        self.create_invoice(supplier=self.supplier, amount=Decimal("42.42"))
+        incremental = self.rollup_rows()
+
+        rebuild_monthly_rollups()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+    def test_rebuild_blocks_invoice_writes_first(self):
+        self.create_invoice()
+        with CaptureQueriesContext(connection) as context:
+            rebuild_monthly_rollups()
+        # Written after the invoices are read, deltas committed in between
+        # would be lost.
+        invoice_queries = [
+            query["sql"]
+            for query in context.captured_queries
+            if '"invoicing_invoice"' in query["sql"]
+        ]
+        self.assertRegex(invoice_queries[0], r"^(LOCK TABLE|UPDATE)")
+        self.assertTrue(invoice_queries[1].startswith("SELECT"))
+
+    def test_dashboard_reads_rollups(self):
+        self.create_invoice(amount=Decimal("30.00"))
+        self.create_invoice(amount=Decimal("10.00"), status="paid")
+        self.create_invoice(supplier=self.supplier, amount=Decimal("15.00"))
+
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/dashboard")
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["alltime_stats"]["count"], 2)
+        # Aggregates are numbers, unlike the serialized decimal fields.
+        self.assertIsInstance(data["alltime_profit"], float)
+        self.assertEqual(Decimal(str(data["alltime_profit"])), Decimal("25.00"))
+        self.assertEqual(
+            Decimal(str(data["alltime_stats"]["outstanding"])), Decimal("30.00")
+        )
+        self.assertEqual(
+            Decimal(str(data["alltime_supplier_stats"]["outstanding"])),
+            Decimal("15.00"),
+        )
+        month = datetime.now(timezone.utc).strftime("%m-%Y")
+        self.assertEqual(data["monthly_invoice_stats"][month]["count"], 2)
+        self.assertEqual(
+            Decimal(str(data["monthly_invoice_stats"][month]["avg"])), Decimal("20")
+        )
+        self.assertEqual(
+            Decimal(str(data["monthly_invoice_stats"][month]["profit"])),
+            Decimal("25.00"),
+        )
+
+    def test_dashboard_follows_writes(self):
+        # The async views only support session authentication.
+        self.client.force_login(self.user)
+        invoice = self.create_invoice(amount=Decimal("30.00"))
+        for url in ("/api/dashboard", "/api/async/dashboard"):
+            self.assertEqual(self.client.get(url).json()["alltime_stats"]["count"], 1)
+
+        self.create_invoice(amount=Decimal("5.00"))
+        invoice.status = "paid"
+        invoice.save()
+        for url in ("/api/dashboard", "/api/async/dashboard"):
+            with self.subTest(url=url):
+                stats = self.client.get(url).json()["alltime_stats"]
+                self.assertEqual(stats["count"], 2)
+                self.assertEqual(Decimal(str(stats["outstanding"])), Decimal("5.00"))
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite specific.")
+class InvoiceIndexTests(InvoicingTestCase):
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return " | ".join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = self.query_plan(queryset)
+        self.assertIn(index_name, plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_listing_uses_date_index(self):
+        self.assertUsesIndex(
+            Invoice.objects.order_by("-date", "-id")[:10],
+            "invoicing_invoice_date_idx",
+        )
+
+    def test_customer_listing_uses_customer_date_index(self):
+        self.assertUsesIndex(
+            Invoice.objects.filter(customer=self.customer).order_by("-date")[:10],
+            "invoicing_inv_customer_idx",
+        )
+
+    def test_side_statistics_use_partial_indexes(self):
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        date_range = {"date__gte": start, "date__lt": start + timedelta(days=31)}
+        for lookup, index_name in (
+            ({"supplier__isnull": True}, "invoicing_inv_cust_side_idx"),
+            ({"customer__isnull": True}, "invoicing_inv_supp_side_idx"),
+        ):
+            queryset = Invoice.objects.filter(**lookup, **date_range).values(
+                "date", "amount"
+            )
+            plan = self.query_plan(queryset)
+            self.assertIn(
+                f"USING COVERING INDEX {index_name} (date>? AND date<?)", plan
+            )
+
+
+class KeysetPaginationTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # Pairs of invoices share a date so the id tie-breaker is exercised.
+        self.invoices = [
+            self.create_invoice(date=start + timedelta(days=index // 2))
+            for index in range(25)
+        ]
+
+    def invoice_url(self, invoice):
+        return f"http://testserver/api/invoices/{invoice.pk}/"
+
+    def test_cursor_pages_cover_all_invoices_once(self):
+        urls, next_url, pages = [], "/api/invoices/?cursor=", 0
+        while next_url:
+            with self.assertNumQueries(1):
+                response = self.client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            urls.extend(invoice["url"] for invoice in response.data["results"])
+            next_url = response.data["next"]
+            pages += 1
+
+        expected = sorted(self.invoices, key=lambda i: (i.date, i.pk), reverse=True)
+        self.assertEqual(urls, [self.invoice_url(invoice) for invoice in expected])
+        self.assertEqual(pages, 3)
+
+    def test_cursor_pages_are_stable_under_inserts(self):
+        first_page = self.client.get("/api/invoices/?cursor=").data
+        # Newer invoices land before the cursor and must not shift the next page.
+        for _ in range(5):
+            self.create_invoice()
+        second_page = self.client.get(first_page["next"]).data
+
+        newest_first = sorted(self.invoices, key=lambda i: (i.date, i.pk), reverse=True)
+        self.assertEqual(
+            [invoice["url"] for invoice in second_page["results"]],
+            [self.invoice_url(invoice) for invoice in newest_first[10:20]],
+        )
+
+    def test_page_number_mode_can_skip_count(self):
+        response = self.client.get("/api/invoices/?page=2&count=false")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertIn("page=3", response.data["next"])
+        self.assertEqual(
+            response.data["previous"], "http://testserver/api/invoices/?count=false"
+        )
+        self.assertEqual(self.client.get("/api/invoices/").data["count"], 25)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/invoices/?cursor=bm90LWpzb24")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            response.data["detail"], KeysetPageNumberPagination.invalid_cursor_message
+        )
+
+
+class ListQueryCountTests(QueryCountAssertionMixin, InvoicingTestCase):
+    def populate(self, size):
+        group = Group.objects.get_or_create(name="CUSTOMER")[0]
+        for index in range(User.objects.count(), size):
+            user = User.objects.create_user(
+                username=f"user{index}", first_name="User", last_name=str(index)
+            )
+            user.groups.add(group)
+        for model, create in (
+            (Group, lambda index: Group.objects.create(name=f"group{index}")),
+            (
+                Customer,
+                lambda index: Customer.objects.create(
+                    name=f"Customer {index}", email=f"customer{index}@ocg.com"
+                ),
+            ),
+            (
+                Supplier,
+                lambda index: Supplier.objects.create(user=User.objects.last()),
+            ),
+            (Invoice, lambda index: self.create_invoice()),
+            (Job, lambda index: enqueue("rebuild_rollups", user=self.user)),
+        ):
+            for index in range(model.objects.count(), size):
+                create(index)
+
+    def test_list_endpoints(self):
+        self.assertQueryCountIndependentOfPageSize(
+            [
+                f"/api/{prefix}/?format={format}"
+                for prefix, viewset, basename in router.registry
+                for format in ("json", "api")
+            ],
+            self.populate,
+        )
+
+
+class SparseFieldsetTests(InvoicingTestCase):
+    def test_list_serializers(self):
+        customer = self.client.get("/api/customers/").json()["results"][0]
+        self.assertNotIn("user", customer)
+        self.assertIn("outstanding_total", customer)
+        self.assertIn("user", self.client.get(customer["url"]).json())
+
+        user = self.client.get("/api/users/").json()["results"][0]
+        self.assertEqual(user["customers"], [self.customer.pk])
+
+    def test_fields_trim_output_and_columns(self):
+        self.create_invoice()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/api/invoices/?fields=amount,date")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()["results"][0]), {"amount", "date"})
+        select = next(
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('SELECT "invoicing_invoice"."id"')
+        )
+        self.assertIn('"invoicing_invoice"."amount"', select)
+        self.assertNotIn('"invoicing_invoice"."status"', select)
+
+    def test_links_ids(self):
+        invoice = self.create_invoice()
+        response = self.client.get(f"/api/invoices/{invoice.pk}/?links=ids")
+        data = response.json()
+        self.assertEqual(data["id"], invoice.pk)
+        self.assertEqual(data["customer"], self.customer.pk)
+        self.assertNotIn("url", data)
+
+        # Async views only support session authentication.
+        self.client.force_login(self.user)
+        response = self.client.get("/api/async/invoices/?links=ids&fields=id")
+        self.assertEqual(response.json()["results"], [{"id": invoice.pk}])
+
+    def test_invalid_parameters(self):
+        self.client.force_login(self.user)
+        for url in (
+            "/api/invoices/?fields=amount,nope",
+            "/api/invoices/?links=names",
+            "/api/async/customers/?fields=nope",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class InvoiceFilterTests(InvoicingTestCase):
+    url = "/api/invoices/"
+
+    def amounts(self, query, **kwargs):
+        response = self.client.get(f"{self.url}?{query}", **kwargs)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [Decimal(invoice["amount"]) for invoice in response.data["results"]]
+
+    def test_filters(self):
+        other = Customer.objects.create(name="Élodie Martin", email="EMartin@ocg.com")
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for day, amount, customer in (
+            (0, "5.00", self.customer),
+            (1, "15.00", other),
+            (2, "25.00", other),
+        ):
+            self.create_invoice(
+                amount=Decimal(amount),
+                date=start + timedelta(days=day),
+                customer=customer,
+            )
+        self.create_invoice(amount=Decimal("35.00"), date=start, supplier=self.supplier)
+        Invoice.objects.filter(amount=Decimal("25.00")).update(status="paid")
+
+        for query, expected in (
+            ("status=paid", ["25.00"]),
+            ("date_from=2025-01-02T00:00Z&date_to=2025-01-03T00:00Z", ["15.00"]),
+            ("amount_min=10&amount_max=25", ["25.00", "15.00"]),
+            (f"customer={self.customer.pk}", ["5.00"]),
+            (f"supplier={self.supplier.pk}", ["35.00"]),
+            ("search=elo", ["25.00", "15.00"]),
+            ("search=%20EMAR", ["25.00", "15.00"]),
+            ("search=martin", []),
+            ("search=test%20cust&status=pending", ["5.00"]),
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.amounts(query), [Decimal(amount) for amount in expected]
+                )
+
+    def test_ordering(self):
+        for amount in ("20.00", "10.00", "30.00", "10.00"):
+            self.create_invoice(amount=Decimal(amount))
+
+        self.assertEqual(self.amounts("ordering=amount&cursor="), [10, 10, 20, 30])
+        self.assertEqual(self.amounts("ordering=-amount"), [30, 20, 10, 10])
+        for query in (
+            "ordering=status",
+            "ordering=amount,date",
+            "amount_min=5&amount_max=1",
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(f"{self.url}?{query}")
+                self.assertEqual(response.status_code, 400)
+
+    def test_customer_normalized_fields(self):
+        self.assertEqual(self.customer.name_normalized, "test customer")
+        self.customer.name = "  Zoë   Ünal "
+        self.customer.save(update_fields=["name"])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.name_normalized, "zoe unal")
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite query plans")
+    def test_filters_use_indexes(self):
+        plans = {
+            "invoicing_cust_name_norm_idx": search_customers(
+                Customer.objects.all(), "test"
+            ),
+            "invoicing_invoice_amount_idx": Invoice.objects.order_by("-amount", "-id"),
+            "invoicing_inv_status_idx": Invoice.objects.filter(status="paid"),
+        }
+        for index, queryset in plans.items():
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+
+class InvoiceBulkTests(InvoicingTestCase):
+    url = "/api/invoices/bulk/"
+
+    def customer_url(self, customer=None):
+        return f"http://testserver/api/customers/{(customer or self.customer).pk}/"
+
+    def supplier_url(self):
+        return f"http://testserver/api/suppliers/{self.supplier.pk}/"
+
+    def test_bulk_create_and_update(self):
+        invoice = self.create_invoice(amount=Decimal("5.00"))
+        rows = [
+            {"customer": self.customer_url(), "amount": f"{index}.25"}
+            for index in range(20)
+        ]
+        rows.append({"supplier": self.supplier_url(), "amount": "99.99"})
+        rows.append(
+            {"url": f"http://testserver/api/invoices/{invoice.pk}/", "status": "paid"}
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f"{self.url}?batch_size=8", rows, format="json")
+
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith('INSERT INTO "invoicing_invoice"')
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 22)
+        self.assertEqual(Invoice.objects.count(), 22)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "paid")
+        self.assertEqual(invoice.amount, Decimal("5.00"))
+
+        incremental = list(InvoiceMonthlyRollup.objects.values_list("count", "total"))
+        rebuild_monthly_rollups()
+        self.assertEqual(
+            list(InvoiceMonthlyRollup.objects.values_list("count", "total")),
+            incremental,
+        )
+
+    def test_concurrent_updates_are_not_lost(self):
+        invoice = self.create_invoice(amount=Decimal("5.00"))
+        deleted = self.create_invoice(amount=Decimal("7.00"))
+        create = InvoiceBulkListSerializer.create
+
+        def create_after_concurrent_writes(serializer, validated_data):
+            # Other requests write the invoices once the rows are validated.
+            concurrent = Invoice.objects.get(pk=invoice.pk)
+            concurrent.amount = Decimal("50.00")
+            concurrent.save()
+            Invoice.objects.get(pk=deleted.pk).delete()
+            return create(serializer, validated_data)
+
+        url = f"http://testserver/api/invoices/{invoice.pk}/"
+        with mock.patch.object(
+            InvoiceBulkListSerializer, "create", create_after_concurrent_writes
+        ):
+            response = self.client.post(
+                self.url, [{"url": url, "status": "paid"}], format="json"
+            )
+            self.assertEqual(response.status_code, 201, response.data)
+            response = self.client.post(
+                self.url,
+                [{"url": f"http://testserver/api/invoices/{deleted.pk}/"}],
+                format="json",
+            )
+            self.assertEqual(response.status_code, 400)
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.amount, invoice.status), (Decimal("50.00"), "paid"))
+        self.assertEqual(reconcile_balances(fix=False)[Customer], 0)
+        rollups = InvoiceMonthlyRollup.objects.filter(count__gt=0)
+        incremental = list(rollups.values_list("count", "total"))
+        rebuild_monthly_rollups()
+        self.assertEqual(list(rollups.values_list("count", "total")), incremental)
+
+    def test_bulk_create_from_ndjson(self):
+        lines = "\n".join(
+            f'{{"customer": "{self.customer_url()}", "amount": "1.50"}}'
+            for _ in range(3)
+        )
+        response = self.client.post(
+            self.url, lines, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Invoice.objects.count(), 3)
+
+    def test_bulk_errors_are_reported_per_row(self):
+        rows = [
+            {"customer": self.customer_url(), "amount": "1.00"},
+            {"customer": self.customer_url(), "supplier": self.supplier_url()},
+            {"amount": "1.00"},
+            {"customer": "http://testserver/api/customers/0/", "amount": "1.00"},
+            {"customer": self.customer_url(), "amount": "not a number"},
+        ]
+        response = self.client.post(self.url, rows, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.data
+        self.assertEqual(errors[0], {})
+        self.assertEqual(set(errors[1]), {"amount"})
+        self.assertIn("non_field_errors", errors[2])
+        self.assertIn("customer", errors[3])
+        self.assertIn("amount", errors[4])
+        self.assertFalse(Invoice.objects.exists())
+
+
+class InvoiceExportTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for day in range(10):
+            self.create_invoice(
+                date=start + timedelta(days=day),
+                status="paid" if day % 2 else "pending",
+            )
+        self.create_invoice(supplier=self.supplier, date=start)
+
+    def test_csv_export_streams_filtered_rows(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/invoices/export/?date_from=2025-01-03&date_to=2025-01-08"
+                "&status=paid&customer=%d" % self.customer.pk
+            )
+            content = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            [row["date"][:10] for row in rows], ["2025-01-04", "2025-01-06"]
+        )
+        self.assertEqual(rows[0]["amount"], "10.00")
+        self.assertEqual(rows[0]["supplier_id"], "")
+
+    def test_ndjson_export(self):
+        response = self.client.get(
+            "/api/invoices/export/?export_format=ndjson&supplier=%d" % self.supplier.pk
+        )
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["supplier_id"], self.supplier.pk)
+
+    def test_invalid_filters_are_rejected(self):
+        response = self.client.get("/api/invoices/export/?status=unknown")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("status", response.data)
+
+    def test_export_command(self):
+        output = io.StringIO()
+        call_command(
+            "export_invoices", "--date-from=2025-01-09", "--chunk-size=1", stdout=output
+        )
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual(
+            [row["date"][:10] for row in rows], ["2025-01-09", "2025-01-10"]
+        )
+
+
+@mock.patch("invoicing.changes.INVOICING_CHANGES_SAFETY_WINDOW", 0)
+class InvoiceChangesTests(InvoicingTestCase):
+    url = "/api/invoices/changes/"
+
+    def changes(self, since=None):
+        url = self.url if since is None else f"{self.url}?since={since}"
+        # With a token, the purge watermark is read too.
+        with self.assertNumQueries(1 if since is None else 2):
+            response = self.client.get(url)
+            content = b"".join(response.streaming_content).decode()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.token = response["Change-Token"]
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_soft_delete(self):
+        invoice = self.create_invoice(amount=Decimal("5.00"))
+        response = self.client.delete(f"/api/invoices/{invoice.pk}/")
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(
+            self.client.get(f"/api/invoices/{invoice.pk}/").status_code, 404
+        )
+        self.assertEqual(self.client.get("/api/invoices/").data["count"], 0)
+        self.assertFalse(Invoice.objects.exists())
+        self.assertIsNotNone(Invoice.all_objects.get().deleted_at)
+        self.assertEqual(Customer.objects.get().invoice_count, 0)
+        self.assertEqual(InvoiceMonthlyRollup.objects.get().count, 0)
+
+    def test_queryset_delete_is_soft(self):
+        for amount in ("1.00", "2.00", "3.00"):
+            self.create_invoice(amount=Decimal(amount))
+        count, _ = Invoice.objects.filter(amount__lt=3).delete()
+
+        self.assertEqual(count, 2)
+        self.assertEqual(Invoice.all_objects.count(), 3)
+        self.assertEqual(Customer.objects.get().invoice_total, Decimal("3.00"))
+        self.assertEqual(InvoiceMonthlyRollup.objects.get().count, 1)
+        self.assertEqual(set(reconcile_balances(fix=False).values()), {0})
+
+    def test_changes_since_token(self):
+        first = self.create_invoice(amount=Decimal("1.00"))
+        second = self.create_invoice(amount=Decimal("2.00"))
+        third = self.create_invoice(amount=Decimal("3.00"))
+        first.amount = Decimal("1.50")
+        first.save()
+        second.delete()
+
+        rows = self.changes()
+        self.assertEqual([row["id"] for row in rows], [third.pk, first.pk, second.pk])
+        self.assertEqual(rows[1]["amount"], "1.50")
+        self.assertEqual([row["deleted"] for row in rows], [False, False, True])
+        self.assertEqual(self.changes(rows[-1]["token"]), [])
+        self.assertEqual(
+            [row["id"] for row in self.changes(rows[0]["token"])],
+            [first.pk, second.pk],
+        )
+
+        third.status = "paid"
+        third.save()
+        rows = self.changes(rows[-1]["token"])
+        self.assertEqual(
+            [(row["id"], row["status"]) for row in rows], [(third.pk, "paid")]
+        )
+
+    def test_recent_changes_are_held_back(self):
+        self.create_invoice()
+        with mock.patch("invoicing.changes.INVOICING_CHANGES_SAFETY_WINDOW", 60):
+            self.assertEqual(self.changes(), [])
+        self.assertEqual(len(self.changes()), 1)
+
+    def test_invalid_token(self):
+        for token in ("nope", "bm9wZXwx"):
+            response = self.client.get(f"{self.url}?since={token}")
+            self.assertEqual(response.status_code, 400, token)
+            self.assertIn("since", response.data)
+
+    def test_resume_token(self):
+        self.assertEqual(self.changes(), [])
+        invoice = self.create_invoice()
+        self.assertEqual([row["id"] for row in self.changes(self.token)], [invoice.pk])
+        self.assertEqual(self.changes(self.token), [])
+        self.assertEqual(self.changes(self.token), [])
+
+    def test_expired_token(self):
+        old = datetime.now(timezone.utc) - timedelta(days=40)
+        kept, deleted = self.create_invoice(), self.create_invoice()
+        deleted.delete()
+        Invoice.all_objects.filter(pk=kept.pk).update(updated_at=old)
+        Invoice.all_objects.filter(pk=deleted.pk).update(
+            updated_at=old + timedelta(days=5), deleted_at=old + timedelta(days=5)
+        )
+
+        # The last change is older than the retention, its token still works.
+        rows = self.changes()
+        self.assertEqual([row["id"] for row in rows], [kept.pk, deleted.pk])
+        self.assertEqual(self.changes(rows[-1]["token"]), [])
+        token = self.token
+
+        # Tokens preceding a purged deletion expire.
+        self.assertEqual(purge_tombstones(), 1)
+        response = self.client.get(f"{self.url}?since={rows[0]['token']}")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Expired", response.data["since"][0])
+        self.assertEqual(self.changes(rows[-1]["token"]), [])
+        self.assertEqual(self.changes(token), [])
+        self.assertEqual(self.changes(), [row for row in rows if row["id"] == kept.pk])
+
+    def test_purge_tombstones(self):
+        invoice = self.create_invoice()
+        invoice.delete()
+        url = f"/api/customers/{self.customer.pk}/"
+
+        # The tombstone still references the customer.
+        call_command("purge_tombstones", stdout=io.StringIO())
+        self.assertEqual(Invoice.all_objects.count(), 1)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            response.data["detail"],
+            "This customer can not be deleted while invoices refer to it.",
+        )
+
+        with mock.patch("invoicing.changes.INVOICING_TOMBSTONE_RETENTION", 0):
+            call_command("purge_tombstones", stdout=io.StringIO())
+        self.assertFalse(Invoice.all_objects.exists())
+        self.assertEqual(self.client.delete(url).status_code, 204)
+
+
+class ResponseCacheTests(InvoicingTestCase):
+    def test_responses_are_cached_until_the_data_changes(self):
+        invoice = self.create_invoice()
+        first = self.client.get("/api/invoices/")
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/invoices/")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        invoice.status = "paid"
+        invoice.save()
+        third = self.client.get("/api/invoices/")
+        self.assertEqual(third.data["results"][0]["status"], "paid")
+        self.assertNotEqual(third["ETag"], first["ETag"])
+
+    def test_entries_are_per_user_and_query(self):
+        self.create_invoice()
+        self.client.get("/api/invoices/")
+        with self.assertNumQueries(2):
+            self.client.get("/api/invoices/?page=1")
+
+        other = User.objects.create_user(username="other")
+        self.client.force_authenticate(other)
+        with self.assertNumQueries(2):
+            self.client.get("/api/invoices/")
+
+    def test_searches_follow_customer_renames(self):
+        self.create_invoice()
+        for url in ("/api/invoices/", "/api/analytics/invoices"):
+            with self.subTest(url=url):
+                self.customer.name = "Test Customer"
+                self.customer.save()
+                self.assertTrue(self.client.get(f"{url}?search=test").data["results"])
+
+                self.customer.name = "Renamed Customer"
+                self.customer.save()
+                self.assertEqual(
+                    self.client.get(f"{url}?search=test").data["results"], []
+                )
+                self.assertTrue(
+                    self.client.get(f"{url}?search=renamed").data["results"]
+                )
+
+    def test_conditional_requests(self):
+        self.create_invoice()
+        response = self.client.get("/api/dashboard")
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(
+                "/api/dashboard", HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(not_modified.status_code, 304)
+        not_modified = self.client.get(
+            "/api/dashboard", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.create_invoice(supplier=self.supplier)
+        modified = self.client.get(
+            "/api/dashboard", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(modified.data["alltime_supplier_stats"]["count"], 1)
+
+
+class SeedDbTests(TestCase):
+    def seed(self, **options):
+        options = {
+            "users": 4,
+            "suppliers": 2,
+            "admins": 1,
+            "days": 3,
+            "invoices_per_day": 7,
+            "seed": 42,
+            "batch_size": 5,
+            **options,
+        }
+        call_command("seed_db", **options)
+
+    def test_seed_db(self):
+        self.seed()
+
+        self.assertEqual(Customer.objects.count(), 4)
+        self.assertEqual(Supplier.objects.count(), 2)
+        self.assertEqual(Invoice.objects.count(), 21)
+        self.assertEqual(Group.objects.get(name="CUSTOMER").user_set.count(), 4)
+        self.assertEqual(
+            User.objects.filter(username="superuser", is_superuser=True).count(), 1
+        )
+
+        fields = ("month", "side", "status", "count", "total", "total_squares")
+        rollups = list(InvoiceMonthlyRollup.objects.values(*fields))
+        rebuild_monthly_rollups()
+        self.assertEqual(list(InvoiceMonthlyRollup.objects.values(*fields)), rollups)
+        self.assertEqual(sum(rollup["count"] for rollup in rollups), 21)
+        self.assertEqual(set(reconcile_balances(fix=False).values()), {0})
+        customer = Customer.objects.first()
+        self.assertEqual(customer.email_normalized, customer.email.lower())
+
+    def test_seed_db_is_deterministic(self):
+        fields = ("amount", "status", "date")
+        self.seed()
+        first = list(Invoice.objects.order_by("id").values_list(*fields))
+        Invoice.all_objects.hard_delete()
+        for model in (Customer, Supplier):
+            model.objects.all().delete()
+        User.objects.exclude(username="superuser").delete()
+        # Seeded on another day.
+        later = datetime.now(timezone.utc) + timedelta(days=2)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.seed()
+        second = list(Invoice.objects.order_by("id").values_list(*fields))
+        self.assertEqual(first, second)
+        self.assertEqual(max(date for _, _, date in first).date(), SEED_END_DATE)
+
+    def test_end_date(self):
+        self.seed(end_date=SEED_END_DATE - timedelta(days=10))
+        dates = Invoice.objects.values_list("date", flat=True)
+        self.assertEqual(max(dates).date(), SEED_END_DATE - timedelta(days=10))
+        self.assertEqual(min(dates).date(), SEED_END_DATE - timedelta(days=12))
+
+    def test_invalid_options(self):
+        with self.assertRaisesMessage(CommandError, "--days must be at least 1."):
+            self.seed(days=0)
+        with self.assertRaisesMessage(CommandError, "no customers or suppliers"):
+            self.seed(users=0, suppliers=0)
+        # Supplier invoices only.
+        self.seed(users=0)
+        self.assertFalse(Invoice.objects.filter(customer__isnull=False).exists())
+        self.assertEqual(Invoice.objects.count(), 21)
+
+
+class BenchmarkTests(InvoicingTestCase):
+    def test_scenarios(self):
+        self.create_invoice()
+        benchmark = Benchmark(self.client, self.user, repeat=3, warmup=1)
+        for run in SCENARIOS.values():
+            run(benchmark)
+
+        result = benchmark.results["GET /api/dashboard"]
+        self.assertEqual(result["rounds"], 3)
+        self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+        self.assertGreater(result["throughput_rps"], 0)
+        self.assertLess(
+            benchmark.results["GET /api/dashboard (cached)"]["queries"],
+            result["queries"],
+        )
+
+    def test_compare_results(self):
+        def results(p50_ms, queries):
+            return {
+                "scales": {
+                    "small": {
+                        "results": {"list": {"p50_ms": p50_ms, "queries": queries}}
+                    }
+                }
+            }
+
+        baseline = results(10.0, 3)
+        self.assertEqual(compare_results(baseline, results(11.0, 3), 0.2), [])
+        self.assertEqual(len(compare_results(baseline, results(13.0, 3), 0.2)), 1)
+        self.assertEqual(len(compare_results(baseline, results(10.0, 4), 0.2)), 1)
+
+
+class RequestMetricsTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_server_timing(self):
+        self.create_invoice()
+        response = self.client.get("/api/invoices/")
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$',
+        )
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/invoices/")
+        self.assertEqual(self.client.get("/api/metrics").status_code, 403)
+
+        admin = User.objects.create_superuser(username="admin")
+        self.client.force_authenticate(admin)
+        response = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        content = response.content.decode()
+        self.assertIn(
+            'invoicing_requests_total{view="invoice-list",method="GET",status="200"} 1',
+            content,
+        )
+        self.assertIn(
+            'invoicing_request_duration_seconds_bucket{view="invoice-list",'
+            'method="GET",le="+Inf"} 1',
+            content,
+        )
+        self.assertIn("# TYPE invoicing_request_queries histogram", content)
+
+    def test_slow_request_log(self):
+        self.create_invoice()
+        with mock.patch("invoicing.middleware.INVOICING_SLOW_REQUEST_MS", 0):
+            with self.assertLogs("invoicing.requests", "WARNING") as logs:
+                self.client.get("/api/invoices/")
+        self.assertIn("Slow request GET /api/invoices/ (invoice-list)", logs.output[0])
+        self.assertIn('FROM "invoicing_invoice"', logs.output[0])
+
+
+class AsyncViewTests(InvoicingTestCase):
+    async def test_async_views_render_like_sync_views(self):
+        await self.async_client.aforce_login(self.user)
+        for _ in range(12):
+            await sync_to_async(self.create_invoice)()
+        await sync_to_async(self.create_invoice)(supplier=self.supplier)
+
+        for sync_url, async_url in (
+            ("/api/dashboard", "/api/async/dashboard"),
+            ("/api/invoices/?cursor=", "/api/async/invoices/"),
+            ("/api/customers/?cursor=", "/api/async/customers/"),
+            ("/api/suppliers/?cursor=", "/api/async/suppliers/"),
+        ):
+            expected = (await sync_to_async(self.client.get)(sync_url)).json()
+            response = await self.async_client.get(async_url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            if "next" in expected:
+                self.assertEqual(data["results"], expected["results"])
+                self.assertEqual(data["next"] is None, expected["next"] is None)
+            else:
+                self.assertEqual(data, expected)
+
+    async def test_async_list_pages(self):
+        await self.async_client.aforce_login(self.user)
+        for _ in range(15):
+            await sync_to_async(self.create_invoice)()
+
+        response = await self.async_client.get("/api/async/invoices/")
+        self.assertIn("db;dur=", response["Server-Timing"])
+        first = response.json()
+        self.assertEqual(len(first["results"]), 10)
+        second = (await self.async_client.get(first["next"])).json()
+        self.assertEqual(len(second["results"]), 5)
+        self.assertIsNone(second["next"])
+        urls = [invoice["url"] for invoice in first["results"] + second["results"]]
+        self.assertEqual(len(set(urls)), 15)
+
+        response = await self.async_client.get("/api/async/invoices/?cursor=bad")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_views_require_authentication(self):
+        response = await self.async_client.get("/api/async/dashboard")
+        self.assertEqual(response.status_code, 403)
+
+
+class InvoiceAnalyticsTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_customer = Customer.objects.create(
+            user=self.user, name="Other Customer"
+        )
+        for day, amount, status in ((3, "10.00", "paid"), (20, "30.00", "pending")):
+            self.create_invoice(
+                date=datetime(2026, 1, day, tzinfo=timezone.utc),
+                amount=Decimal(amount),
+                status=status,
+            )
+        self.create_invoice(
+            customer=self.other_customer,
+            date=datetime(2026, 2, 5, tzinfo=timezone.utc),
+            amount=Decimal("100.00"),
+        )
+        self.create_invoice(
+            supplier=self.supplier,
+            date=datetime(2026, 2, 6, tzinfo=timezone.utc),
+            amount=Decimal("500.00"),
+        )
+
+    def get(self, query):
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/analytics/invoices?{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.data["results"]
+
+    def test_buckets(self):
+        self.assertEqual(
+            self.get("bucket=month&side=customer"),
+            [
+                {
+                    "bucket": "2026-01-01",
+                    "count": 2,
+                    "total": "40.00",
+                    "average": "20.00",
+                },
+                {
+                    "bucket": "2026-02-01",
+                    "count": 1,
+                    "total": "100.00",
+                    "average": "100.00",
+                },
+            ],
+        )
+        quarters = self.get("bucket=quarter")
+        self.assertEqual([row["count"] for row in quarters], [4])
+        days = self.get("bucket=day&date_from=2026-01-10T00:00:00Z")
+        self.assertEqual(
+            [row["bucket"] for row in days], ["2026-01-20", "2026-02-05", "2026-02-06"]
+        )
+
+    def test_group_by(self):
+        rows = self.get("bucket=month&group_by=status&date_to=2026-02-01T00:00:00Z")
+        self.assertEqual(
+            [(row["status"], row["total"]) for row in rows],
+            [("paid", "10.00"), ("pending", "30.00")],
+        )
+        rows = self.get("bucket=quarter&group_by=supplier")
+        self.assertEqual(rows[0]["supplier"], self.supplier.pk)
+        self.assertEqual(len(rows), 1)
+
+    def test_top_customers(self):
+        rows = self.get("bucket=quarter&group_by=customer&top=1")
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["customer"], self.other_customer.pk)
+        rows = self.get("bucket=quarter&group_by=customer&top=2")
+        self.assertEqual(len(rows), 2)
+
+    def test_invalid_options(self):
+        for query in ("bucket=year", "top=3", "group_by=status&top=3", "top=0"):
+            response = self.client.get(f"/api/analytics/invoices?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+
+class InvoiceBalanceTests(InvoicingTestCase):
+    def assertBalance(self, party, count, total, outstanding, last_invoice_date):
+        party.refresh_from_db()
+        self.assertEqual(
+            (
+                party.invoice_count,
+                party.invoice_total,
+                party.outstanding_total,
+                party.last_invoice_date,
+            ),
+            (count, Decimal(total), Decimal(outstanding), last_invoice_date),
+        )
+
+    def assertReconciled(self):
+        self.assertEqual(set(reconcile_balances(fix=False).values()), {0})
+
+    def test_balances_follow_invoice_changes(self):
+        first_date = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        last_date = datetime(2026, 2, 1, tzinfo=timezone.utc)
+        first = self.create_invoice(amount=Decimal("10.00"), date=first_date)
+        last = self.create_invoice(
+            amount=Decimal("5.00"), date=last_date, status="paid"
+        )
+        self.assertBalance(self.customer, 2, "15.00", "10.00", last_date)
+
+        response = self.client.patch(
+            f"/api/invoices/{first.pk}/",
+            {"amount": "12.00", "status": "paid"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertBalance(self.customer, 2, "17.00", "0.00", last_date)
+
+        other = Customer.objects.create(user=self.user, name="Other")
+        last.customer = other
+        last.save()
+        self.assertBalance(self.customer, 1, "12.00", "0.00", first_date)
+        self.assertBalance(other, 1, "5.00", "0.00", last_date)
+
+        first.refresh_from_db()
+        first.delete()
+        self.assertBalance(self.customer, 0, "0.00", "0.00", None)
+
+        self.create_invoice(supplier=self.supplier, amount=Decimal("7.00"))
+        self.assertEqual(Supplier.objects.get().invoice_count, 1)
+        self.assertReconciled()
+
+    def test_bulk_writes_update_balances(self):
+        invoice = self.create_invoice(amount=Decimal("5.00"))
+        customer_url = f"http://testserver/api/customers/{self.customer.pk}/"
+        rows = [{"customer": customer_url, "amount": "1.50"} for _ in range(4)]
+        rows.append(
+            {"url": f"http://testserver/api/invoices/{invoice.pk}/", "status": "paid"}
+        )
+        response = self.client.post("/api/invoices/bulk/", rows, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.invoice_count, 5)
+        self.assertEqual(self.customer.invoice_total, Decimal("11.00"))
+        self.assertEqual(self.customer.outstanding_total, Decimal("6.00"))
+        self.assertReconciled()
+
+    def test_serializers_expose_read_only_balances(self):
+        self.create_invoice(amount=Decimal("3.00"))
+        url = f"/api/customers/{self.customer.pk}/"
+        self.assertEqual(self.client.get(url).data["invoice_total"], "3.00")
+
+        self.client.patch(url, {"invoice_count": 100}, format="json")
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.invoice_count, 1)
+        data = self.client.get(f"/api/suppliers/{self.supplier.pk}/").data
+        self.assertEqual(data["invoice_count"], 0)
+
+    def test_reconcile_balances(self):
+        self.create_invoice(amount=Decimal("3.00"))
+        Customer.objects.update(invoice_count=7)
+
+        out = io.StringIO()
+        call_command("reconcile_balances", dry_run=True, stdout=out)
+        self.assertIn("1 drifted customers found.", out.getvalue())
+        self.assertEqual(Customer.objects.get().invoice_count, 7)
+
+        call_command("reconcile_balances", stdout=io.StringIO())
+        self.assertEqual(Customer.objects.get().invoice_count, 1)
+        self.assertReconciled()
+
+    def test_reconcile_locks_the_balances_first(self):
+        self.create_invoice()
+        Customer.objects.update(invoice_count=7)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(reconcile_balances(batch_size=1)[Customer], 1)
+        # Locked before the invoices are read, an invoice written in between
+        # would have its increment overwritten.
+        queries = [query["sql"] for query in context.captured_queries]
+        read = next(
+            index
+            for index, sql in enumerate(queries)
+            if sql.startswith("SELECT") and '"invoicing_invoice"' in sql
+        )
+        self.assertTrue(
+            any(
+                sql.startswith('UPDATE "invoicing_customer"') or "FOR UPDATE" in sql
+                for sql in queries[:read]
+            )
+        )
+        self.assertReconciled()
+
+
+class DatabaseSettingsTests(TestCase):
+    @skipUnless(connection.vendor == "sqlite", "SQLite pragmas")
+    def test_sqlite_pragmas(self):
+        def busy_timeout():
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA busy_timeout")
+                return cursor.fetchone()[0]
+
+        previous = busy_timeout()
+        pragmas = {"busy_timeout": previous + 1234}
+        with mock.patch("invoicing.signals.INVOICING_SQLITE_PRAGMAS", pragmas):
+            configure_connection(sender=type(connection), connection=connection)
+        try:
+            self.assertEqual(busy_timeout(), previous + 1234)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA busy_timeout = {previous}")
+
+    def test_production_settings(self):
+        environ = {"DJANGO_SECRET_KEY": "secret", "DJANGO_ALLOWED_HOSTS": "a.com,b.com"}
+        with mock.patch.dict(os.environ, environ):
+            production = runpy.run_module("project.settings_production")
+        self.assertFalse(production["DEBUG"])
+        self.assertEqual(production["ALLOWED_HOSTS"], ["a.com", "b.com"])
+        database = production["DATABASES"]["default"]
+        self.assertEqual(database["CONN_MAX_AGE"], 60)
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+        self.assertEqual(production["INVOICING_SQLITE_PRAGMAS"]["journal_mode"], "WAL")
+
+        environ.update(DJANGO_DB_ENGINE="postgresql", DJANGO_CONN_MAX_AGE="0")
+        with mock.patch.dict(os.environ, environ):
+            production = runpy.run_module("project.settings_production")
+        database = production["DATABASES"]["default"]
+        self.assertEqual(database["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+        self.assertFalse(database["DISABLE_SERVER_SIDE_CURSORS"])
+
+
+class ReplicaRoutingTests(InvoicingTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            "invoicing.views.mixins.INVOICING_REPLICA_ALIAS", "replica"
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The replica test database is a separate, empty, database.
+        Customer.objects.using("replica").create(name="Replica Customer")
+
+    def names(self, response):
+        return [customer["name"] for customer in response.data["results"]]
+
+    def test_reads_go_to_the_replica(self):
+        self.create_invoice()
+        self.assertEqual(
+            self.names(self.client.get("/api/customers/")), ["Replica Customer"]
+        )
+        self.assertEqual(self.client.get("/api/invoices/").data["count"], 0)
+        dashboard = self.client.get("/api/dashboard").data
+        self.assertEqual(dashboard["alltime_stats"]["count"], 0)
+        self.assertIsNone(read_database.get())
+
+        # Responses read from the replica are cached apart.
+        with mock.patch("invoicing.views.mixins.INVOICING_REPLICA_ALIAS", None):
+            self.assertEqual(self.client.get("/api/invoices/").data["count"], 1)
+
+    def test_session_authentication_reads_the_primary(self):
+        # The replica has neither the session nor the user.
+        self.client = APIClient()
+        self.client.force_login(self.user)
+        response = self.client.get("/api/customers/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.names(response), ["Replica Customer"])
+
+    def test_reads_after_writes_stay_on_the_primary(self):
+        response = self.client.post(
+            "/api/customers/",
+            {"name": "New Customer", "email": "new@ocg.com"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Customer.objects.using("replica").count(), 1)
+        cookie = response.cookies["invoicing_primary"]
+        self.assertEqual(cookie["max-age"], 10)
+
+        self.assertEqual(
+            self.names(self.client.get("/api/customers/")),
+            ["New Customer", "Test Customer"],
+        )
+
+        # The replica may lag behind the write: its responses are not cached
+        # until the sticky period has passed.
+        self.client.cookies.clear()
+        for _ in range(2):
+            with CaptureQueriesContext(connections["replica"]) as queries:
+                self.assertEqual(
+                    self.names(self.client.get("/api/customers/")),
+                    ["Replica Customer"],
+                )
+            self.assertTrue(queries)
+        with mock.patch("invoicing.cache.INVOICING_STICKY_SECONDS", 0):
+            self.client.get("/api/customers/")
+        with self.assertNumQueries(0, using="replica"):
+            self.client.get("/api/customers/")
+
+
+class FastJSONTests(InvoicingTestCase):
+    data = {
+        "amount": Decimal("123456789.01"),
+        "date": datetime(2025, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        "name": "Café\u2028",
+        1: [None, True, 1.5],
+    }
+
+    def test_renderer(self):
+        content = FastJSONRenderer().render(self.data)
+        self.assertIn(b"\\u2028", content)
+        # A number, like `JSONRenderer` renders it.
+        self.assertEqual(json.loads(content)["amount"], 123456789.01)
+        self.assertEqual(
+            json.loads(content), json.loads(JSONRenderer().render(self.data))
+        )
+        self.assertEqual(json.loads(content)["date"], "2025-03-01T12:30:15.123456Z")
+        with mock.patch("invoicing.renderers.orjson", None):
+            self.assertEqual(FastJSONRenderer().render(self.data), content)
+
+        indented = FastJSONRenderer().render(self.data, "application/json; indent=4")
+        self.assertEqual(json.loads(indented), json.loads(content))
+        self.assertIn(b'\n    "amount"', indented)
+
+    def test_parser(self):
+        content = b'{"amount": 12.34, "rows": [1, "a\\u00e9"]}'
+        for orjson in (parsers.orjson, None):
+            with (
+                self.subTest(orjson=orjson),
+                mock.patch("invoicing.parsers.orjson", orjson),
+            ):
+                data = FastJSONParser().parse(io.BytesIO(content))
+                self.assertEqual(Decimal(str(data["amount"])), Decimal("12.34"))
+                self.assertEqual(data["rows"], [1, "aé"])
+                with self.assertRaises(ParseError):
+                    FastJSONParser().parse(io.BytesIO(b'{"amount": '))
+
+        with mock.patch("invoicing.parsers.orjson", None):
+            data = FastJSONParser().parse(io.BytesIO(content))
+        self.assertEqual(data["amount"], Decimal("12.34"))
+
+    def test_api(self):
+        response = self.client.post(
+            "/api/invoices/",
+            json.dumps(
+                {
+                    "customer": f"http://testserver/api/customers/{self.customer.pk}/",
+                    "amount": 1234.56,
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()["amount"], "1234.56")
+        self.assertEqual(Invoice.objects.get().amount, Decimal("1234.56"))
+
+
+class JobTests(InvoicingTestCase):
+    url = "/api/jobs/"
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+        self.enterContext(
+            mock.patch("invoicing.jobs.INVOICING_EXPORT_ROOT", export_root.name)
+        )
+
+    def run_worker(self):
+        call_command("run_worker", processes=0, burst=True, stdout=io.StringIO())
+
+    def test_export_job(self):
+        for _ in range(3):
+            self.create_invoice()
+        self.create_invoice(status="paid")
+        data = {"name": "export", "params": {"status": "pending"}}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data["status"], "queued")
+        self.assertEqual(
+            response.data["params"], {"status": "pending", "export_format": "csv"}
+        )
+        download_url = f"{response.data['url']}download/"
+        self.assertEqual(self.client.get(download_url).status_code, 404)
+
+        self.run_worker()
+        job = self.client.get(response.data["url"]).data
+        self.assertEqual(job["status"], "succeeded", job["error"])
+        self.assertEqual((job["progress_done"], job["progress_total"]), (3, 3))
+        self.assertEqual(job["result"]["rows"], 3)
+        self.assertEqual(job["result"]["url"], urlparse(download_url).path)
+        # Written out of the media directory.
+        self.assertFalse(default_storage.exists(job["result"]["file"]))
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(len(response.getvalue().splitlines()), 4)
+
+        admin = User.objects.create_user(username="admin", is_staff=True)
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.client.get(download_url).status_code, 200)
+        other = User.objects.create_user(username="other")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(download_url).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(download_url).status_code, 403)
+
+    def test_validation(self):
+        for data in (
+            {"name": "nope"},
+            {"name": "export", "params": {"export_format": "xml"}},
+            {"name": "rebuild_rollups", "params": {"full": True}},
+            # Staff only.
+            {"name": "rebuild_rollups"},
+        ):
+            with self.subTest(data=data):
+                response = self.client.post(self.url, data, format="json")
+                self.assertEqual(response.status_code, 400)
+
+        admin = User.objects.create_user(username="admin", is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.post(
+            self.url, {"name": "reconcile_balances"}, format="json"
+        )
+        self.assertEqual(response.status_code, 202, response.data)
+        self.run_worker()
+        self.assertEqual(Job.objects.get().result, {"customer": 0, "supplier": 0})
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url).data["count"], 0)
+
+    def test_retries(self):
+        def fail(job):
+            raise ValueError("Boom")
+
+        self.enterContext(
+            mock.patch.dict(JOB_HANDLERS, {"fail": JobHandler(fail, None, False)})
+        )
+        job = enqueue("fail", user=self.user, max_attempts=2)
+
+        self.assertEqual(claim_job("test"), job.pk)
+        self.assertIsNone(claim_job("test"))
+        with self.assertLogs("invoicing.jobs", "ERROR"):
+            self.assertEqual(run_job(job.pk), "queued")
+        job.refresh_from_db()
+        self.assertIn("ValueError: Boom", job.error)
+        self.assertGreater(job.run_after, datetime.now(timezone.utc))
+        self.assertIsNone(claim_job("test"))
+
+        Job.objects.update(run_after=datetime.now(timezone.utc))
+        self.assertEqual(claim_job("test"), job.pk)
+        with self.assertLogs("invoicing.jobs", "ERROR"):
+            self.assertEqual(run_job(job.pk), "failed")
+
+        url = f"{self.url}{job.pk}/retry/"
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            (response.data["status"], response.data["attempts"]), ("queued", 0)
+        )
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+    def test_lost_jobs_are_claimed_again(self):
+        job = enqueue("rebuild_rollups")
+        self.assertEqual(claim_job("lost"), job.pk)
+        self.assertIsNone(claim_job("test"))
+        # Long running, but alive.
+        an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+        Job.objects.update(started_at=an_hour_ago)
+        self.assertIsNone(claim_job("test"))
+
+        Job.objects.update(heartbeat_at=an_hour_ago)
+        self.assertEqual(claim_job("test"), job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts), ("test", 2))
+
+    def test_lost_jobs_are_not_finished_by_their_first_worker(self):
+        job = enqueue("rebuild_rollups")
+        self.assertEqual(claim_job("lost"), job.pk)
+        an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+        Job.objects.update(heartbeat_at=an_hour_ago)
+
+        def run(job):
+            # Claimed again while the first worker still runs it.
+            self.assertEqual(claim_job("test"), job.pk)
+            return {}
+
+        handler = JobHandler(run, None, False)
+        self.enterContext(mock.patch.dict(JOB_HANDLERS, {"rebuild_rollups": handler}))
+        with self.assertLogs("invoicing.jobs", "WARNING"):
+            self.assertEqual(run_job(job.pk), "running")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ("running", "test"))
+        self.assertIsNone(job.finished_at)
+
+        with self.assertLogs("invoicing.jobs", "WARNING"):
+            self.assertEqual(fail_job(job.pk, "Boom", "lost"), "running")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ("running", ""))
+
+    def test_heartbeat(self):
+        job = enqueue("rebuild_rollups")
+        claim_job("test")
+        job.refresh_from_db()
+        beats = []
+
+        def update(**kwargs):
+            beats.append(kwargs["heartbeat_at"])
+            return 1
+
+        jobs = mock.Mock()
+        jobs.filter.return_value.update.side_effect = update
+        # The thread runs outside the test transaction, its queries are mocked.
+        with mock.patch("invoicing.jobs.INVOICING_JOB_HEARTBEAT_INTERVAL", 0.01):
+            with mock.patch.object(Job, "objects", jobs):
+                with heartbeat(job):
+                    time.sleep(0.1)
+        self.assertGreater(len(beats), 1)
+        jobs.filter.assert_called_with(pk=job.pk, status="running", worker="test")
+
+    def test_crashed_processes_are_replaced(self):
+        job = enqueue("rebuild_rollups")
+        pools = []
+
+        class CrashingPool:
+            def __init__(self, *args, **kwargs):
+                pools.append(self)
+
+            def submit(self, func, *args):
+                future = Future()
+                future.set_exception(BrokenProcessPool("A process died."))
+                return future
+
+            def shutdown(self, wait=True):
+                pass
+
+        with mock.patch(
+            "invoicing.management.commands.run_worker.ProcessPoolExecutor",
+            CrashingPool,
+        ):
+            call_command("run_worker", processes=2, burst=True, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+        self.assertIn("BrokenProcessPool: A process died.", job.error)
+        self.assertEqual(len(pools), 2)
+
+
+class IdempotencyTests(InvoicingTestCase):
+    url = "/api/invoices/"
+
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.data = {
+            "customer": f"http://testserver/api/customers/{self.customer.pk}/",
+            "amount": "42.00",
+        }
+
+    def post(self, data, key, url=None):
+        return self.client.post(
+            url or self.url, data, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retries_replay_the_response(self):
+        response = self.post(self.data, "abc")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+        with self.assertNumQueries(1):
+            retry = self.post(self.data, "abc")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(Invoice.objects.count(), 1)
+
+        self.assertEqual(
+            self.post({**self.data, "amount": "43.00"}, "abc").status_code, 422
+        )
+        self.assertEqual(self.post(self.data, "def").status_code, 201)
+        self.assertEqual(
+            self.client.post(self.url, self.data, format="json").status_code, 201
+        )
+        self.assertEqual(Invoice.objects.count(), 3)
+
+        other = User.objects.create_user(username="other")
+        self.client.force_authenticate(other)
+        self.assertNotIn("Idempotent-Replayed", self.post(self.data, "abc"))
+
+    def test_failures_are_not_stored(self):
+        response = self.post({"amount": "nope"}, "abc")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post(self.data, "abc").status_code, 201)
+
+    def test_in_progress_and_expired_keys(self):
+        self.post(self.data, "abc")
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.post(self.data, "abc").status_code, 409)
+
+        IdempotencyKey.objects.update(
+            expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)
+        )
+        self.assertEqual(self.post(self.data, "abc").status_code, 201)
+        self.assertNotEqual(IdempotencyKey.objects.get().pk, record.pk)
+
+        IdempotencyKey.objects.update(
+            expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)
+        )
+        self.assertEqual(purge_idempotency_keys(), 1)
+
+    def test_abandoned_attempts_are_taken_over(self):
+        self.post(self.data, "abc")
+        # The first attempt crashed before storing its response.
+        IdempotencyKey.objects.update(
+            status_code=None,
+            created_at=datetime.now(timezone.utc) - timedelta(minutes=10),
+        )
+        response = self.post(self.data, "abc")
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Invoice.objects.count(), 2)
+        self.assertEqual(self.post(self.data, "abc")["Idempotent-Replayed"], "true")
+
+    def test_bulk(self):
+        rows = [self.data, {**self.data, "amount": "1.00"}]
+        response = self.post(rows, "bulk", url="/api/invoices/bulk/")
+        self.assertEqual(response.status_code, 201, response.data)
+        retry = self.post(rows, "bulk", url="/api/invoices/bulk/")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.json(), response.json())
+        self.assertEqual(Invoice.objects.count(), 2)
+
+
+class IngestionThrottleTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.enterContext(mock.patch.object(InvoiceIngestionThrottle, "capacity", 3))
+        self.enterContext(mock.patch.object(InvoiceIngestionThrottle, "rate", 0.5))
+
+    def test_token_bucket(self):
+        customer_url = f"http://testserver/api/customers/{self.customer.pk}/"
+        row = {"customer": customer_url, "amount": "1.00"}
+
+        response = self.client.post("/api/invoices/bulk/", [row, row], format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            self.client.post("/api/invoices/", row, format="json").status_code, 201
+        )
+        response = self.client.post("/api/invoices/", row, format="json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+        # Reads are not throttled.
+        self.assertEqual(self.client.get("/api/invoices/").status_code, 200)
+
+        with mock.patch("invoicing.throttling.time.time", return_value=time.time() + 2):
+            response = self.client.post("/api/invoices/", row, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_idempotent_retries_are_free(self):
+        customer_url = f"http://testserver/api/customers/{self.customer.pk}/"
+        rows = [{"customer": customer_url, "amount": "1.00"}] * 3
+
+        def post(key):
+            return self.client.post(
+                "/api/invoices/bulk/", rows, format="json", HTTP_IDEMPOTENCY_KEY=key
+            )
+
+        self.assertEqual(post("abc").status_code, 201)
+        for _ in range(3):
+            retry = post("abc")
+            self.assertEqual(retry.status_code, 201)
+            self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(post("def").status_code, 429)
+
+
+class AdminTests(QueryCountAssertionMixin, InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_superuser(username="admin", password="pass")
+        self.client.force_login(admin)
+
+    def populate(self, size):
+        for index in range(Invoice.objects.count(), size):
+            user = User.objects.create_user(username=f"party{index}")
+            if index % 2:
+                self.create_invoice(supplier=Supplier.objects.create(user=user))
+            else:
+                customer = Customer.objects.create(
+                    user=user, name=f"Customer {index}", email=f"c{index}@ocg.com"
+                )
+                self.create_invoice(customer=customer, status="paid")
+
+    def test_changelist_query_count(self):
+        urls = (
+            "/admin/invoicing/invoice/",
+            "/admin/invoicing/invoice/?status__exact=paid&side=customer",
+            "/admin/invoicing/invoice/?q=cust",
+            "/admin/invoicing/customer/",
+            "/admin/invoicing/supplier/",
+            "/admin/invoicing/invoice/add/",
+        )
+        counts = {url: [] for url in urls}
+        for size in (0, 10, 60):
+            self.populate(size)
+            for url in urls:
+                counts[url].append(self.count_queries(url)[0])
+        # The first requests fill the content type cache.
+        counts = {url: url_counts[1:] for url, url_counts in counts.items()}
+
+        for url, url_counts in counts.items():
+            with self.subTest(url=url):
+                self.assertEqual(len(set(url_counts)), 1, f"{url} ran {url_counts}")
+
+    def test_changelist_counts_are_bounded(self):
+        self.populate(30)
+        with mock.patch.object(EstimatedCountPaginator, "count_limit", 10):
+            for url, count in (
+                ("/admin/invoicing/customer/", Customer.objects.count()),
+                # The deleted invoices are filtered out.
+                ("/admin/invoicing/invoice/", 10),
+                ("/admin/invoicing/invoice/?status__exact=paid", 10),
+                ("/admin/invoicing/invoice/?side=supplier", 10),
+            ):
+                with self.subTest(url=url):
+                    with CaptureQueriesContext(connection) as context:
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.context["cl"].result_count, count)
+                    for query in context.captured_queries:
+                        if "COUNT(" in query["sql"]:
+                            self.assertIn("LIMIT", query["sql"])
+
+    @skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite specific.")
+    def test_date_filter_uses_date_index(self):
+        self.populate(10)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                "/admin/invoicing/invoice/",
+                {
+                    "date__gte": "2025-01-01T00:00:00+00:00",
+                    "date__lt": "2025-02-01T00:00:00+00:00",
+                },
+            )
+        self.assertEqual(response.status_code, 200)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if '"invoicing_invoice"' in query["sql"]:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plans.append(" | ".join(row[-1] for row in cursor.fetchall()))
+        # The count and the page.
+        self.assertEqual(len(plans), 2, plans)
+        for plan in plans:
+            self.assertIn("INDEX invoicing_invoice_date_idx (date>? AND date<?)", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_search(self):
+        self.populate(6)
+        response = self.client.get("/admin/invoicing/invoice/?q=customer 4")
+        self.assertEqual(
+            [invoice.customer.name for invoice in response.context["cl"].result_list],
+            ["Customer 4"],
+        )
+        response = self.client.get("/admin/invoicing/customer/?q=C2@OCG")
+        self.assertEqual(
+            [customer.name for customer in response.context["cl"].result_list],
+            ["Customer 2"],
+        )
+
+
+@mock.patch("invoicing.thumbnails.INVOICING_THUMBNAIL_WORKERS", 0)
+class ThumbnailTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.thumbnails = os.path.join(media_root.name, "thumbnails")
+
+    def image(self, color="red", size=(600, 400), name="image.png"):
+        output = io.BytesIO()
+        Image.new("RGB", size, color).save(output, "PNG")
+        return SimpleUploadedFile(name, output.getvalue(), content_type="image/png")
+
+    def upload(self, url, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {"image": image}, format="multipart")
+        self.assertEqual(response.status_code, 200, response.data)
+        return self.client.get(url).data
+
+    def variant_files(self):
+        return sorted(
+            os.path.join(os.path.basename(directory), name)
+            for directory, _, names in os.walk(self.thumbnails)
+            for name in names
+        )
+
+    def test_upload_generates_variants(self):
+        data = self.upload(f"/api/customers/{self.customer.pk}/", self.image())
+
+        digest = Customer.objects.get().image_digest
+        self.assertEqual(len(digest), 64)
+        self.assertEqual(
+            data["thumbnails"],
+            {
+                size: f"http://testserver/media/thumbnails/{digest[:2]}/{digest}-{size}.webp"
+                for size in ("64", "256")
+            },
+        )
+        with Image.open(
+            os.path.join(self.thumbnails, digest[:2], f"{digest}-256.webp")
+        ) as image:
+            self.assertEqual((image.format, image.size), ("WEBP", (256, 171)))
+        with Image.open(
+            os.path.join(self.thumbnails, digest[:2], f"{digest}-64.webp")
+        ) as image:
+            self.assertEqual(image.size, (64, 43))
+
+        list_data = self.client.get("/api/customers/").data["results"][0]
+        self.assertEqual(list_data["thumbnails"], data["thumbnails"])
+
+    def test_identical_images_share_variants(self):
+        customer = self.upload(f"/api/customers/{self.customer.pk}/", self.image())
+        files = self.variant_files()
+        supplier = self.upload(
+            f"/api/suppliers/{self.supplier.pk}/", self.image(name="other.png")
+        )
+        self.assertEqual(supplier["thumbnails"], customer["thumbnails"])
+        self.assertEqual(self.variant_files(), files)
+
+    def test_replaced_image_clears_the_digest_until_generated(self):
+        self.upload(f"/api/customers/{self.customer.pk}/", self.image())
+        customer = Customer.objects.get()
+        customer.image = self.image("blue")
+        with mock.patch("invoicing.models.schedule_thumbnails") as schedule:
+            customer.save()
+        schedule.assert_called_once_with(customer)
+        self.assertEqual(Customer.objects.get().image_digest, "")
+
+    def test_least_recently_generated_variants_are_evicted(self):
+        self.upload(f"/api/customers/{self.customer.pk}/", self.image("red"))
+        self.upload(f"/api/suppliers/{self.supplier.pk}/", self.image("blue"))
+        customer_digest = Customer.objects.get().image_digest
+        supplier_digest = Supplier.objects.get().image_digest
+        # The customer variants were generated last.
+        old = time.time() - 60
+        for name in self.variant_files():
+            if name.split("/")[1].startswith(supplier_digest):
+                os.utime(os.path.join(self.thumbnails, name), (old, old))
+
+        size = sum(
+            os.path.getsize(os.path.join(self.thumbnails, name))
+            for name in self.variant_files()
+            if name.split("/")[1].startswith(customer_digest)
+        )
+        self.assertEqual(prune_thumbnails(size), {supplier_digest})
+        self.assertEqual(Supplier.objects.get().image_digest, "")
+        self.assertEqual(Customer.objects.get().image_digest, customer_digest)
+        self.assertEqual(len(self.variant_files()), 2)
+
+        run_job(enqueue("generate_thumbnails").pk)
+        self.assertEqual(Supplier.objects.get().image_digest, supplier_digest)
+
+    def test_invalid_images_are_skipped(self):
+        customer = Customer.objects.get()
+        Customer.objects.filter(pk=customer.pk).update(image="missing.png")
+        customer.refresh_from_db()
+        with self.assertLogs("invoicing.thumbnails", "WARNING"):
+            self.assertFalse(generate_thumbnails(customer))
+        self.assertEqual(Customer.objects.get().image_digest, "")
+
+        # Remote images, as stored by `seed_db`, have no thumbnails.
+        customer.image = "https://robohash.org/customer"
+        self.assertFalse(generate_thumbnails(customer))
+
+    def test_thumbnails_are_generated_in_the_thread_pool(self):
+        customer = Customer.objects.get()
+        customer.image = self.image()
+        with mock.patch("invoicing.thumbnails.INVOICING_THUMBNAIL_WORKERS", 2):
+            with mock.patch("invoicing.thumbnails.get_executor") as get_executor:
+                with self.captureOnCommitCallbacks(execute=True):
+                    customer.save()
+        get_executor.return_value.submit.assert_called_once_with(
+            _generate_thumbnails_task, "invoicing.Customer", customer.pk
+        )
+
+
+def read_npz(path):
+    """
+    Decode the columns of an `.npz` file written by `invoicing.columnar`.
+    """
+    columns = {}
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            data = archive.read(name)
+            (header_length,) = struct.unpack("<H", data[8:10])
+            header = ast.literal_eval(data[10 : 10 + header_length].decode())
+            body, (length,) = data[10 + header_length :], header["shape"]
+            if header["descr"].startswith("<U"):
+                width = int(header["descr"][2:]) * 4
+                values = [
+                    body[index : index + width].decode("utf-32-le").rstrip("\0")
+                    for index in range(0, len(body), width)
+                ]
+            else:
+                values = list(struct.unpack(f"<{length}q", body))
+            columns[name.removesuffix(".npy")] = values
+    return columns
+
+
+class ColumnarSnapshotTests(InvoicingTestCase):
+    def setUp(self):
+        super().setUp()
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        self.output = Path(output.name)
+        self.create_invoice(
+            amount=Decimal("10.25"), date=datetime(2025, 1, 5, tzinfo=timezone.utc)
+        )
+        self.create_invoice(
+            supplier=self.supplier,
+            amount=Decimal("3.00"),
+            date=datetime(2025, 2, 1, tzinfo=timezone.utc),
+        )
+        self.create_invoice(
+            amount=Decimal("7.10"), date=datetime(2025, 1, 20, tzinfo=timezone.utc)
+        )
+
+    def snapshot(self, *args):
+        stdout = io.StringIO()
+        call_command(
+            "snapshot_invoices",
+            str(self.output),
+            "--chunk-size",
+            "2",
+            *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def manifest(self):
+        return json.loads((self.output / "_manifest.json").read_text())
+
+    def read_rows(self):
+        rows = []
+        for part in self.manifest()["parts"]:
+            columns = read_npz(self.output / part["path"])
+            rows += zip(*(columns[name] for name in self.manifest()["columns"]))
+        return sorted(rows)
+
+    def test_snapshot_is_partitioned_by_month(self):
+        self.assertIn("Wrote 3 invoices", self.snapshot("--format", "npz"))
+
+        manifest = self.manifest()
+        invoices = list(Invoice.objects.order_by("id"))
+        self.assertEqual(manifest["max_id"], invoices[-1].pk)
+        self.assertEqual(
+            [(part["path"], part["rows"]) for part in manifest["parts"]],
+            [
+                (f"month=2025-01/part-{invoices[0].pk}-{invoices[0].pk}.npz", 1),
+                (f"month=2025-02/part-{invoices[1].pk}-{invoices[1].pk}.npz", 1),
+                (f"month=2025-01/part-{invoices[2].pk}-{invoices[2].pk}.npz", 1),
+            ],
+        )
+        epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(
+            self.read_rows()[:2],
+            [
+                (
+                    invoices[0].pk,
+                    (invoices[0].date - epoch) // timedelta(microseconds=1),
+                    "pending",
+                    1025,
+                    self.customer.pk,
+                    "Test Customer",
+                    0,
+                    "",
+                ),
+                (
+                    invoices[1].pk,
+                    (invoices[1].date - epoch) // timedelta(microseconds=1),
+                    "pending",
+                    300,
+                    0,
+                    "",
+                    self.supplier.pk,
+                    "Test Er",
+                ),
+            ],
+        )
+
+    def test_snapshots_are_incremental(self):
+        self.snapshot("--format", "npz")
+        self.assertIn("Wrote 0 invoices", self.snapshot())
+
+        invoice = self.create_invoice(date=datetime(2025, 3, 1, tzinfo=timezone.utc))
+        # A part left by an interrupted snapshot.
+        leftover = self.output / "month=2025-03" / "part-1-1.npz"
+        leftover.parent.mkdir()
+        leftover.write_bytes(b"")
+
+        with self.assertNumQueries(1):
+            self.assertIn("Wrote 1 invoices", self.snapshot())
+        self.assertFalse(leftover.exists())
+        self.assertEqual(self.manifest()["max_id"], invoice.pk)
+        self.assertEqual(len(self.manifest()["parts"]), 4)
+        self.assertEqual([row[0] for row in self.read_rows()][-1], invoice.pk)
+
+        # An interrupted full snapshot leaves the previous one untouched.
+        building = self.output.with_name(f"{self.output.name}.building")
+        replaced = self.output.with_name(f"{self.output.name}.replaced")
+        self.addCleanup(shutil.rmtree, building, ignore_errors=True)
+
+        def write_one_part(path, columns):
+            if list(building.glob("month=*/*")):
+                raise KeyboardInterrupt
+            columnar.write_npz(path, columns)
+
+        with (
+            mock.patch.dict(columnar.SNAPSHOT_FORMATS, {"npz": write_one_part}),
+            self.assertRaises(KeyboardInterrupt),
+        ):
+            self.snapshot("--full", "--format", "npz")
+        self.assertEqual(len(self.manifest()["parts"]), 4)
+        self.assertEqual(len(self.read_rows()), 4)
+
+        self.snapshot("--full", "--format", "npz")
+        self.assertEqual(len(self.read_rows()), 4)
+        self.assertFalse(building.exists())
+        self.assertFalse(replaced.exists())
+        self.assertEqual(
+            sorted(
+                path.relative_to(self.output).as_posix()
+                for path in self.output.glob("month=*/*")
+            ),
+            sorted(part["path"] for part in self.manifest()["parts"]),
+        )
+
+    @skipUnless(columnar.pyarrow is None, "pyarrow is installed.")
+    def test_parquet_requires_pyarrow(self):
+        with self.assertRaisesMessage(CommandError, "require pyarrow"):
+            self.snapshot("--format", "parquet")
+
+    @skipUnless(columnar.pyarrow is not None, "pyarrow is not installed.")
+    def test_parquet_snapshot(self):
+        self.snapshot("--format", "parquet")
+        table = columnar.pyarrow.parquet.read_table(
+            self.output / self.manifest()["parts"][1]["path"]
+        )
+        self.assertEqual(table.column("supplier_name").to_pylist(), ["Test Er"])
+        self.assertEqual(table.column("customer_id").to_pylist(), [None])
@@ -0,0 +1,79 @@
+import time
+
+from rest_framework.throttling import BaseThrottle
+
+from invoicing.cache import get_cache
+from invoicing.idempotency import is_replay
+from invoicing.settings import INVOICING_INGESTION_BURST, INVOICING_INGESTION_RATE
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Per-user token bucket holding up to `capacity` tokens, refilled at `rate`
+    tokens per second. Requests consume `get_cost()` tokens, so that clients
+    can burst and then keep a steady pace, where fixed windows would reject
+    them until the window ends.
+
+    The bucket state is kept in the response cache, which must be shared by
+    the processes serving the API for the limit to hold across them. Reads
+    and writes of a bucket are not atomic, concurrent requests of a user may
+    let a few extra tokens through.
+    """
+
+    scope = None
+    rate = None
+    capacity = None
+
+    def get_cost(self, request, view):
+        return 1
+
+    def get_cache_key(self, request, view):
+        return f"invoicing:throttle:{self.scope}:{request.user.pk}"
+
+    def allow_request(self, request, view):
+        if not request.user.is_authenticated:
+            return True
+
+        cost = self.get_cost(request, view)
+        if cost <= 0:
+            return True
+
+        cache = get_cache()
+        key = self.get_cache_key(request, view)
+        now = time.time()
+        tokens, updated_at = cache.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+        # Requests costing more than the capacity can never pass, let them
+        # through once the bucket is full rather than reject them forever.
+        cost = min(cost, self.capacity)
+        if tokens < cost:
+            self.wait_seconds = (cost - tokens) / self.rate
+            return False
+
+        timeout = (self.capacity - tokens + cost) / self.rate + 1
+        cache.set(key, (tokens - cost, now), timeout)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class InvoiceIngestionThrottle(TokenBucketThrottle):
+    """
+    Limit the number of invoices a user creates or updates through the API,
+    one token per row of bulk requests. Retries answered with the stored
+    response of an `Idempotency-Key` write nothing and are free.
+    """
+
+    scope = "invoice_ingestion"
+    rate = INVOICING_INGESTION_RATE
+    capacity = INVOICING_INGESTION_BURST
+    actions = ("create", "bulk")
+
+    def get_cost(self, request, view):
+        if view.action not in self.actions or is_replay(request):
+            return 0
+        if view.action == "bulk" and isinstance(request.data, list):
+            return len(request.data)
+        return 1
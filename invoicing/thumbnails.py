@@ -0,0 +1,220 @@
+"""
+Image thumbnails.
+
+Once an uploaded customer or supplier image is committed, it is resized to
+every size of `INVOICING_THUMBNAIL_SIZES` in a background thread pool, Pillow
+releasing the GIL while it decodes and resamples. The WebP variants are stored
+under `MEDIA_ROOT/thumbnails`, named after the SHA-256 digest of the original
+image, so that identical images share them, and the digest is saved with the
+image.
+
+The least recently generated or reused variants, by modification time, are
+evicted once they take more than `INVOICING_THUMBNAIL_CACHE_SIZE` bytes, and
+the digest is cleared from the images using them; the `generate_thumbnails` job
+creates them again. This is not a least recently used eviction: the variants
+are served from `MEDIA_ROOT` by the web server, which does not record reads.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from invoicing.cache import bump_versions
+from invoicing.settings import (
+    INVOICING_THUMBNAIL_CACHE_SIZE,
+    INVOICING_THUMBNAIL_QUALITY,
+    INVOICING_THUMBNAIL_SIZES,
+    INVOICING_THUMBNAIL_WORKERS,
+)
+
+logger = logging.getLogger("invoicing.thumbnails")
+
+# Models having an `image` and an `image_digest`.
+THUMBNAILED_MODELS = ("invoicing.Customer", "invoicing.Supplier")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_storage():
+    return FileSystemStorage(
+        location=Path(settings.MEDIA_ROOT) / "thumbnails",
+        base_url=f"{settings.MEDIA_URL}thumbnails/",
+        # Concurrent uploads of an image write the same variants.
+        allow_overwrite=True,
+    )
+
+
+def variant_name(digest, size):
+    return f"{digest[:2]}/{digest}-{size}.webp"
+
+
+def variant_urls(digest):
+    """
+    Return the URLs of the variants of the image with the given digest, by size.
+    """
+    storage = get_storage()
+    return {
+        str(size): storage.url(variant_name(digest, size))
+        for size in INVOICING_THUMBNAIL_SIZES
+    }
+
+
+def is_local_image(image):
+    # `seed_db` stores remote URLs rather than files.
+    return bool(image) and "://" not in image.name
+
+
+def generate_variants(file):
+    """
+    Store the variants of the image in `file` and return its digest. Variants
+    already stored are reused, which refreshes their modification time.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+
+    storage = get_storage()
+    missing = []
+    for size in INVOICING_THUMBNAIL_SIZES:
+        name = variant_name(digest, size)
+        if storage.exists(name):
+            os.utime(storage.path(name))
+        else:
+            missing.append(size)
+    if not missing:
+        return digest
+
+    file.seek(0)
+    with Image.open(file) as image:
+        # JPEG images are decoded at the smallest scale covering the largest
+        # variant, then every variant is resized from the previous one.
+        image.draft("RGB", (max(missing), max(missing)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        for size in sorted(missing, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, "WEBP", quality=INVOICING_THUMBNAIL_QUALITY)
+            storage.save(variant_name(digest, size), ContentFile(output.getvalue()))
+    return digest
+
+
+def prune_thumbnails(max_size=None):
+    """
+    Evict the least recently generated or reused variants until they take at
+    most `max_size` bytes, `INVOICING_THUMBNAIL_CACHE_SIZE` by default, and
+    return the digests of the evicted images.
+    """
+    if max_size is None:
+        max_size = INVOICING_THUMBNAIL_CACHE_SIZE
+    root = Path(get_storage().location)
+    if not root.exists():
+        return set()
+
+    images = {}
+    total = 0
+    for path in root.glob("*/*.webp"):
+        stat = path.stat()
+        digest = path.name.split("-", 1)[0]
+        paths, size, used_at = images.get(digest, ([], 0, 0))
+        images[digest] = (
+            [*paths, path],
+            size + stat.st_size,
+            max(used_at, stat.st_mtime),
+        )
+        total += stat.st_size
+
+    evicted = set()
+    for digest, (paths, size, _) in sorted(images.items(), key=lambda item: item[1][2]):
+        if total <= max_size:
+            break
+        for path in paths:
+            path.unlink(missing_ok=True)
+        total -= size
+        evicted.add(digest)
+
+    if evicted:
+        for label in THUMBNAILED_MODELS:
+            model = apps.get_model(label)
+            if model.objects.filter(image_digest__in=evicted).update(image_digest=""):
+                bump_versions(model._meta.label_lower)
+    return evicted
+
+
+def generate_thumbnails(instance):
+    """
+    Generate the variants of the image of `instance` and save its digest.
+    Return whether they were generated.
+    """
+    image = instance.image
+    if not is_local_image(image):
+        return False
+    try:
+        with image.open("rb"):
+            digest = generate_variants(image)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Can not generate thumbnails of %s.", image.name, exc_info=True)
+        return False
+
+    model = type(instance)
+    # The image may have been replaced in the meantime.
+    if model.objects.filter(pk=instance.pk, image=image.name).update(
+        image_digest=digest
+    ):
+        instance.image_digest = digest
+        bump_versions(model._meta.label_lower)
+    return True
+
+
+def _generate_thumbnails_task(label, pk):
+    try:
+        instance = apps.get_model(label).objects.filter(pk=pk).first()
+        if instance is not None and generate_thumbnails(instance):
+            prune_thumbnails()
+    except Exception:
+        logger.exception("Thumbnails of %s #%s failed.", label, pk)
+    finally:
+        if INVOICING_THUMBNAIL_WORKERS:
+            # Pool threads hold their own connections.
+            connections.close_all()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                INVOICING_THUMBNAIL_WORKERS, thread_name_prefix="thumbnails"
+            )
+    return _executor
+
+
+def schedule_thumbnails(instance):
+    """
+    Generate the thumbnails of the image of `instance` in the background, once
+    the current transaction commits.
+    """
+    args = (instance._meta.label, instance.pk)
+
+    def submit():
+        if INVOICING_THUMBNAIL_WORKERS:
+            get_executor().submit(_generate_thumbnails_task, *args)
+        else:
+            _generate_thumbnails_task(*args)
+
+    transaction.on_commit(submit)
@@ -15,12 +15,29 @@ router.register(r"groups", views.GroupViewSet)
 router.register(r"customers", views.CustomerViewSet)
 router.register(r"suppliers", views.SupplierViewSet)
 router.register(r"invoices", views.InvoiceViewSet)
+router.register(r"jobs", views.JobViewSet)
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     path("", include(router.urls)),
     path("dashboard", views.Dashboard.as_view()),
+    path("analytics/invoices", views.InvoiceAnalytics.as_view()),
+    path("metrics", views.Metrics.as_view()),
+    path("async/dashboard", views.AsyncDashboard.as_view(), name="async-dashboard"),
+    path(
+        "async/customers/",
+        views.AsyncCustomerList.as_view(),
+        name="async-customer-list",
+    ),
+    path(
+        "async/suppliers/",
+        views.AsyncSupplierList.as_view(),
+        name="async-supplier-list",
+    ),
+    path(
+        "async/invoices/", views.AsyncInvoiceList.as_view(), name="async-invoice-list"
+    ),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
 ]
 
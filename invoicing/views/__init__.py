@@ -4,5 +4,14 @@ from .views import (
     CustomerViewSet,
     SupplierViewSet,
     InvoiceViewSet,
+    JobViewSet,
 )
 from .dashboard_views import Dashboard
+from .analytics_views import InvoiceAnalytics
+from .metrics_views import Metrics
+from .async_views import (
+    AsyncDashboard,
+    AsyncCustomerList,
+    AsyncSupplierList,
+    AsyncInvoiceList,
+)
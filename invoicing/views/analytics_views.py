@@ -0,0 +1,46 @@
+from drf_spectacular.utils import extend_schema, inline_serializer
+from rest_framework import permissions, serializers
+from rest_framework.views import APIView, Response, status
+
+from invoicing.analytics import invoice_analytics
+from invoicing.cache import cached_response
+from invoicing.serializers import (
+    InvoiceAnalyticsSerializer,
+    InvoiceAnalyticsRowSerializer,
+)
+from invoicing.views.mixins import ReplicaReadMixin
+
+
+class InvoiceAnalytics(ReplicaReadMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    # `search` matches the names and emails of the customers.
+    cache_dependencies = ("invoicing.invoice", "invoicing.customer")
+
+    @extend_schema(
+        parameters=[InvoiceAnalyticsSerializer],
+        responses=inline_serializer(
+            "InvoiceAnalytics",
+            {
+                "bucket": serializers.CharField(),
+                "group_by": serializers.CharField(allow_null=True),
+                "results": InvoiceAnalyticsRowSerializer(many=True),
+            },
+        ),
+    )
+    @cached_response
+    def get(self, request, *args, **kwargs):
+        """
+        Invoice count, total and average amount per day, week, month or
+        quarter, optionally grouped by status, customer or supplier.
+        """
+        serializer = InvoiceAnalyticsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+
+        rows = invoice_analytics(**options)
+        data = {
+            "bucket": options["bucket"],
+            "group_by": options.get("group_by"),
+            "results": InvoiceAnalyticsRowSerializer(rows, many=True).data,
+        }
+        return Response(data, status.HTTP_200_OK)
@@ -0,0 +1,167 @@
+"""
+ASGI-native, read-only versions of the dashboard and list endpoints.
+
+DRF views are synchronous, so these are plain Django async views built on the
+async ORM: under an ASGI server a request waiting on the database only frees
+the event loop for other requests. The queries themselves are not faster: the
+async ORM runs them with `sync_to_async(thread_sensitive=True)`, one at a time
+in a single thread. They render the same data as their DRF counterparts, list
+pages are always keyset paginated and only session authentication is
+supported.
+"""
+
+import asyncio
+from datetime import datetime
+
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from invoicing.models import Customer, Invoice, Supplier
+from invoicing.pagination import KeysetPageNumberPagination
+from invoicing.renderers import FastJSONRenderer
+from invoicing.serializers import CustomerListSerializer, InvoiceSerializer
+from invoicing.serializers.invoicing_serializers import SupplierSerializer
+from invoicing.views.dashboard_views import (
+    build_dashboard_data,
+    get_monthly_stats_queryset,
+    get_side_stats_aggregates,
+    get_side_stats_queryset,
+)
+from invoicing.views.mixins import OptimizedQuerySetMixin, get_sparse_fieldset_kwargs
+
+
+class AsyncAPIView(View):
+    """
+    Async view rendering JSON like DRF, for authenticated users only.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return self.render(
+                {"detail": "Authentication credentials were not provided."},
+                status=403,
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+    renderer = FastJSONRenderer()
+
+    def render(self, data, status=200):
+        return HttpResponse(
+            self.renderer.render(data),
+            status=status,
+            content_type=self.renderer.media_type,
+        )
+
+
+class AsyncDashboard(AsyncAPIView):
+    async def get(self, request, *args, **kwargs):
+        """
+        Collect the dashboard metrics. The queries are awaited together but
+        still run one after the other, see the module docstring.
+        """
+        year = datetime.now().year
+
+        async def monthly_stats():
+            queryset = get_monthly_stats_queryset(year)
+            return [stat async for stat in queryset]
+
+        alltime_stats, alltime_supplier_stats, invoice_stats = await asyncio.gather(
+            get_side_stats_queryset("customer").aaggregate(
+                **get_side_stats_aggregates()
+            ),
+            get_side_stats_queryset("supplier").aaggregate(
+                **get_side_stats_aggregates()
+            ),
+            monthly_stats(),
+        )
+        return self.render(
+            build_dashboard_data(alltime_stats, alltime_supplier_stats, invoice_stats)
+        )
+
+
+class AsyncListView(OptimizedQuerySetMixin, AsyncAPIView):
+    """
+    Keyset paginated list of `queryset`, rendered with `serializer_class`
+    and supporting the `fields` and `links` parameters of the DRF lists.
+    """
+
+    queryset = None
+    serializer_class = None
+    keyset_ordering = ("-pk",)
+    action = "list"
+
+    def get_serializer_class(self):
+        return self.serializer_class
+
+    def get_serializer_context(self):
+        return {"request": self.request}
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(get_sparse_fieldset_kwargs(self.request.GET))
+        return self.get_serializer_class()(
+            *args, context=self.get_serializer_context(), **kwargs
+        )
+
+    def get_queryset(self):
+        return self.optimize_queryset(self.queryset.all())
+
+    async def get(self, request, *args, **kwargs):
+        pagination = KeysetPageNumberPagination()
+        fields = pagination.get_keyset_fields(self.queryset.model, self.keyset_ordering)
+        try:
+            position = pagination.parse_cursor(
+                request.GET.get(pagination.cursor_query_param), fields
+            )
+            queryset = self.get_queryset().order_by(*self.keyset_ordering)
+        except NotFound as exc:
+            return self.render({"detail": exc.detail}, status=exc.status_code)
+        except ValidationError as exc:
+            return self.render(exc.detail, status=exc.status_code)
+
+        if position is not None:
+            queryset = queryset.filter(
+                pagination.keyset_filter(self.keyset_ordering, fields, position)
+            )
+
+        page_size = api_settings.PAGE_SIZE
+        results = [obj async for obj in queryset[: page_size + 1]]
+        page = results[:page_size]
+
+        next_link = None
+        if len(results) > page_size:
+            cursor = pagination.encode_cursor(
+                [field.value_from_object(page[-1]) for field in fields]
+            )
+            next_link = replace_query_param(
+                request.build_absolute_uri(), pagination.cursor_query_param, cursor
+            )
+
+        # The queryset is shaped after the serializer, rendering runs no query.
+        serializer = self.get_serializer(page, many=True)
+        return self.render(
+            {"next": next_link, "previous": None, "results": serializer.data}
+        )
+
+
+class AsyncCustomerList(AsyncListView):
+    queryset = Customer.objects.all()
+    serializer_class = CustomerListSerializer
+    keyset_ordering = ("name", "id")
+
+
+class AsyncSupplierList(AsyncListView):
+    queryset = Supplier.objects.all()
+    serializer_class = SupplierSerializer
+    keyset_ordering = ("id",)
+
+
+class AsyncInvoiceList(AsyncListView):
+    queryset = Invoice.objects.all()
+    serializer_class = InvoiceSerializer
+    keyset_ordering = ("-date", "-id")
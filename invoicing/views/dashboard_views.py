@@ -1,68 +1,104 @@
-from datetime import datetime
+from datetime import date, datetime
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
-from django.db.models.functions import TruncMonth
-from django.db.models import Avg, Sum, Count
+from django.db.models import Q, Sum
 
-from invoicing.models import Customer, Invoice
+from invoicing.cache import cached_response
+from invoicing.models import InvoiceMonthlyRollup
+from invoicing.views.mixins import ReplicaReadMixin
 from rest_framework.views import APIView, Response, status
 
 User = get_user_model()
 
 
-class Dashboard(APIView):
-    def get(self, *args, **kwargs):
-        """
-        Collect some metrics for the dashboard.
-        """
+def get_side_stats_queryset(side):
+    return InvoiceMonthlyRollup.objects.filter(side=side)
 
-        # Get all-time stats
-        alltime_stats = Invoice.objects.filter(supplier__isnull=True).aggregate(
-            count=Count("id"),
-            total_amount=Sum("amount"),
-        )
-        alltime_stats = {
-            "count": alltime_stats["count"],
-            "sum": alltime_stats["total_amount"],
-        }
 
-        # Get all-time supplier stats
-        alltime_supplier_stats = Invoice.objects.filter(
-            customer__isnull=True
-        ).aggregate(
-            count=Count("id"),
-            total_amount=Sum("amount"),
+def get_side_stats_aggregates():
+    return {
+        "count": Sum("count", default=0),
+        "total_amount": Sum("total"),
+        "outstanding": Sum("total", filter=Q(status="pending"), default=0),
+    }
+
+
+def get_monthly_stats_queryset(year):
+    customer, supplier = Q(side="customer"), Q(side="supplier")
+    return (
+        # A range the month index can seek on.
+        InvoiceMonthlyRollup.objects.filter(
+            month__gte=date(year, 1, 1),
+            month__lt=date(year + 1, 1, 1),
+        )
+        .values("month")
+        .annotate(
+            count=Sum("count", filter=customer, default=0),
+            total_amount=Sum("total", filter=customer),
+            supplier_total=Sum("total", filter=supplier, default=0),
+            outstanding=Sum("total", filter=customer & Q(status="pending"), default=0),
         )
-        alltime_supplier_stats = {
-            "count": alltime_supplier_stats["count"],
-            "sum": alltime_supplier_stats["total_amount"],
+        .filter(count__gt=0)
+        .order_by("month")
+    )
+
+
+def build_dashboard_data(alltime_stats, alltime_supplier_stats, invoice_stats):
+    """
+    Shape the results of the dashboard queries into the response data.
+    """
+    alltime_stats = {
+        "count": alltime_stats["count"],
+        "sum": alltime_stats["total_amount"],
+        "outstanding": alltime_stats["outstanding"],
+    }
+    alltime_supplier_stats = {
+        "count": alltime_supplier_stats["count"],
+        "sum": alltime_supplier_stats["total_amount"],
+        "outstanding": alltime_supplier_stats["outstanding"],
+    }
+
+    monthly_invoice_stats = {}
+    for stat in invoice_stats:
+        stats = {
+            "count": stat["count"],
+            "sum": stat["total_amount"],
+            "avg": stat["total_amount"] / stat["count"],
+            "supplier_sum": stat["supplier_total"],
+            "profit": stat["total_amount"] - stat["supplier_total"],
+            "outstanding": stat["outstanding"],
         }
+        monthly_invoice_stats[stat["month"].strftime("%m-%Y")] = stats
+
+    return {
+        "monthly_invoice_stats": monthly_invoice_stats,
+        "alltime_stats": alltime_stats,
+        "alltime_supplier_stats": alltime_supplier_stats,
+        "alltime_profit": (alltime_stats["sum"] or 0)
+        - (alltime_supplier_stats["sum"] or 0),
+    }
+
+
+class Dashboard(ReplicaReadMixin, APIView):
+    cache_dependencies = ("invoicing.invoice",)
+
+    @cached_response
+    def get(self, *args, **kwargs):
+        """
+        Collect some metrics for the dashboard.
 
-        # Get invoice stats per month
-        invoice_stats = (
-            Invoice.objects.filter(
-                supplier__isnull=True, date__year=datetime.now().year
-            )
-            .annotate(month=TruncMonth("date"))
-            .values("month")
-            .annotate(
-                count=Count("id"), total_amount=Sum("amount"), average=Avg("amount")
-            )
-            .order_by("month")
+        The metrics are read from the pre-aggregated `InvoiceMonthlyRollup`
+        table, kept up to date by every invoice write, rather than by scanning
+        the invoice table.
+        """
+        year = datetime.now().year
+        data = build_dashboard_data(
+            get_side_stats_queryset("customer").aggregate(
+                **get_side_stats_aggregates()
+            ),
+            get_side_stats_queryset("supplier").aggregate(
+                **get_side_stats_aggregates()
+            ),
+            get_monthly_stats_queryset(year),
         )
-        monthly_invoice_stats = {}
-        for stat in invoice_stats:
-            stats = {
-                "count": stat["count"],
-                "sum": stat["total_amount"],
-                "avg": stat["average"],
-            }
-            monthly_invoice_stats[stat["month"].strftime("%m-%Y")] = stats
-
-        data = {
-            "monthly_invoice_stats": monthly_invoice_stats,
-            "alltime_stats": alltime_stats,
-            "alltime_supplier_stats": alltime_supplier_stats,
-            "alltime_profit": alltime_stats["sum"] - alltime_supplier_stats["sum"],
-        }
         return Response(data, status.HTTP_200_OK)
@@ -0,0 +1,21 @@
+from drf_spectacular.utils import OpenApiTypes, extend_schema
+from rest_framework import permissions
+from rest_framework.views import APIView, Response
+
+from invoicing.metrics import registry
+from invoicing.renderers import PrometheusRenderer
+
+
+class Metrics(APIView):
+    """
+    Per-view request metrics in the Prometheus text format.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    @extend_schema(responses={(200, "text/plain"): OpenApiTypes.STR})
+    def get(self, request, *args, **kwargs):
+        response = Response(registry.render())
+        response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+        return response
@@ -0,0 +1,223 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ProtectedError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import ManyRelatedField
+from rest_framework.serializers import BaseSerializer
+
+from invoicing.routers import read_database
+from invoicing.settings import (
+    INVOICING_REPLICA_ALIAS,
+    INVOICING_STICKY_COOKIE,
+    INVOICING_STICKY_SECONDS,
+)
+
+
+class OptimizedQuerySetMixin:
+    """
+    Shape the queryset of read actions after the fields the serializer renders.
+
+    Concrete columns the serializer does not render are deferred with `only()`,
+    relations it renders nested are joined with `select_related()` and
+    to-many relations are loaded with `prefetch_related()`, so the number of
+    queries does not depend on the page size.
+    """
+
+    optimized_actions = ("list", "retrieve")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in self.optimized_actions:
+            return queryset
+        return self.optimize_queryset(queryset)
+
+    def optimize_queryset(self, queryset):
+        only, select_related, prefetch_related = self.get_queryset_plan(queryset.model)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if only is not None:
+            queryset = queryset.only(*only)
+        return queryset
+
+    def get_queryset_plan(self, model):
+        """
+        Return the `only`, `select_related` and `prefetch_related` arguments
+        matching the serializer of the current action. `only` is `None` when
+        a rendered attribute can not be mapped to model fields.
+        """
+        serializer = self.get_serializer()
+        only = {model._meta.pk.name}
+        # The paginator reads the keyset of the last row of the page, which
+        # may be ordered on any of the `ordering_fields`.
+        only.update(
+            name.lstrip("-")
+            for name in getattr(self, "keyset_ordering", ())
+            if name.lstrip("-") != "pk"
+        )
+        only.update(getattr(self, "ordering_fields", ()))
+        select_related, prefetch_related = set(), set()
+        reverse_accessors = {
+            relation.get_accessor_name() for relation in model._meta.related_objects
+        }
+
+        for field in serializer.fields.values():
+            if field.write_only or not field.source_attrs:
+                # `source="*"` fields, like `url`, only need the primary key.
+                continue
+
+            name = field.source_attrs[0]
+            if name in reverse_accessors:
+                # Reverse relations, like `customer_set`, are loaded from the
+                # primary key of the rows.
+                prefetch_related.add(name)
+                continue
+
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                model_field = None
+
+            if model_field is None or model_field.name != name:
+                # Properties, methods and reverse relations accessors.
+                only = None
+                if isinstance(field, ManyRelatedField):
+                    prefetch_related.add(name)
+                continue
+
+            if model_field.many_to_many or model_field.one_to_many:
+                prefetch_related.add(name)
+            elif model_field.is_relation and model_field.concrete:
+                if isinstance(field, BaseSerializer) or len(field.source_attrs) > 1:
+                    select_related.add(name)
+                if only is not None:
+                    only.add(name)
+            elif only is not None:
+                only.add(name)
+
+        return only, select_related, prefetch_related
+
+
+def get_sparse_fieldset_kwargs(query_params):
+    """
+    Return the `fields` and `links` arguments of `SparseFieldsetMixin`
+    serializers requested in `query_params`.
+    """
+    kwargs = {}
+    fields = query_params.get("fields")
+    if fields is not None:
+        kwargs["fields"] = [name for name in fields.split(",") if name]
+    links = query_params.get("links")
+    if links:
+        kwargs["links"] = links
+    return kwargs
+
+
+class ActionSerializerMixin:
+    """
+    Render each action with its serializer of `action_serializer_classes`,
+    falling back to `serializer_class`.
+
+    Serializers of the `sparse_actions` get the fields listed in the `fields`
+    query parameter, e.g. `?fields=url,amount`, and relations rendered as
+    primary keys rather than URLs with `?links=ids`.
+    """
+
+    action_serializer_classes = {}
+    sparse_actions = ("list", "retrieve")
+
+    def get_serializer_class(self):
+        serializer_class = self.action_serializer_classes.get(self.action)
+        if serializer_class is not None:
+            return serializer_class
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.sparse_actions:
+            kwargs.update(get_sparse_fieldset_kwargs(self.request.GET))
+        return super().get_serializer(*args, **kwargs)
+
+
+class ReplicaReadMixin:
+    """
+    Serve the `replica_actions` of a view from `INVOICING_REPLICA_ALIAS`.
+
+    Responses to successful writes set a cookie keeping the client on the
+    primary for `INVOICING_STICKY_SECONDS`, so that it reads its own writes.
+    Views without actions, like `APIView`s, read every safe request from
+    the replica. Requests are authenticated against the primary.
+    """
+
+    replica_actions = ("list", "retrieve")
+
+    def use_replica(self, request):
+        if INVOICING_REPLICA_ALIAS is None or request.method not in SAFE_METHODS:
+            return False
+        if INVOICING_STICKY_COOKIE in request.COOKIES:
+            return False
+        action = getattr(self, "action", None)
+        return action is None or action in self.replica_actions
+
+    def initial(self, request, *args, **kwargs):
+        # Authenticated, permission checked and throttled on the primary: a
+        # lagging replica may not have the session of a user who just logged in.
+        super().initial(request, *args, **kwargs)
+        if self.use_replica(request):
+            self._read_database_token = read_database.set(INVOICING_REPLICA_ALIAS)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            token = self.__dict__.pop("_read_database_token", None)
+            if token is not None:
+                read_database.reset(token)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (
+            INVOICING_REPLICA_ALIAS is not None
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            response.set_cookie(
+                INVOICING_STICKY_COOKIE,
+                "1",
+                max_age=INVOICING_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The request conflicts with the current state of the resource."
+    default_code = "conflict"
+
+
+class ProtectedDeleteMixin:
+    """
+    Answer the deletion of an object still referenced through a protected
+    foreign key with a `409 Conflict`, rather than a server error.
+
+    Deleted invoices count as references until they are purged, see
+    `invoicing.changes.purge_tombstones`.
+    """
+
+    def perform_destroy(self, instance):
+        try:
+            super().perform_destroy(instance)
+        except ProtectedError as error:
+            referencing = sorted(
+                {
+                    str(obj._meta.verbose_name_plural).lower()
+                    for obj in error.protected_objects
+                }
+            )
+            raise Conflict(
+                f"This {str(instance._meta.verbose_name).lower()} can not be deleted while "
+                f"{', '.join(referencing)} refer to it."
+            )
@@ -1,31 +1,90 @@
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
 
-from rest_framework import permissions, viewsets
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
-from invoicing.models import Customer, Invoice, Supplier
+from invoicing.cache import CachedResponseMixin
+from invoicing.changes import (
+    CHANGE_TOKEN_HEADER,
+    get_changes_until,
+    get_resume_token,
+    iter_changes,
+)
+from invoicing.exports import EXPORT_FORMATS, export_invoices
+from invoicing.filters import IndexedOrderingFilter, InvoiceFilterBackend
+from invoicing.idempotency import IDEMPOTENCY_HEADER, idempotent
+from invoicing.jobs import JOB_HANDLERS, get_export_storage
+from invoicing.models import Customer, Invoice, Job, Supplier
+from invoicing.pagination import KeysetPageNumberPagination
+from invoicing.parsers import FastJSONParser, NDJSONParser
 from invoicing.serializers import (
     InvoiceSerializer,
+    InvoiceBulkSerializer,
+    InvoiceExportSerializer,
+    InvoiceChangesSerializer,
+    InvoiceFilterSerializer,
     CustomerSerializer,
+    CustomerListSerializer,
     UserSerializer,
+    UserListSerializer,
     GroupSerializer,
+    JobSerializer,
+    JobCreateSerializer,
 )
 from invoicing.serializers.invoicing_serializers import SupplierSerializer
+from invoicing.settings import (
+    INVOICE_BULK_BATCH_SIZE,
+    INVOICE_BULK_MAX_BATCH_SIZE,
+    INVOICE_BULK_MAX_ROWS,
+    INVOICE_EXPORT_CHUNK_SIZE,
+)
+from invoicing.throttling import InvoiceIngestionThrottle
+from invoicing.views.mixins import (
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    ProtectedDeleteMixin,
+    ReplicaReadMixin,
+)
 
 User = get_user_model()
 
+IDEMPOTENCY_PARAMETER = OpenApiParameter(
+    IDEMPOTENCY_HEADER,
+    location=OpenApiParameter.HEADER,
+    description="Unique key of the request, its retries get the same response.",
+)
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class UserViewSet(
+    ReplicaReadMixin,
+    ProtectedDeleteMixin,
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    viewsets.ModelViewSet,
+):
     """
     API endpoint that allows users to be viewed or edited.
     """
 
     queryset = User.objects.all().order_by("-date_joined")
     serializer_class = UserSerializer
+    action_serializer_classes = {"list": UserListSerializer}
     permission_classes = [permissions.IsAuthenticated]
 
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(
+    ReplicaReadMixin,
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    viewsets.ModelViewSet,
+):
     """
     API endpoint that allows groups to be viewed or edited.
     """
@@ -35,31 +94,242 @@ class GroupViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(
+    ReplicaReadMixin,
+    ProtectedDeleteMixin,
+    CachedResponseMixin,
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    viewsets.ModelViewSet,
+):
     """
     API endpoint that allows customers to be viewed or edited.
     """
 
-    queryset = Customer.objects.all().order_by("name")
+    queryset = Customer.objects.all().order_by("name", "id")
     serializer_class = CustomerSerializer
+    action_serializer_classes = {"list": CustomerListSerializer}
     permission_classes = [permissions.IsAuthenticated]
+    cache_dependencies = ("invoicing.customer",)
+    pagination_class = KeysetPageNumberPagination
+    keyset_ordering = ("name", "id")
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(
+    ReplicaReadMixin,
+    ProtectedDeleteMixin,
+    CachedResponseMixin,
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    viewsets.ModelViewSet,
+):
     """
     API endpoint that allows suppliers to be viewed or edited.
     """
 
-    queryset = Supplier.objects.all().order_by("user")
+    queryset = Supplier.objects.all().order_by("user", "id")
     serializer_class = SupplierSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_dependencies = ("invoicing.supplier",)
+    pagination_class = KeysetPageNumberPagination
+    # `user` is nullable, which a keyset can not seek on.
+    keyset_ordering = ("id",)
 
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(
+    ReplicaReadMixin,
+    CachedResponseMixin,
+    ActionSerializerMixin,
+    OptimizedQuerySetMixin,
+    viewsets.ModelViewSet,
+):
     """
     API endpoint that allows invoices to be viewed or edited.
     """
 
-    queryset = Invoice.objects.all().order_by("-date")
+    queryset = Invoice.objects.all().order_by("-date", "-id")
     serializer_class = InvoiceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # `search` matches the names and emails of the customers.
+    cache_dependencies = ("invoicing.invoice", "invoicing.customer")
+    pagination_class = KeysetPageNumberPagination
+    keyset_ordering = ("-date", "-id")
+    filter_backends = [InvoiceFilterBackend, IndexedOrderingFilter]
+    filter_serializer_class = InvoiceFilterSerializer
+    ordering_fields = ("date", "amount")
+    throttle_classes = [InvoiceIngestionThrottle]
+
+    @extend_schema(parameters=[IDEMPOTENCY_PARAMETER])
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def get_bulk_batch_size(self):
+        try:
+            batch_size = int(self.request.query_params["batch_size"])
+        except (KeyError, ValueError):
+            return INVOICE_BULK_BATCH_SIZE
+        return max(1, min(batch_size, INVOICE_BULK_MAX_BATCH_SIZE))
+
+    @extend_schema(
+        request=InvoiceBulkSerializer(many=True),
+        responses=InvoiceSerializer(many=True),
+        parameters=[IDEMPOTENCY_PARAMETER],
+    )
+    @action(
+        detail=False,
+        methods=["post"],
+        parser_classes=[FastJSONParser, NDJSONParser],
+        serializer_class=InvoiceBulkSerializer,
+    )
+    @idempotent
+    def bulk(self, request):
+        """
+        Create and update invoices in bulk, from a JSON array or NDJSON lines.
+
+        Rows with an invoice `url` update that invoice, the others create new
+        ones. Nothing is written unless every row is valid, and the rows are
+        written in batches of `?batch_size=` within a single transaction.
+        """
+        context = self.get_serializer_context()
+        context["batch_size"] = self.get_bulk_batch_size()
+        serializer = InvoiceBulkSerializer(
+            data=request.data,
+            many=True,
+            partial=True,
+            max_length=INVOICE_BULK_MAX_ROWS,
+            context=context,
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            invoices = serializer.save()
+
+        data = InvoiceSerializer(invoices, many=True, context=context).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(parameters=[InvoiceExportSerializer], responses={200: bytes})
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Stream the invoices matching the filters as CSV or NDJSON.
+        """
+        serializer = InvoiceExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = dict(serializer.validated_data)
+        export_format = options.pop("export_format")
+
+        response = StreamingHttpResponse(
+            export_invoices(export_format, INVOICE_EXPORT_CHUNK_SIZE, **options),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="invoices.{export_format}"'
+        )
+        return response
+
+    @extend_schema(parameters=[InvoiceChangesSerializer], responses={200: bytes})
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        Stream the invoices created, changed or deleted since the `since`
+        token as NDJSON, in the order they changed.
+
+        Every row carries the `token` to pass as `since` to get the changes
+        after it, deleted invoices have `deleted` set. Once the response is
+        read to the end, the `Change-Token` header resumes after its last row,
+        also when it has none. Changes younger than
+        `INVOICING_CHANGES_SAFETY_WINDOW` seconds are left to the next call.
+        """
+        serializer = InvoiceChangesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        until = get_changes_until()
+        response = StreamingHttpResponse(
+            iter_changes(
+                INVOICE_EXPORT_CHUNK_SIZE, until=until, **serializer.validated_data
+            ),
+            content_type=EXPORT_FORMATS["ndjson"],
+        )
+        response[CHANGE_TOKEN_HEADER] = get_resume_token(
+            until, serializer.validated_data.get("since")
+        )
+        return response
+
+
+class JobViewSet(
+    ActionSerializerMixin,
+    mixins.CreateModelMixin,
+    viewsets.ReadOnlyModelViewSet,
+):
+    """
+    API endpoint that allows background jobs to be enqueued and followed.
+
+    Jobs are run by `manage.py run_worker`. Staff users see every job, other
+    users their own. They are always read from the primary database, where
+    their progress is up to date.
+    """
+
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    action_serializer_classes = {"create": JobCreateSerializer}
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    @extend_schema(request=JobCreateSerializer, responses={202: JobSerializer})
+    def create(self, request, *args, **kwargs):
+        """
+        Enqueue a job, see `invoicing.jobs` for the available ones.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save(user=request.user)
+        data = JobSerializer(job, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    @extend_schema(request=None, responses={202: JobSerializer})
+    @action(detail=True, methods=["post"])
+    def retry(self, request, pk=None):
+        """
+        Enqueue a failed job again, with a fresh set of attempts.
+        """
+        job = self.get_object()
+        if job.status != "failed":
+            raise ValidationError({"status": ["Only failed jobs can be retried."]})
+        handler = JOB_HANDLERS.get(job.name)
+        if handler is None or (handler.admin_only and not request.user.is_staff):
+            raise ValidationError({"name": ["This job can not be retried."]})
+
+        Job.objects.filter(pk=job.pk).update(
+            status="queued",
+            attempts=0,
+            error="",
+            run_after=timezone.now(),
+            started_at=None,
+            finished_at=None,
+        )
+        job.refresh_from_db()
+        data = JobSerializer(job, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    @extend_schema(responses={200: bytes})
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """
+        Download the file written by a succeeded `export` job.
+        """
+        job = self.get_object()
+        storage = get_export_storage()
+        name = (job.result or {}).get("file") if job.name == "export" else None
+        if job.status != "succeeded" or not name or not storage.exists(name):
+            raise NotFound("This job has no file to download.")
+
+        return FileResponse(
+            storage.open(name),
+            as_attachment=True,
+            filename=name,
+            content_type=EXPORT_FORMATS[job.params["export_format"]],
+        )
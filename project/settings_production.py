@@ -0,0 +1,79 @@
+"""
+Production settings, configured with environment variables.
+
+Use with `DJANGO_SETTINGS_MODULE=project.settings_production`. The database
+defaults to the SQLite file of the development settings, tuned for concurrent
+access; set `DJANGO_DB_ENGINE=postgresql` (which requires `psycopg`) to use
+PostgreSQL.
+"""
+
+import os
+
+from invoicing.db import SQLITE_TUNED_PRAGMAS
+from project.settings import *  # noqa: F401,F403
+from project.settings import BASE_DIR
+
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
+SECRET_KEY = os.environ["DJANGO_SECRET_KEY"]
+
+DEBUG = env_bool("DJANGO_DEBUG", False)
+
+ALLOWED_HOSTS = [
+    host for host in os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",") if host
+]
+
+
+# Database
+# Connections are kept open for `CONN_MAX_AGE` seconds rather than opened for
+# every request, and checked before being reused.
+
+DB_ENGINE = os.environ.get("DJANGO_DB_ENGINE", "sqlite3")
+
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DJANGO_DB_NAME", "invoicing"),
+            "USER": os.environ.get("DJANGO_DB_USER", ""),
+            "PASSWORD": os.environ.get("DJANGO_DB_PASSWORD", ""),
+            "HOST": os.environ.get("DJANGO_DB_HOST", ""),
+            "PORT": os.environ.get("DJANGO_DB_PORT", ""),
+            # Exports stream through server-side cursors, which transaction
+            # pooling proxies like PgBouncer do not support.
+            "DISABLE_SERVER_SIDE_CURSORS": env_bool(
+                "DJANGO_DB_DISABLE_SERVER_SIDE_CURSORS", False
+            ),
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DJANGO_DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # Take the write lock when the transaction starts, so that
+                # concurrent writers wait for it rather than deadlock.
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 5,
+            },
+        }
+    }
+
+DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get("DJANGO_CONN_MAX_AGE", 60))
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# PostgreSQL read replica, the primary settings with another host.
+if os.environ.get("DJANGO_REPLICA_DB_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.environ["DJANGO_REPLICA_DB_HOST"],
+        "PORT": os.environ.get("DJANGO_REPLICA_DB_PORT", ""),
+        "TEST": {"MIRROR": "default"},
+    }
+    INVOICING_REPLICA_ALIAS = "replica"
+
+INVOICING_SQLITE_PRAGMAS = SQLITE_TUNED_PRAGMAS